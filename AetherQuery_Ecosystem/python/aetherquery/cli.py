@@ -0,0 +1,381 @@
+"""
+Командная строка AetherQuery: интерактивная оболочка, нагрузочный bench и explain
+
+Запуск:
+    aetherquery shell http://localhost:8000
+    aetherquery bench sqlite:///data.db "SELECT * FROM users WHERE id = 1" -c 8 -d 10
+    aetherquery explain unix:///run/aetherquery.sock "SELECT * FROM orders WHERE user_id = 5"
+
+Цель - адрес сервера (http://, https://, ws://, unix://) или локальная
+база SQLite (sqlite:///path.db) без сервера. Клиент, requests и rich
+импортируются только внутри команд, поэтому `aetherquery --help` стартует быстро.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from typing import Optional, Dict, Any, Iterator, List, Callable
+
+import click
+
+from .exceptions import AetherQueryError, QueryError
+
+HISTORY_FILE = os.path.expanduser('~/.aetherquery_history')
+
+
+class LocalTarget:
+    """Локальная база SQLite с тем же интерфейсом, что и сервер"""
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        import sqlite3
+
+        path = url[len('sqlite://'):]
+        path = path[1:] if path.startswith('/') else path
+        self.name = url
+        self._sqlite3 = sqlite3
+        self._conn = sqlite3.connect(path or ':memory:', timeout=timeout, isolation_level=None)
+
+    def stream(self, sql: str, params: Optional[list] = None, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        try:
+            cursor = self._conn.execute(sql, params or [])
+            if cursor.description is None:
+                return
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [dict(zip(columns, row)) for row in rows]
+        except self._sqlite3.Error as e:
+            raise QueryError(str(e), sql=sql)
+
+    def query(self, sql: str, params: Optional[list] = None) -> List[Dict[str, Any]]:
+        return [row for batch in self.stream(sql, params) for row in batch]
+
+    def explain(self, sql: str, params: Optional[list] = None, analyze: bool = False) -> List[Dict[str, Any]]:
+        # Нормализованный план строит сервер; локально показываем план SQLite как есть
+        return self.query(f"EXPLAIN QUERY PLAN {sql}", params)
+
+    def close(self):
+        self._conn.close()
+
+
+class ServerTarget:
+    """Сервер AetherQuery через AetherClient (одно соединение на всю сессию)"""
+
+    def __init__(self, url: str, api_key: Optional[str] = None, timeout: float = 30.0, transport: str = 'http'):
+        from .client import AetherClient
+
+        if url.startswith(('ws://', 'wss://')):
+            url, transport = 'http' + url[len('ws'):], 'ws'
+        self.name = url
+        self.client = AetherClient(url, api_key=api_key, timeout=timeout, transport=transport)
+
+    @staticmethod
+    def _rows(result: Dict[str, Any], sql: str) -> List[Dict[str, Any]]:
+        if not result.get('success'):
+            raise QueryError(result.get('error') or "Query failed", sql=sql)
+        return result.get('data') or []
+
+    def stream(self, sql: str, params: Optional[list] = None, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        if self.client.transport == 'ws':
+            # По WebSocket строки приходят пачками по мере выполнения
+            yield from self.client.channel.stream(sql, params, batch_size=batch_size)
+            return
+        rows = self._rows(self.client.query(sql, params), sql)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def query(self, sql: str, params: Optional[list] = None) -> List[Dict[str, Any]]:
+        return self._rows(self.client.query(sql, params), sql)
+
+    def explain(self, sql: str, params: Optional[list] = None, analyze: bool = False) -> List[Dict[str, Any]]:
+        result = self.client.explain(sql, params, analyze=analyze)
+        return plan_rows(result['plan'])
+
+    def close(self):
+        self.client.close()
+
+
+def plan_rows(node: Dict[str, Any], depth: int = 0) -> List[Dict[str, Any]]:
+    """Дерево плана в строки таблицы с отступами по глубине"""
+    rows = [{
+        'operation': '  ' * depth + node['operation'],
+        'table': node.get('table'),
+        'index': node.get('index'),
+        'est. rows': node.get('estimated_rows'),
+        'rows': node.get('actual_rows'),
+        'cost': node.get('cost'),
+        'detail': node.get('detail') if depth else None,
+    }]
+    for child in node.get('children') or []:
+        rows.extend(plan_rows(child, depth + 1))
+    return rows
+
+
+def open_target(url: str, api_key: Optional[str] = None, timeout: float = 30.0, transport: str = 'http'):
+    """Локальная база для sqlite://, иначе сервер"""
+    if url.startswith('sqlite://'):
+        return LocalTarget(url, timeout=timeout)
+    return ServerTarget(url, api_key=api_key, timeout=timeout, transport=transport)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Перцентиль по ближайшему рангу для отсортированного списка"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_bench(
+    make_target: Callable[[], Any],
+    sql: str,
+    params: Optional[list] = None,
+    concurrency: int = 4,
+    duration: float = 10.0,
+    warmup: float = 1.0,
+) -> Dict[str, Any]:
+    """
+    Выполняет запрос в concurrency потоках в течение duration секунд
+
+    У каждого потока своё соединение; первые warmup секунд не учитываются.
+    """
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def worker(index: int):
+        target = make_target()
+        try:
+            while True:
+                begin = time.perf_counter()
+                if begin >= deadline:
+                    break
+                try:
+                    target.query(sql, params)
+                except AetherQueryError:
+                    errors[index] += 1
+                    continue
+                if begin >= measure_from:
+                    latencies[index].append(time.perf_counter() - begin)
+        finally:
+            target.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    values = sorted(value for worker_latencies in latencies for value in worker_latencies)
+    return {
+        'queries': len(values),
+        'errors': sum(errors),
+        'qps': len(values) / duration if duration else 0.0,
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p90_ms': percentile(values, 0.90) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+class Output:
+    """Вывод таблиц: через rich, если он установлен, иначе простым текстом"""
+
+    def __init__(self):
+        try:
+            from rich.console import Console
+        except ImportError:
+            self.console = None
+        else:
+            self.console = Console()
+
+    def table(self, batches: Iterator[List[Dict[str, Any]]]) -> int:
+        """Печатает пачки строк по мере поступления; возвращает число строк"""
+        columns: Optional[List[str]] = None
+        widths: List[int] = []
+        count = 0
+        for batch in batches:
+            if not batch:
+                continue
+            if columns is None:
+                columns = list(batch[0])
+                widths = [
+                    max(len(str(column)), *(len(self._cell(row.get(column))) for row in batch))
+                    for column in columns
+                ]
+            self._print_rows(columns, widths, batch, header=count == 0)
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def _cell(value: Any) -> str:
+        return 'NULL' if value is None else str(value)
+
+    def _print_rows(self, columns: List[str], widths: List[int], rows: List[Dict[str, Any]], header: bool):
+        if self.console is not None:
+            from rich.table import Table
+
+            table = Table(show_header=header, box=None)
+            for column in columns:
+                table.add_column(column)
+            for row in rows:
+                table.add_row(*(self._cell(row.get(column)) for column in columns))
+            self.console.print(table)
+            return
+        if header:
+            click.echo('  '.join(str(column).ljust(width) for column, width in zip(columns, widths)))
+            click.echo('  '.join('-' * width for width in widths))
+        for row in rows:
+            click.echo('  '.join(self._cell(row.get(column)).ljust(width) for column, width in zip(columns, widths)))
+
+    def message(self, text: str, error: bool = False):
+        if self.console is not None:
+            self.console.print(text, style='red' if error else None, highlight=False)
+        else:
+            click.echo(text, err=error)
+
+
+@click.group()
+@click.option('--api-key', envvar='AETHERQUERY_API_KEY', help='Ключ API (или AETHERQUERY_API_KEY)')
+@click.option('--timeout', type=float, default=30.0, show_default=True, help='Таймаут запроса в секундах')
+@click.option('--transport', type=click.Choice(['http', 'ws']), default='http', show_default=True,
+              help='Транспорт к серверу; ws передаёт результаты пачками')
+@click.pass_context
+def main(ctx: click.Context, api_key: Optional[str], timeout: float, transport: str):
+    """Командная строка AetherQuery"""
+    ctx.obj = {'api_key': api_key, 'timeout': timeout, 'transport': transport}
+
+
+def _target_factory(ctx: click.Context, url: str) -> Callable[[], Any]:
+    options = ctx.obj
+    return lambda: open_target(url, options['api_key'], options['timeout'], options['transport'])
+
+
+@main.command()
+@click.argument('target')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Строк в пачке вывода')
+@click.pass_context
+def shell(ctx: click.Context, target: str, batch_size: int):
+    """Интерактивная оболочка: запросы завершаются ';', \\q - выход, \\timing - время, \\explain SQL - план"""
+    try:
+        import readline
+    except ImportError:
+        readline = None
+    if readline is not None:
+        try:
+            readline.read_history_file(HISTORY_FILE)
+        except OSError:
+            pass
+
+    output = Output()
+    connection = _target_factory(ctx, target)()
+    show_timing = True
+    buffer: List[str] = []
+    output.message(f"Подключено к {connection.name}. \\q - выход")
+    try:
+        while True:
+            try:
+                line = input('...> ' if buffer else 'aq> ')
+            except EOFError:
+                break
+            except KeyboardInterrupt:
+                buffer = []
+                click.echo()
+                continue
+
+            stripped = line.strip()
+            if not buffer and stripped.startswith('\\'):
+                command, _, argument = stripped.partition(' ')
+                if command in ('\\q', '\\quit'):
+                    break
+                if command == '\\timing':
+                    show_timing = not show_timing
+                    output.message(f"Время выполнения: {'вкл' if show_timing else 'выкл'}")
+                elif command == '\\explain' and argument:
+                    _run_statement(output, lambda: iter([connection.explain(argument.rstrip(';'))]), show_timing)
+                else:
+                    output.message(f"Неизвестная команда: {command}", error=True)
+                continue
+
+            buffer.append(line)
+            if not stripped.endswith(';'):
+                continue
+            sql = '\n'.join(buffer).strip().rstrip(';')
+            buffer = []
+            if sql:
+                _run_statement(output, lambda: connection.stream(sql, batch_size=batch_size), show_timing)
+    finally:
+        connection.close()
+        if readline is not None:
+            try:
+                readline.write_history_file(HISTORY_FILE)
+            except OSError:
+                pass
+
+
+def _run_statement(output: Output, batches: Callable[[], Iterator[List[Dict[str, Any]]]], show_timing: bool):
+    started = time.perf_counter()
+    try:
+        count = output.table(batches())
+    except AetherQueryError as e:
+        output.message(f"Ошибка: {e}", error=True)
+        return
+    except KeyboardInterrupt:
+        output.message("Прервано", error=True)
+        return
+    suffix = f" ({(time.perf_counter() - started) * 1000:.1f} мс)" if show_timing else ""
+    output.message(f"{count} строк{suffix}")
+
+
+@main.command()
+@click.argument('target')
+@click.argument('sql')
+@click.option('-p', '--param', 'params', multiple=True, help='Параметр запроса (повторяемый)')
+@click.option('-c', '--concurrency', type=int, default=4, show_default=True, help='Параллельных соединений')
+@click.option('-d', '--duration', type=float, default=10.0, show_default=True, help='Длительность замера в секундах')
+@click.option('--warmup', type=float, default=1.0, show_default=True, help='Прогрев без учёта, в секундах')
+@click.pass_context
+def bench(ctx: click.Context, target: str, sql: str, params: tuple, concurrency: int, duration: float, warmup: float):
+    """Нагрузочный прогон запроса: пропускная способность и перцентили задержки"""
+    result = run_bench(_target_factory(ctx, target), sql, list(params) or None, concurrency, duration, warmup)
+    output = Output()
+    output.message(
+        f"{result['queries']} запросов за {duration:.1f} с, {result['qps']:.1f} qps, ошибок: {result['errors']}"
+    )
+    output.table(iter([[{
+        'p50, мс': round(result['p50_ms'], 2),
+        'p90, мс': round(result['p90_ms'], 2),
+        'p99, мс': round(result['p99_ms'], 2),
+        'max, мс': round(result['max_ms'], 2),
+    }]]))
+    if result['errors'] and not result['queries']:
+        sys.exit(1)
+
+
+@main.command()
+@click.argument('target')
+@click.argument('sql')
+@click.option('-p', '--param', 'params', multiple=True, help='Параметр запроса (повторяемый)')
+@click.option('--analyze', is_flag=True, help='Выполнить запрос и показать фактические строки (только сервер)')
+@click.pass_context
+def explain(ctx: click.Context, target: str, sql: str, params: tuple, analyze: bool):
+    """План выполнения запроса"""
+    output = Output()
+    connection = _target_factory(ctx, target)()
+    try:
+        output.table(iter([connection.explain(sql, list(params) or None, analyze=analyze)]))
+    except AetherQueryError as e:
+        output.message(f"Ошибка: {e}", error=True)
+        sys.exit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
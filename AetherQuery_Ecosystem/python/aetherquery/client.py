@@ -1,17 +1,59 @@
 """Минимальный синхронный клиент для AetherQuery"""
 
 import json
-from typing import Optional, Dict, Any
-import requests
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator, Callable, TYPE_CHECKING
 
 from .exceptions import (
     AetherQueryError,
+    ConfigurationError,
     ConnectionError,
     QueryError,
     AuthenticationError,
+    ResourceError,
     TimeoutError,
 )
 
+if TYPE_CHECKING:
+    import requests
+    from .ws import WebSocketChannel
+
+
+def _load_requests():
+    """Импортирует requests при первом создании клиента"""
+    global requests
+    import requests as module
+    
+    requests = module
+    return module
+
+
+def __getattr__(name: str) -> Any:
+    # requests (с urllib3, idna, charset_normalizer) - основная часть времени
+    # импорта пакета; грузим его, только когда он действительно нужен
+    if name == 'requests':
+        return _load_requests()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def parse_server_timing(header: Any) -> Dict[str, float]:
+    """Разбирает заголовок Server-Timing: 'execute;dur=1.2, fetch;dur=0.3'"""
+    timings: Dict[str, float] = {}
+    if not isinstance(header, str):
+        return timings
+    for metric in header.split(','):
+        name, *params = [part.strip() for part in metric.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur' and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
 
 class AetherClient:
     """Базовый синхронный клиент для работы с AetherQuery API"""
@@ -21,21 +63,47 @@ class AetherClient:
         base_url: str,
         api_key: Optional[str] = None,
         timeout: float = 30.0,
+        transport: str = 'http',
+        on_timings: Optional[Callable[[str, Dict[str, Any]], None]] = None,
     ):
         """
         Инициализация клиента
         
         Args:
-            base_url: Базовый URL API сервера
+            base_url: Базовый URL API сервера; unix:///path/to.sock - Unix
+                domain socket (большие результаты передаются через разделяемую память)
             api_key: Ключ API для аутентификации
             timeout: Таймаут запросов в секундах
+            transport: 'http' - запрос на каждый вызов, 'ws' - все query()
+                через одно WebSocket соединение (нужен websocket-client)
+            on_timings: Вызывается после каждого HTTP запроса с путём и
+                разбивкой задержки (см. last_timings)
         """
+        if transport not in ('http', 'ws'):
+            raise ConfigurationError(
+                f"Unknown transport: {transport}", config_key='transport', config_value=transport
+            )
+        self.socket_path = None
+        if base_url.startswith('unix://'):
+            if transport != 'http':
+                raise ConfigurationError(
+                    "Unix socket supports only the http transport",
+                    config_key='transport', config_value=transport
+                )
+            from .uds import UNIX_BASE_URL
+            
+            self.socket_path = base_url[len('unix://'):]
+            base_url = UNIX_BASE_URL
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key
         self.timeout = timeout
+        self.transport = transport
+        self.on_timings = on_timings
+        self._channel = None
+        self._channel_lock = threading.Lock()
         
         # Создаем сессию
-        self.session = requests.Session()
+        self.session = _load_requests().Session()
         self.session.headers.update({
             'User-Agent': 'AetherQuery-Python-Client/0.1.0',
             'Accept': 'application/json',
@@ -43,6 +111,15 @@ class AetherClient:
         
         if api_key:
             self.session.headers['Authorization'] = f'Bearer {api_key}'
+        
+        if self.socket_path:
+            from .uds import SHARED_MEMORY_HEADER, UnixSocketAdapter
+            
+            self.session.mount(self.base_url, UnixSocketAdapter(self.socket_path))
+            self.session.headers[SHARED_MEMORY_HEADER] = '1'
+        
+        # Открытая транзакция сервера (своя для каждого потока)
+        self._local = threading.local()
     
     def _request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
         """Выполняет HTTP запрос с обработкой ошибок"""
@@ -52,37 +129,90 @@ class AetherClient:
         kwargs.setdefault('timeout', self.timeout)
         
         try:
+            started = time.perf_counter()
             response = self.session.request(method, url, **kwargs)
+            received = time.perf_counter()
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            if self.socket_path and isinstance(result, dict) and 'shared_memory' in result:
+                from .uds import read_shared_result
+                
+                # Большой результат лежит в сегменте разделяемой памяти, по сокету пришёл дескриптор
+                result = read_shared_result(result['shared_memory'])
+            self._record_timings(endpoint, response, started, received, time.perf_counter())
+            return result
         except requests.exceptions.Timeout:
             raise TimeoutError(f"Request timeout after {self.timeout}s")
         except requests.exceptions.ConnectionError:
             raise ConnectionError("Connection failed")
         except requests.exceptions.HTTPError as e:
-            status_code = e.response.status_code
-            if status_code == 400:
-                raise QueryError(f"Bad request: {e}")
-            elif status_code == 401:
-                raise AuthenticationError(f"Authentication failed: {e}")
-            elif status_code == 403:
-                raise AuthenticationError(f"Forbidden: {e}")
-            else:
-                raise AetherQueryError(f"HTTP error {status_code}: {e}")
+            raise self._http_error(e)
         except requests.exceptions.RequestException as e:
             raise ConnectionError(f"Request failed: {e}")
     
+    @property
+    def last_timings(self) -> Optional[Dict[str, Any]]:
+        """
+        Разбивка задержки последнего запроса этого потока, мс
+        
+        round_trip - от отправки до получения ответа, server - фазы из
+        заголовка Server-Timing, network - round_trip за вычетом времени
+        сервера, decode - разбор JSON ответа.
+        """
+        return getattr(self._local, 'timings', None)
+    
+    def _record_timings(self, endpoint: str, response, started: float, received: float, decoded: float):
+        server = parse_server_timing(response.headers.get('Server-Timing'))
+        round_trip = (received - started) * 1000
+        timings = {
+            'round_trip': round(round_trip, 3),
+            'network': round(max(round_trip - server.get('total', 0.0), 0.0), 3),
+            'decode': round((decoded - received) * 1000, 3),
+            'total': round((decoded - started) * 1000, 3),
+            'server': server,
+        }
+        self._local.timings = timings
+        if self.on_timings is not None:
+            self.on_timings(endpoint, timings)
+    
+    @staticmethod
+    def _http_error(e: 'requests.exceptions.HTTPError') -> AetherQueryError:
+        """Исключение клиента по HTTP ошибке сервера"""
+        status_code = e.response.status_code
+        if status_code == 400:
+            return QueryError(f"Bad request: {e}")
+        elif status_code == 401:
+            return AuthenticationError(f"Authentication failed: {e}")
+        elif status_code == 403:
+            return AuthenticationError(f"Forbidden: {e}")
+        elif status_code == 429:
+            # Квота ключа API, очередь класса нагрузки или лимит открытых транзакций
+            retry_after = e.response.headers.get('Retry-After')
+            return ResourceError(
+                f"Too many requests: {e}",
+                resource_type=e.response.headers.get('X-Quota-Exceeded', 'queries_in_flight'),
+                retry_after=float(retry_after) if retry_after else None,
+            )
+        else:
+            return AetherQueryError(f"HTTP error {status_code}: {e}")
+    
     def health(self) -> Dict[str, Any]:
         """Проверяет здоровье сервера"""
         return self._request('GET', '/health')
     
-    def query(self, sql: str, params: Optional[list] = None) -> Dict[str, Any]:
+    def query(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
         """
         Выполняет SQL запрос
         
         Args:
             sql: SQL запрос
             params: Параметры для prepared statements
+            options: Опции выполнения (read_only, transaction, datasource, ...)
             
         Returns:
             Результат выполнения запроса
@@ -90,11 +220,343 @@ class AetherClient:
         payload = {'query': sql}
         if params:
             payload['params'] = params
-            
+        if options:
+            payload['options'] = options
+        
+        session_id = getattr(self._local, 'session_id', None)
+        if self.transport == 'ws':
+            return self.channel.query(sql, params, options, session_id=session_id)
+        if session_id:
+            return self._request(
+                'POST', '/query', json=payload, headers={'X-Session-Id': session_id}
+            )
         return self._request('POST', '/query', json=payload)
     
+    def explain(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        analyze: bool = False,
+        datasource: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Нормализованный план выполнения запроса
+        
+        Args:
+            sql: SQL запрос
+            params: Параметры запроса
+            analyze: Выполнить запрос (только чтение) и получить фактические строки и время
+            datasource: Имя источника данных
+            
+        Returns:
+            plan (дерево узлов: operation, table, index, estimated_rows,
+            actual_rows, cost, children), node, execution_time, raw
+        """
+        payload: Dict[str, Any] = {'query': sql, 'analyze': analyze}
+        if params:
+            payload['params'] = params
+        if datasource:
+            payload['datasource'] = datasource
+        return self._request('POST', '/explain', json=payload)
+    
+    def slow_queries(self, datasource: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+        """Журнал медленных запросов сервера с планами"""
+        params: Dict[str, Any] = {'limit': limit}
+        if datasource:
+            params['datasource'] = datasource
+        return self._request('GET', '/slow-queries', params=params)
+    
+    def index_advice(
+        self,
+        datasource: Optional[str] = None,
+        validate: bool = True,
+        limit: int = 20,
+    ) -> Dict[str, Any]:
+        """
+        Кандидаты в индексы по журналу медленных запросов
+        
+        Args:
+            datasource: Имя источника данных
+            validate: Проверить кандидатов на копии базы SQLite
+            limit: Сколько кандидатов вернуть
+            
+        Returns:
+            candidates (по убыванию выигрыша) и ddl - скрипт рекомендованных индексов
+        """
+        params: Dict[str, Any] = {'validate': str(validate).lower(), 'limit': limit}
+        if datasource:
+            params['datasource'] = datasource
+        return self._request('GET', '/advisor/indexes', params=params)
+    
+    def export(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        format: str = 'csv',
+        **options: Any,
+    ) -> Dict[str, Any]:
+        """
+        Выгружает результат запроса в файлы на сервере
+        
+        Args:
+            sql: SQL запрос (только чтение)
+            params: Параметры запроса
+            format: 'csv' или 'parquet'
+            **options: compression, name, partition_rows, partition_by, batch_size, datasource
+            
+        Returns:
+            Описание выгрузки: каталог, число строк и список файлов
+            
+        Пример:
+            >>> client.export("SELECT * FROM events", format="parquet",
+            ...               compression="zstd", partition_by="day", name="events/2024")
+        """
+        payload = {'query': sql, 'format': format, **options}
+        if params:
+            payload['params'] = params
+        return self._request('POST', '/export', json=payload)
+    
+    def import_file(
+        self,
+        path: str,
+        table: str,
+        wait: bool = True,
+        poll_interval: float = 0.5,
+        **options: Any,
+    ) -> Dict[str, Any]:
+        """
+        Загружает CSV/Parquet файл из каталога импорта сервера в таблицу
+        
+        Args:
+            path: Путь к файлу относительно --import-dir сервера
+            table: Целевая таблица (создаётся с выведенными типами, если её нет)
+            wait: Дождаться окончания загрузки
+            poll_interval: Период опроса прогресса в секундах
+            **options: format, delimiter, create, batch_size, chunk_bytes, datasource
+            
+        Returns:
+            Прогресс загрузки: rows, progress, rows_per_second, mb_per_second, ...
+        """
+        payload = {'path': path, 'table': table, **options}
+        import_id = self._request('POST', '/import', json=payload)['import_id']
+        while True:
+            status = self._request('GET', f'/import/{import_id}')
+            if not wait or status['status'] not in ('queued', 'running'):
+                break
+            time.sleep(poll_interval)
+        if status['status'] == 'failed':
+            raise QueryError(f"Import into {table} failed: {status.get('error')}")
+        return status
+    
+    def submit_job(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        Ставит долгий запрос в очередь фоновых заданий сервера
+        
+        Returns:
+            Идентификатор задания для job_status()/wait_job()/job_rows()
+        """
+        payload = {'query': sql}
+        if params:
+            payload['params'] = params
+        if options:
+            payload['options'] = options
+        return self._request('POST', '/jobs', json=payload)['job_id']
+    
+    def job_status(self, job_id: str) -> Dict[str, Any]:
+        """Состояние фонового задания"""
+        return self._request('GET', f'/jobs/{job_id}')
+    
+    def wait_job(
+        self,
+        job_id: str,
+        poll_interval: float = 1.0,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Ждёт завершения задания, опрашивая его состояние"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status = self.job_status(job_id)
+            if status['status'] == 'done':
+                return status
+            if status['status'] in ('failed', 'cancelled'):
+                raise QueryError(f"Job {job_id} {status['status']}: {status.get('error')}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(timeout, operation=f"waiting for job {job_id}")
+            time.sleep(poll_interval)
+    
+    def job_rows(self, job_id: str, retries: int = 3) -> Iterator[Dict[str, Any]]:
+        """
+        Потоково читает результат готового задания
+        
+        При обрыве соединения чтение продолжается с последней полученной
+        строки через Range запрос.
+        """
+        url = f"{self.base_url}/jobs/{job_id}/result"
+        offset = 0
+        columns = None
+        failures = 0
+        while True:
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                response = self.session.request(
+                    'GET', url, headers=headers, stream=True, timeout=self.timeout
+                )
+                response.raise_for_status()
+                buffer = b''
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        offset += len(line) + 1
+                        if columns is None:
+                            columns = json.loads(line)['columns']
+                        else:
+                            yield dict(zip(columns, json.loads(line)))
+                return
+            except requests.exceptions.HTTPError as e:
+                raise self._http_error(e)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                failures += 1
+                if failures > retries:
+                    raise ConnectionError(f"Job result download failed: {e}")
+    
+    def changes(
+        self,
+        tables: Optional[list] = None,
+        query: Optional[str] = None,
+        datasource: Optional[str] = None,
+        retries: int = 3,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Подписка на изменения данных (Server-Sent Events /changes)
+        
+        Args:
+            tables: Таблицы, изменения которых нужны (по умолчанию - все)
+            query: Живой запрос - сервер присылает новый результат при изменении его таблиц
+            datasource: Имя источника данных
+            retries: Число переподключений подряд при обрыве
+            
+        Yields:
+            {'event': 'change' | 'result' | 'reset' | 'error', 'id': ..., 'data': {...}}
+            
+        Пример:
+            >>> for change in client.changes(tables=["orders"]):
+            ...     refresh_orders()
+        """
+        params = {}
+        if tables:
+            params['tables'] = ','.join(tables)
+        if query:
+            params['query'] = query
+        if datasource:
+            params['datasource'] = datasource
+        url = f"{self.base_url}/changes"
+        last_id = None
+        failures = 0
+        while True:
+            headers = {'Accept': 'text/event-stream'}
+            if last_id is not None:
+                # Сервер дошлёт пропущенные за время обрыва события
+                headers['Last-Event-ID'] = str(last_id)
+            try:
+                response = self.session.request(
+                    'GET', url, params=params, headers=headers, stream=True, timeout=self.timeout
+                )
+                response.raise_for_status()
+                event = {}
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        if 'data' in event:
+                            failures = 0
+                            yield event
+                            if event['event'] == 'reset':
+                                return
+                        event = {}
+                    elif line.startswith(':'):
+                        continue
+                    else:
+                        field, _, value = line.partition(':')
+                        value = value[1:] if value.startswith(' ') else value
+                        if field == 'event':
+                            event['event'] = value
+                        elif field == 'id':
+                            event['id'] = last_id = int(value)
+                        elif field == 'data':
+                            event.setdefault('event', 'message')
+                            event['data'] = json.loads(value)
+                return
+            except requests.exceptions.HTTPError as e:
+                raise self._http_error(e)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                failures += 1
+                if failures > retries:
+                    raise ConnectionError(f"Change stream failed: {e}")
+    
+    @property
+    def channel(self) -> 'WebSocketChannel':
+        """
+        WebSocket канал к /ws (открывается при первом обращении)
+        
+        Пример параллельных запросов через одно соединение:
+            >>> futures = [client.channel.submit("SELECT * FROM users WHERE id = ?", [i]) for i in ids]
+            >>> results = [f.result() for f in futures]
+        """
+        with self._channel_lock:
+            if self._channel is None:
+                from .ws import WebSocketChannel
+                
+                url = 'ws' + self.base_url[len('http'):] if self.base_url.startswith('http') else self.base_url
+                headers = {
+                    name: value for name, value in self.session.headers.items()
+                    if name in ('User-Agent', 'Authorization')
+                }
+                self._channel = WebSocketChannel(f"{url}/ws", headers=headers, timeout=self.timeout)
+            return self._channel
+    
+    @contextmanager
+    def transaction(self, datasource: Optional[str] = None) -> Iterator['AetherClient']:
+        """
+        Транзакция на сервере: все query() внутри блока выполняются в ней
+        
+        При выходе из блока транзакция фиксируется, при исключении - откатывается.
+        
+        Args:
+            datasource: Имя источника данных (по умолчанию - основной)
+            
+        Пример:
+            >>> with client.transaction():
+            ...     client.query("INSERT INTO accounts (id, balance) VALUES (?, ?)", [1, 100])
+            ...     client.query("UPDATE totals SET balance = balance + ?", [100])
+        """
+        if getattr(self._local, 'session_id', None):
+            raise AetherQueryError("Nested transactions are not supported")
+        
+        payload = {'datasource': datasource} if datasource else {}
+        session_id = self._request('POST', '/session', json=payload)['session_id']
+        self._local.session_id = session_id
+        try:
+            yield self
+        except BaseException:
+            self._local.session_id = None
+            try:
+                self._request('POST', f'/session/{session_id}/rollback')
+            except AetherQueryError:
+                # Сессия могла уже истечь на сервере - она откатывается там же
+                pass
+            raise
+        self._local.session_id = None
+        self._request('POST', f'/session/{session_id}/commit')
+    
     def close(self):
         """Закрывает клиент и освобождает ресурсы"""
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
         self.session.close()
     
     def __enter__(self):
@@ -216,10 +216,14 @@ class QueryError(AetherQueryError):
             details["params"] = params
         if position is not None:
             details["position"] = position
+        # Подклассы передают свой код и детали
+        if isinstance(kwargs.get("details"), dict):
+            details.update(kwargs.pop("details"))
+        kwargs.pop("details", None)
             
         super().__init__(
             message=message,
-            code="QUERY_ERROR",
+            code=kwargs.pop("code", "QUERY_ERROR"),
             details=details if details else None,
             **kwargs
         )
@@ -277,11 +281,13 @@ class ResourceError(QueryError):
         message: str = "Resource limit exceeded",
         resource_type: Optional[str] = None,
         limit: Optional[int] = None,
-        used: Optional[int] = None
+        used: Optional[int] = None,
+        retry_after: Optional[float] = None
     ):
         self.resource_type = resource_type
         self.limit = limit
         self.used = used
+        self.retry_after = retry_after
         
         details = {}
         if resource_type:
@@ -290,6 +296,8 @@ class ResourceError(QueryError):
             details["limit"] = limit
         if used is not None:
             details["used"] = used
+        if retry_after is not None:
+            details["retry_after"] = retry_after
             
         super().__init__(
             message=message,
@@ -0,0 +1,7 @@
+"""
+Компоненты тестового сервера AetherQuery
+
+Приложение FastAPI, эндпоинты и запуск - в aetherquery_server.py. Модули
+пакета не зависят от состояния сервера: ServerState собирает их сам, а
+фоновая работа получает квоты через переданный ей admission.
+"""
@@ -0,0 +1,280 @@
+"""Советник по индексам по журналу медленных запросов"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+from .backends import BackendError, SQLiteBackend, quote_identifier
+from .datasource import Datasource
+from .sql import FINGERPRINT_LITERALS, classify_statement, normalize_query, table_aliases
+
+
+# Советник по индексам
+WHERE_CLAUSE = re.compile(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\blimit\b|\bhaving\b|\bunion\b|$)", re.S)
+
+ON_CLAUSE = re.compile(r"\bon\b(.*?)(?=\b(?:left|right|inner|outer|cross|join|where|group|order|limit)\b|$)", re.S)
+
+ORDER_CLAUSE = re.compile(r"\border\s+by\b(.*?)(?=\blimit\b|$)", re.S)
+
+EQUALITY_PREDICATE = re.compile(r"([a-z_][\w.]*)\s*(?:==?|\bin\s*\(|\bis\s+(?!not\b))")
+
+RANGE_PREDICATE = re.compile(r"([a-z_][\w.]*)\s*(?:<=|>=|<(?!>)|>|\bbetween\b|\blike\b)")
+
+JOIN_EQUALITY = re.compile(r"([a-z_][\w.]*)\s*=\s*([a-z_][\w.]*)")
+
+
+def predicate_columns(query: str) -> Dict[str, List[str]]:
+    """Колонки из условий запроса: равенства (WHERE и ON), диапазоны и сортировка"""
+    text = FINGERPRINT_LITERALS.sub("?", normalize_query(query))
+    columns: Dict[str, List[str]] = {"eq": [], "range": [], "order": []}
+
+    def add(kind: str, name: str):
+        if name not in columns[kind]:
+            columns[kind].append(name)
+
+    for clause in WHERE_CLAUSE.findall(text):
+        for name in EQUALITY_PREDICATE.findall(clause):
+            add("eq", name)
+        for name in RANGE_PREDICATE.findall(clause):
+            add("range", name)
+    for clause in ON_CLAUSE.findall(text):
+        for left, right in JOIN_EQUALITY.findall(clause):
+            add("eq", left)
+            add("eq", right)
+    for clause in ORDER_CLAUSE.findall(text):
+        for term in clause.split(","):
+            parts = term.split()
+            if parts and "(" not in parts[0]:
+                add("order", parts[0])
+    return columns
+
+
+def plan_nodes(plan: Optional[Dict[str, Any]]):
+    """Все узлы дерева плана"""
+    if not plan:
+        return
+    yield plan
+    for child in plan.get("children") or []:
+        yield from plan_nodes(child)
+
+
+def index_name(table: str, columns: List[str]) -> str:
+    return "idx_" + "_".join([table] + columns)
+
+
+class IndexAdvisor:
+    """
+    Кандидаты в индексы по журналу медленных запросов
+
+    Для каждой формы запроса с планом колонки условий (равенства, затем
+    первый диапазон, иначе сортировка) сопоставляются со схемой таблиц;
+    кандидат отбрасывается, если его колонки уже являются префиксом
+    существующего индекса. Без проверки выигрыш - грубая оценка по доле
+    времени запросов; с проверкой каждый кандидат создаётся на копии базы
+    SQLite, и выигрыш считается по времени запросов до и после.
+    """
+
+    MAX_COLUMNS = 4
+    # Доля времени запроса, которую индекс предположительно экономит
+    BENEFIT_FACTORS = {"eq": 0.9, "range": 0.5, "order": 0.3}
+
+    def __init__(self, datasource: "Datasource", max_scratch_bytes: int = 256 << 20,
+                 max_validated: int = 20, directory: Optional[str] = None):
+        self.datasource = datasource
+        self.max_scratch_bytes = max_scratch_bytes
+        self.max_validated = max_validated
+        self.directory = directory
+
+    async def advise(self, validate: bool = True, limit: int = 20) -> Dict[str, Any]:
+        backend = self.datasource.primary.backend
+        entries = [entry for entry in list(self.datasource.slow_queries.entries.values()) if entry["plan"]]
+        schemas: Dict[str, Dict[str, Any]] = {}
+        indexes: Dict[str, List[List[str]]] = {}
+        for table in sorted({table for entry in entries for table in entry["tables"]}):
+            try:
+                schema = await backend.get_table_schema(table)
+                existing = await backend.get_indexes(table) if hasattr(backend, "get_indexes") else []
+            except BackendError:
+                continue
+            if not schema:
+                continue
+            schemas[table] = {column["name"].lower(): column for column in schema}
+            indexes[table] = [[column.lower() for column in index["columns"]] for index in existing
+                              if not index.get("partial")]
+            primary_key = [column["name"].lower() for column in schema if column.get("primary_key")]
+            if primary_key:
+                indexes[table].append(primary_key)
+
+        candidates: Dict[Tuple[str, Tuple[str, ...]], Dict[str, Any]] = {}
+        for entry in entries:
+            for table, columns, kind, access in self._candidates(entry, schemas, indexes):
+                key = (table, tuple(columns))
+                candidate = candidates.get(key)
+                if candidate is None:
+                    name = index_name(table, columns)
+                    candidate = candidates[key] = {
+                        "table": table,
+                        "columns": columns,
+                        "name": name,
+                        "ddl": (f"CREATE INDEX IF NOT EXISTS {quote_identifier(name)} ON {quote_identifier(table)} "
+                                f"({', '.join(quote_identifier(column) for column in columns)})"),
+                        "reason": f"{access['operation']} on {table} ({access['detail']})",
+                        "estimated_rows": access.get("estimated_rows"),
+                        "queries": [],
+                        "executions": 0,
+                        "total_ms": 0.0,
+                        "estimated_benefit_ms": 0.0,
+                        "validated": False,
+                        "_samples": [],
+                    }
+                factor = self.BENEFIT_FACTORS[kind] / (2 if access["operation"] == "search" else 1)
+                candidate["queries"].append(entry["fingerprint"])
+                candidate["executions"] += entry["count"]
+                candidate["total_ms"] += entry["total_ms"]
+                candidate["estimated_benefit_ms"] += entry["total_ms"] * factor
+                candidate["_samples"].append((entry["query"], entry["params"], entry["total_ms"]))
+
+        ranked = sorted(candidates.values(), key=lambda candidate: -candidate["estimated_benefit_ms"])
+        validation = None
+        if validate and ranked:
+            validation = await self._validate_all(backend, ranked[:self.max_validated])
+            ranked.sort(key=lambda candidate: -candidate["estimated_benefit_ms"])
+
+        report = [{key: value for key, value in candidate.items() if not key.startswith("_")}
+                  for candidate in ranked[:limit]]
+        recommended = [candidate for candidate in report
+                       if candidate.get("used", True) and candidate["estimated_benefit_ms"] > 0]
+        return {
+            "datasource": self.datasource.name,
+            "slow_queries": len(entries),
+            "validation": validation,
+            "candidates": report,
+            "ddl": "".join(f"{candidate['ddl']};\n" for candidate in recommended),
+        }
+
+    def _candidates(self, entry: Dict[str, Any], schemas: Dict[str, Dict[str, Any]],
+                    indexes: Dict[str, List[List[str]]]):
+        """Кандидаты (таблица, колонки, вид условия, узел плана) для одной формы запроса"""
+        if classify_statement(entry["query"]) != "read" and not re.match(
+                r"\s*(update|delete)\b", entry["query"], re.IGNORECASE):
+            return
+        aliases = {alias.lower(): table.lower() for alias, table in table_aliases(entry["query"]).items()}
+        access: Dict[str, Dict[str, Any]] = {}
+        sorted_in_plan = False
+        for node in plan_nodes(entry["plan"]):
+            if node.get("operation") in ("scan", "search") and node.get("table"):
+                access.setdefault(node["table"].lower(), node)
+            elif node.get("operation") == "sort":
+                sorted_in_plan = True
+
+        by_table: Dict[str, Dict[str, List[str]]] = {}
+        for kind, names in predicate_columns(entry["query"]).items():
+            for name in names:
+                qualifier, _, column = name.rpartition(".")
+                if qualifier:
+                    owners = [aliases.get(qualifier, qualifier)]
+                else:
+                    owners = [table for table in entry["tables"] if column in schemas.get(table, {})]
+                if len(owners) != 1 or column not in schemas.get(owners[0], {}):
+                    continue
+                columns = by_table.setdefault(owners[0], {"eq": [], "range": [], "order": []})
+                if column not in columns[kind]:
+                    columns[kind].append(column)
+
+        for table, kinds in by_table.items():
+            node = access.get(table)
+            if node is None:
+                continue
+            columns = list(kinds["eq"])
+            kind = "eq" if columns else None
+            ranges = [column for column in kinds["range"] if column not in columns]
+            if ranges:
+                columns.append(ranges[0])
+                kind = kind or "range"
+            elif sorted_in_plan and kinds["order"] and len(by_table) == 1:
+                columns.extend(column for column in kinds["order"] if column not in columns)
+                kind = kind or "order"
+            columns = columns[:self.MAX_COLUMNS]
+            if not columns:
+                continue
+            if any(existing[:len(columns)] == columns for existing in indexes.get(table, [])):
+                continue
+            yield table, columns, kind, node
+
+    async def _validate_all(self, backend, candidates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Проверяет кандидатов на копии базы SQLite"""
+        if not hasattr(backend, "scratch_copy"):
+            return {"status": "skipped", "reason": f"{type(backend).__name__} has no scratch copy"}
+        size = await backend.database_size()
+        if size > self.max_scratch_bytes:
+            return {"status": "skipped", "reason": f"database is {size} bytes, limit {self.max_scratch_bytes}"}
+
+        fd, path = tempfile.mkstemp(suffix=".db", prefix="aetherquery-advisor-", dir=self.directory)
+        os.close(fd)
+        loop = asyncio.get_running_loop()
+        try:
+            await backend.scratch_copy(path)
+            for candidate in candidates:
+                result = await loop.run_in_executor(None, self._validate, path, candidate)
+                candidate.update(result)
+                candidate["validated"] = True
+                if result["used"] and result["before_ms"] > 0:
+                    # Доля сэкономленного времени на копии переносится на суммарное время форм
+                    saved = max(0.0, 1 - result["after_ms"] / result["before_ms"])
+                    candidate["estimated_benefit_ms"] = sum(total for _, _, total in candidate["_samples"]) * saved
+                else:
+                    candidate["estimated_benefit_ms"] = 0.0
+        finally:
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+        return {"status": "done", "scratch_bytes": size, "validated": len(candidates)}
+
+    @staticmethod
+    def _measure(conn: sqlite3.Connection, query: str, params: Any, repeat: int = 3) -> float:
+        """Лучшее время запроса в мс; изменения откатываются"""
+        best = None
+        for _ in range(repeat):
+            conn.execute("SAVEPOINT advisor_probe")
+            started = time.perf_counter()
+            try:
+                conn.execute(query, params if params is not None else ()).fetchall()
+            finally:
+                elapsed = (time.perf_counter() - started) * 1000
+                conn.execute("ROLLBACK TO advisor_probe")
+                conn.execute("RELEASE advisor_probe")
+            best = elapsed if best is None else min(best, elapsed)
+            if elapsed > 1000:
+                break
+        return best
+
+    @classmethod
+    def _validate(cls, path: str, candidate: Dict[str, Any]) -> Dict[str, Any]:
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            samples = [(query, params) for query, params, _ in candidate["_samples"]]
+            before = sum(cls._measure(conn, query, params) for query, params in samples)
+            conn.execute(candidate["ddl"])
+            conn.execute(f"ANALYZE {quote_identifier(candidate['name'])}")
+            used = False
+            for query, params in samples:
+                plan = SQLiteBackend._explain(conn, query, params)["plan"]
+                used = used or any(node.get("index") == candidate["name"] for node in plan_nodes(plan))
+            after = sum(cls._measure(conn, query, params) for query, params in samples)
+            conn.execute(f"DROP INDEX {quote_identifier(candidate['name'])}")
+        except (sqlite3.Error, BackendError) as e:
+            return {"used": False, "error": str(e), "before_ms": 0.0, "after_ms": 0.0, "speedup": None}
+        finally:
+            conn.close()
+        return {
+            "used": used,
+            "before_ms": before,
+            "after_ms": after,
+            "speedup": before / after if after > 0 else None,
+        }
@@ -0,0 +1,1104 @@
+"""Бэкенды источников данных, фильтры сканирования и реестр бэкендов по схеме URL"""
+
+import asyncio
+import functools
+import importlib
+import logging
+import os
+import queue
+import re
+import shlex
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from .sql import classify_statement, extract_tables, table_aliases
+from .timings import run_in_context, timed
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+# Бэкенды источников данных
+class BackendError(Exception):
+    """Ошибка выполнения запроса на стороне бэкенда"""
+
+
+class SimulatedBackend:
+    """Имитация базы данных с предопределёнными ответами"""
+
+    def __init__(self, name: str, lag: float = 0.0, delay: float = 0.1):
+        self.name = name
+        self.lag = lag
+        self.delay = delay
+
+    @classmethod
+    def from_url(cls, url) -> "SimulatedBackend":
+        """simulated://имя?lag=0.5&delay=0.1"""
+        query = parse_qs(url.query)
+        return cls(
+            name=url.netloc or "simulated",
+            lag=float(query.get("lag", ["0"])[0]),
+            delay=float(query.get("delay", ["0.1"])[0]),
+        )
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        # Имитация выполнения запроса
+        with timed("execute"):
+            await asyncio.sleep(self.delay)
+
+        # Примеры ответов для разных запросов
+        query_lower = query.lower().strip()
+
+        if "select" in query_lower and "users" in query_lower:
+            return [
+                {"id": 1, "name": "Alice", "email": "alice@example.com", "created_at": "2024-01-01"},
+                {"id": 2, "name": "Bob", "email": "bob@example.com", "created_at": "2024-01-02"},
+                {"id": 3, "name": "Charlie", "email": "charlie@example.com", "created_at": "2024-01-03"}
+            ]
+        elif "select" in query_lower and "products" in query_lower:
+            return [
+                {"id": 1, "name": "Product A", "price": 100, "stock": 50},
+                {"id": 2, "name": "Product B", "price": 200, "stock": 30},
+                {"id": 3, "name": "Product C", "price": 150, "stock": 20}
+            ]
+        elif "error" in query_lower:
+            raise BackendError("Simulated query error: Syntax error near 'ERROR'")
+
+        # Общий ответ
+        return [
+            {"result": "success", "rows_affected": 1, "message": "Query executed successfully"}
+        ]
+
+    async def replication_lag(self) -> float:
+        """Отставание от primary в секундах"""
+        return self.lag
+
+    # Имитация каталога
+    TABLES = {"users": 100, "products": 50, "orders": 200, "customers": 150}
+
+    async def get_tables(self) -> List[str]:
+        return list(self.TABLES)
+
+    async def get_table_schema(self, table: str) -> List[Dict[str, Any]]:
+        return [
+            {"name": "id", "type": "integer", "nullable": False},
+            {"name": "name", "type": "varchar(255)", "nullable": True},
+            {"name": "created_at", "type": "timestamp", "nullable": True}
+        ]
+
+    async def table_stats(self, table: str) -> Dict[str, Any]:
+        return {"estimated_rows": self.TABLES.get(table, 100), "size_mb": 10.5}
+
+    async def get_indexes(self, table: str) -> List[Dict[str, Any]]:
+        return [{"name": f"{table}_pkey", "columns": ["id"], "unique": True, "partial": False}]
+
+    async def explain(self, query: str, params: Any = None, analyze: bool = False) -> Dict[str, Any]:
+        """Имитация плана: полный просмотр каждой упомянутой таблицы"""
+        children = [
+            {"operation": "scan", "detail": f"SCAN {table}", "table": table,
+             "estimated_rows": self.TABLES.get(table, 100), "cost": float(self.TABLES.get(table, 100))}
+            for table in extract_tables(query)
+        ]
+        plan: Dict[str, Any] = {"operation": "query", "detail": query, "children": children,
+                                "cost": sum(child["cost"] for child in children)}
+        result: Dict[str, Any] = {"plan": plan, "raw": [], "execution_time": None}
+        if analyze:
+            started = time.perf_counter()
+            plan["actual_rows"] = len(await self.execute(query, params))
+            result["execution_time"] = (time.perf_counter() - started) * 1000
+        return result
+
+    async def open_transaction(self) -> "SimulatedTransaction":
+        return SimulatedTransaction(self)
+
+    async def select_batches(self, table: str, columns: Optional[List[str]] = None,
+                             filters: Optional[Dict[str, Any]] = None, batch_size: int = 1000):
+        """Фильтр и проекция выполняются в памяти: имитация не умеет pushdown"""
+        rows = [row for row in await self.execute(f"SELECT * FROM {table}") if match_filters(row, filters)]
+        if columns:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    async def bulk_insert(self, table: str, columns: List[str], rows: List[tuple]) -> int:
+        await asyncio.sleep(self.delay)
+        return len(rows)
+
+    async def execute_batch(self, statements: List[Tuple[str, List[Any]]]) -> int:
+        await asyncio.sleep(self.delay)
+        return sum(len(rows) for _, rows in statements)
+
+    async def query_batches(self, sql: str, params: Any = None, batch_size: int = 1000):
+        rows = await self.execute(sql, params)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    async def close(self):
+        pass
+
+
+def quote_identifier(name: str) -> str:
+    """Экранирует имя таблицы/колонки для SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+async def take_from_queue(sink: "queue.Queue"):
+    """Забирает элемент (index, payload) из очереди, заполняемой рабочим потоком"""
+    try:
+        item = sink.get_nowait()
+    except queue.Empty:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await loop.run_in_executor(None, functools.partial(sink.get, timeout=0.5))
+                break
+            except queue.Empty:
+                continue
+    if isinstance(item[1], Exception):
+        raise item[1]
+    return item
+
+
+# Фильтры в стиле MongoDB: {"age": {"$gt": 25}, "status": "active"}
+FILTER_OPERATORS = {
+    "$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<=", "$in": "IN",
+}
+
+
+def compile_filters(filters: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """Преобразует фильтр в SQL условие WHERE с параметрами"""
+    clauses: List[str] = []
+    params: List[Any] = []
+    for column, condition in (filters or {}).items():
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op not in FILTER_OPERATORS:
+                raise BackendError(f"Unsupported filter operator: {op}")
+            if op == "$in":
+                values = list(value)
+                if not values:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{quote_identifier(column)} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+            elif value is None:
+                clauses.append(f"{quote_identifier(column)} IS {'NOT ' if op == '$ne' else ''}NULL")
+            else:
+                clauses.append(f"{quote_identifier(column)} {FILTER_OPERATORS[op]} ?")
+                params.append(value)
+    return " AND ".join(clauses), params
+
+
+def match_filters(row: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Проверяет строку на соответствие фильтру (для бэкендов без pushdown)"""
+    for column, condition in (filters or {}).items():
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        value = row.get(column)
+        for op, expected in condition.items():
+            if op == "$eq" and not value == expected:
+                return False
+            if op == "$ne" and not value != expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None or expected is None:
+                    return False
+                if op == "$gt" and not value > expected:
+                    return False
+                if op == "$gte" and not value >= expected:
+                    return False
+                if op == "$lt" and not value < expected:
+                    return False
+                if op == "$lte" and not value <= expected:
+                    return False
+    return True
+
+
+class SQLiteBackend:
+    """Источник данных SQLite (встроен в Python): одно соединение для записи и пул читателей"""
+
+    # Профиль для нагруженных встроенных развёртываний
+    TUNED_PRAGMAS = {
+        "journal_mode": "wal",      # Читатели не блокируются записью
+        "synchronous": "normal",    # В WAL режиме безопасно и без fsync на каждый коммит
+        "mmap_size": 268435456,     # 256 MB файла читается через mmap без копирования
+        "cache_size": -65536,       # 64 MB страничного кэша на соединение
+        "temp_store": "memory",
+    }
+    # Сколько ждать освобождения таблиц другим соединением общего кэша (SQLITE_LOCKED), сек
+    LOCKED_TIMEOUT = 5.0
+
+    def __init__(self, name: str, path: str, readers: int = 4, pragmas: Optional[Dict[str, Any]] = None,
+                 statement_cache: int = 256):
+        self.name = name
+        self.path = path
+        self.readers = readers
+        self.pragmas = pragmas or {}
+        self.statement_cache = statement_cache
+        self._uri = False
+        if path == ":memory:":
+            # Общая in-memory база, видимая всем соединениям пула
+            self.path = f"file:aetherquery-{name}-{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+
+        # Единственный писатель: SQLite всё равно сериализует запись
+        self._writer = self._connect()
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{name}-writer")
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(readers):
+            self._pool.put(self._connect(read_only=True))
+        self._executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix=f"sqlite-{name}-reader")
+        self._session_pool: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        # Сколько выданных читателей закрыть при возврате после уменьшения пула
+        self._surplus = 0
+        # Записи через сервер (завершённые и идущие) и отдельное соединение для PRAGMA data_version
+        self.local_writes = 0
+        self.writes_in_progress = 0
+        self._watcher: Optional[sqlite3.Connection] = None
+
+    @property
+    def pool_size(self) -> int:
+        return self.readers
+
+    def resize(self, readers: int):
+        """Меняет число соединений читателей; занятые лишние закрываются при возврате"""
+        readers = max(1, readers)
+        with self._lock:
+            delta = readers - self.readers
+            self.readers = readers
+            if delta > 0:
+                cancelled = min(delta, self._surplus)
+                self._surplus -= cancelled
+                for _ in range(delta - cancelled):
+                    self._pool.put(self._connect(read_only=True))
+                if readers > self._executor._max_workers:
+                    previous = self._executor
+                    self._executor = ThreadPoolExecutor(max_workers=readers,
+                                                        thread_name_prefix=f"sqlite-{self.name}-reader")
+                    previous.shutdown(wait=False)
+            else:
+                self._surplus -= delta
+                while self._surplus:
+                    try:
+                        conn = self._pool.get_nowait()
+                    except queue.Empty:
+                        break
+                    conn.close()
+                    self._surplus -= 1
+        logger.info(f"SQLite {self.name}: reader pool resized to {readers}")
+
+    @classmethod
+    def from_url(cls, url) -> "SQLiteBackend":
+        """sqlite:///relative.db, sqlite:////absolute/path.db, sqlite:///:memory:
+
+        Параметры: readers (pool_size), profile=tuned, journal_mode, synchronous,
+        mmap_size, cache_size, busy_timeout, statement_cache
+        """
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        path = url.path[1:] if url.path.startswith("/") else url.path
+        pragmas: Dict[str, Any] = dict(cls.TUNED_PRAGMAS) if query.get("profile") == "tuned" else {}
+        for pragma in ("journal_mode", "synchronous", "mmap_size", "cache_size", "busy_timeout", "temp_store"):
+            if pragma in query:
+                pragmas[pragma] = query[pragma]
+        return cls(
+            name=query.get("name", os.path.basename(path) or "sqlite"),
+            path=path or ":memory:",
+            readers=int(query.get("readers", query.get("pool_size", "4"))),
+            pragmas=pragmas,
+            statement_cache=int(query.get("statement_cache", "256")),
+        )
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        # cached_statements - LRU подготовленных выражений на соединение
+        conn = sqlite3.connect(
+            self.path, uri=self._uri, check_same_thread=False, isolation_level=None,
+            cached_statements=self.statement_cache
+        )
+        for pragma, value in self.pragmas.items():
+            if not re.fullmatch(r"-?\w+", str(value)):
+                raise ValueError(f"Invalid value for PRAGMA {pragma}: {value!r}")
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if read_only:
+            # Читатели общего кэша остаются в сериализуемой изоляции: read_uncommitted показал бы
+            # незафиксированные строки транзакций /session, и они попали бы в кэш запросов.
+            # SQLITE_LOCKED во время чужой записи обрабатывает _retry_locked
+            conn.execute("PRAGMA query_only = 1")
+        return conn
+
+    @staticmethod
+    def _is_locked(error: Exception) -> bool:
+        """SQLITE_LOCKED: таблица занята другим соединением той же in-memory базы"""
+        message = str(error)
+        return "table is locked" in message or "schema is locked" in message
+
+    def _retry_locked(self, func, conn: sqlite3.Connection, *args, retry=None):
+        """
+        Повторяет операцию, пока таблицы заняты другим соединением общего кэша
+
+        busy_timeout на SQLITE_LOCKED не действует, поэтому ожидание - здесь.
+        Операция должна быть атомарной (запрос или транзакция с ROLLBACK при
+        ошибке); retry() - можно ли ещё повторять (потоковое чтение - пока
+        ничего не отдано).
+        """
+        if not self._uri:
+            return func(conn, *args)
+        deadline = time.monotonic() + self.LOCKED_TIMEOUT
+        delay = 0.001
+        while True:
+            try:
+                return func(conn, *args)
+            except (sqlite3.Error, BackendError) as e:
+                if not self._is_locked(e) or time.monotonic() >= deadline or (retry and not retry()):
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    async def _run(self, func, *args):
+        """Выполняет блокирующую операцию на соединении читателя"""
+        return await run_in_context(self._executor, self._with_connection, func, *args)
+
+    async def _run_write(self, func, *args):
+        """Выполняет блокирующую операцию на соединении писателя"""
+        self.writes_in_progress += 1
+        try:
+            return await run_in_context(self._write_executor, self._retry_locked, func, self._writer, *args)
+        finally:
+            self.writes_in_progress -= 1
+            self.local_writes += 1
+
+    def _with_connection(self, func, *args):
+        with timed("lease"):
+            conn = self._pool.get()
+        try:
+            return self._retry_locked(func, conn, *args)
+        finally:
+            with self._lock:
+                surplus = self._surplus > 0
+                if surplus:
+                    self._surplus -= 1
+            if surplus:
+                conn.close()
+            else:
+                self._pool.put(conn)
+
+    @staticmethod
+    def _execute(conn: sqlite3.Connection, query: str, params: Any) -> List[Dict[str, Any]]:
+        try:
+            with timed("execute"):
+                cursor = conn.execute(query, params if params is not None else ())
+            if cursor.description is None:
+                return [{"rows_affected": cursor.rowcount, "last_insert_id": cursor.lastrowid}]
+            columns = [column[0] for column in cursor.description]
+            with timed("fetch"):
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        if classify_statement(query) == "read":
+            return await self._run(self._execute, query, params)
+        return await self._run_write(self._execute, query, params)
+
+    async def open_transaction(self) -> "SQLiteTransaction":
+        """Транзакция на отдельном соединении (соединения переиспользуются)"""
+        with self._lock:
+            conn = self._session_pool.pop() if self._session_pool else None
+        if conn is None:
+            conn = self._connect()
+        transaction = SQLiteTransaction(self, conn)
+        try:
+            await transaction.execute("BEGIN")
+        except BackendError:
+            conn.close()
+            raise
+        return transaction
+
+    def _release_session_connection(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._session_pool.append(conn)
+
+    def settings(self) -> Dict[str, Any]:
+        """Фактические настройки соединения писателя"""
+        def read(conn):
+            return {
+                pragma: conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                for pragma in ("journal_mode", "synchronous", "mmap_size", "cache_size")
+            }
+        return self._write_executor.submit(read, self._writer).result()
+
+    async def replication_lag(self) -> float:
+        return 0.0
+
+    # Каталог
+    @staticmethod
+    def _get_tables(conn: sqlite3.Connection) -> List[str]:
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _get_table_schema(conn: sqlite3.Connection, table: str) -> List[Dict[str, Any]]:
+        rows = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        return [
+            {
+                "name": name,
+                "type": column_type.lower(),
+                "nullable": not notnull and not pk,
+                "default": default,
+                "primary_key": bool(pk),
+            }
+            for _, name, column_type, notnull, default, pk in rows
+        ]
+
+    @staticmethod
+    def _table_stats(conn: sqlite3.Connection, table: str) -> Dict[str, Any]:
+        # Оценка строк из sqlite_stat1 (после ANALYZE), иначе max(rowid) - один спуск по B-дереву
+        # вместо count(*), который читает всю таблицу; для WITHOUT ROWID оценки нет
+        estimated_rows = None
+        try:
+            stat = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? ORDER BY idx IS NOT NULL LIMIT 1", (table,)
+            ).fetchone()
+            if stat:
+                estimated_rows = int(stat[0].split()[0])
+        except sqlite3.Error:
+            pass
+        if estimated_rows is None:
+            try:
+                last = conn.execute(f"SELECT max(rowid) FROM {quote_identifier(table)}").fetchone()[0]
+                estimated_rows = max(int(last or 0), 0)
+            except sqlite3.Error:
+                pass
+
+        # Размер таблицы и её индексов из dbstat (если SQLite собран с SQLITE_ENABLE_DBSTAT_VTAB)
+        size_mb = None
+        try:
+            size = conn.execute(
+                "SELECT sum(pgsize) FROM dbstat WHERE name = ? "
+                "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?)",
+                (table, table),
+            ).fetchone()[0]
+            if size is not None:
+                size_mb = round(size / (1024 * 1024), 3)
+        except sqlite3.Error:
+            pass
+        return {"estimated_rows": estimated_rows, "size_mb": size_mb}
+
+    async def get_tables(self) -> List[str]:
+        return await self._run(self._get_tables)
+
+    async def get_table_schema(self, table: str) -> List[Dict[str, Any]]:
+        return await self._run(self._get_table_schema, table)
+
+    async def table_stats(self, table: str) -> Dict[str, Any]:
+        try:
+            return await self._run(self._table_stats, table)
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    @staticmethod
+    def _get_indexes(conn: sqlite3.Connection, table: str) -> List[Dict[str, Any]]:
+        indexes = []
+        for row in conn.execute(f"PRAGMA index_list({quote_identifier(table)})").fetchall():
+            name = row[1]
+            columns = [info[2] for info in conn.execute(f"PRAGMA index_info({quote_identifier(name)})")]
+            indexes.append({"name": name, "columns": columns, "unique": bool(row[2]),
+                            "partial": bool(row[4]) if len(row) > 4 else False})
+        return indexes
+
+    async def get_indexes(self, table: str) -> List[Dict[str, Any]]:
+        """Индексы таблицы: имя, колонки по порядку, уникальность"""
+        try:
+            return await self._run(self._get_indexes, table)
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    @staticmethod
+    def _backup(conn: sqlite3.Connection, path: str) -> int:
+        target = sqlite3.connect(path)
+        try:
+            conn.backup(target)
+            return target.execute("PRAGMA page_count").fetchone()[0] * target.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            target.close()
+
+    async def database_size(self) -> int:
+        """Размер базы в байтах"""
+        return await self._run(
+            lambda conn: conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        )
+
+    async def scratch_copy(self, path: str) -> int:
+        """Согласованная копия базы в файл path (online backup API); возвращает её размер"""
+        try:
+            return await self._run(self._backup, path)
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    # Планы выполнения
+    PLAN_ACCESS = re.compile(
+        r"^(SCAN|SEARCH) (\S+)(?: AS \S+)?"
+        r"(?: USING (?:(COVERING )?INDEX (\S+)|(INTEGER PRIMARY KEY|PRIMARY KEY)))?(?: \((.*)\))?"
+    )
+    PLAN_OPERATIONS = (
+        ("USE TEMP B-TREE FOR ORDER BY", "sort"),
+        ("USE TEMP B-TREE", "temp_btree"),
+        ("SCALAR SUBQUERY", "subquery"),
+        ("CORRELATED", "subquery"),
+        ("LIST SUBQUERY", "subquery"),
+        ("CO-ROUTINE", "coroutine"),
+        ("MATERIALIZE", "materialize"),
+        ("COMPOUND QUERY", "compound"),
+        ("LEFT-MOST SUBQUERY", "compound_part"),
+        ("UNION", "compound_part"),
+        ("INTERSECT", "compound_part"),
+        ("EXCEPT", "compound_part"),
+        ("MULTI-INDEX OR", "multi_index_or"),
+        ("INDEX ", "index_or_term"),
+        ("SCAN CONSTANT ROW", "constant"),
+    )
+
+    @classmethod
+    def _plan_node(cls, detail: str, aliases: Dict[str, str],
+                   table_rows: Dict[str, Optional[int]], index_stats: Dict[str, List[int]]) -> Dict[str, Any]:
+        """Узел плана по строке EXPLAIN QUERY PLAN с оценкой числа строк"""
+        for prefix, operation in cls.PLAN_OPERATIONS:
+            if detail.startswith(prefix):
+                return {"operation": operation, "detail": detail}
+        match = cls.PLAN_ACCESS.match(detail)
+        if not match:
+            return {"operation": "other", "detail": detail}
+
+        kind, name, covering, index, primary_key, terms = match.groups()
+        table = aliases.get(name.lower(), name)
+        node: Dict[str, Any] = {
+            "operation": kind.lower(),
+            "detail": detail,
+            "table": table,
+            "index": index or ("PRIMARY KEY" if primary_key else None),
+            "covering": bool(covering),
+        }
+        rows = table_rows.get(table)
+        equalities = len(re.findall(r"\w+=\?", terms or ""))
+        if kind == "SCAN" or not terms:
+            node["estimated_rows"] = rows
+        elif primary_key and equalities:
+            node["estimated_rows"] = 1
+        elif index and equalities and index in index_stats:
+            # sqlite_stat1: "всего строк, строк на значение первых 1..N колонок"
+            stat = index_stats[index]
+            node["estimated_rows"] = stat[min(equalities, len(stat) - 1)]
+        return node
+
+    @classmethod
+    def _explain(cls, conn: sqlite3.Connection, query: str, params: Any) -> Dict[str, Any]:
+        try:
+            raw = [
+                {"id": node_id, "parent": parent, "detail": detail}
+                for node_id, parent, _, detail in conn.execute(
+                    f"EXPLAIN QUERY PLAN {query}", params if params is not None else ()
+                ).fetchall()
+            ]
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+        aliases = table_aliases(query)
+        index_stats: Dict[str, List[int]] = {}
+        try:
+            for index, stat in conn.execute("SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL"):
+                index_stats[index] = [int(value) for value in stat.split() if value.isdigit()]
+        except sqlite3.Error:
+            pass
+        table_rows: Dict[str, Optional[int]] = {}
+        for detail in [row["detail"] for row in raw]:
+            match = cls.PLAN_ACCESS.match(detail)
+            if match:
+                table = aliases.get(match.group(2).lower(), match.group(2))
+                if table not in table_rows:
+                    try:
+                        table_rows[table] = cls._table_stats(conn, table)["estimated_rows"]
+                    except sqlite3.Error:
+                        table_rows[table] = None
+
+        root: Dict[str, Any] = {"operation": "query", "detail": query, "children": []}
+        nodes = {0: root}
+        for row in raw:
+            node = cls._plan_node(row["detail"], aliases, table_rows, index_stats)
+            node["children"] = []
+            nodes[row["id"]] = node
+            nodes.get(row["parent"], root)["children"].append(node)
+        return {"plan": root, "raw": raw}
+
+    async def explain(self, query: str, params: Any = None, analyze: bool = False) -> Dict[str, Any]:
+        """
+        План из EXPLAIN QUERY PLAN в нормализованном виде
+
+        SQLite не сообщает стоимость и фактические строки по узлам: оценки
+        берутся из sqlite_stat1, а analyze выполняет запрос и заполняет
+        фактическое число строк и время для корня плана.
+        """
+        result = await self._run(self._explain, query, params)
+        result["execution_time"] = None
+        if analyze:
+            started = time.perf_counter()
+            rows = await self._run(self._execute, query, params)
+            result["execution_time"] = (time.perf_counter() - started) * 1000
+            result["plan"]["actual_rows"] = len(rows)
+        return result
+
+    # Параллельное сканирование
+    def _scan_key(self, conn: sqlite3.Connection, table: str) -> Tuple[str, List[str]]:
+        """Возвращает ключ для разбиения (INTEGER PRIMARY KEY или rowid) и колонки таблицы"""
+        info = conn.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+        if not info:
+            raise BackendError(f"no such table: {table}")
+        columns = [row[1] for row in info]
+        pk = [row for row in info if row[5]]
+        if len(pk) == 1 and pk[0][2].upper() == "INTEGER":
+            return pk[0][1], columns
+        return "rowid", columns
+
+    def _scan_ranges(self, conn: sqlite3.Connection, table: str, partitions: int,
+                     min_rows: int) -> Tuple[str, List[str], List[Tuple[int, int]]]:
+        key, columns = self._scan_key(conn, table)
+        quoted = quote_identifier(table)
+        low, high = conn.execute(
+            f"SELECT min({quote_identifier(key)}), max({quote_identifier(key)}) FROM {quoted}"
+        ).fetchone()
+        if low is None:
+            return key, columns, []
+
+        # Оценка числа строк из sqlite_stat1 (после ANALYZE), иначе по ширине диапазона
+        estimate = high - low + 1
+        try:
+            stat = conn.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND idx IS NULL", (table,)
+            ).fetchone()
+            if stat:
+                estimate = int(stat[0].split()[0])
+        except sqlite3.Error:
+            pass
+
+        partitions = max(1, min(partitions, estimate // max(min_rows, 1) or 1))
+        step = (high - low + 1 + partitions - 1) // partitions
+        ranges = []
+        start = low
+        while start <= high:
+            ranges.append((start, min(start + step, high + 1)))
+            start += step
+        return key, columns, ranges
+
+    async def scan_ranges(self, table: str, partitions: int,
+                          min_rows: int = 10000) -> Tuple[str, List[str], List[Tuple[int, int]]]:
+        """Разбивает таблицу на диапазоны ключа по статистике"""
+        try:
+            return await self._run(self._scan_ranges, table, partitions, min_rows)
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    @staticmethod
+    def scan_partition(conn: sqlite3.Connection, table: str, key: str, columns: List[str],
+                       bounds: Tuple[int, int], order_by: str, batch_size: int, emit):
+        """Читает диапазон ключа пачками; emit возвращает False, если чтение нужно прервать"""
+        quoted_key = quote_identifier(key)
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(quote_identifier(c) for c in columns)} FROM {quote_identifier(table)} "
+                f"WHERE {quoted_key} >= ? AND {quoted_key} < ? ORDER BY {quote_identifier(order_by)}",
+                bounds,
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows or not emit([dict(zip(columns, row)) for row in rows]):
+                    break
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, sql: str, params: List[Any], batch_size: int, emit):
+        try:
+            cursor = conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows or not emit([dict(zip(columns, row)) for row in rows]):
+                    break
+        except sqlite3.Error as e:
+            raise BackendError(str(e))
+
+    async def select_batches(self, table: str, columns: Optional[List[str]] = None,
+                             filters: Optional[Dict[str, Any]] = None, batch_size: int = 1000):
+        """Потоковое чтение таблицы с проекцией и фильтром на стороне SQLite"""
+        where, params = compile_filters(filters)
+        projection = ", ".join(quote_identifier(c) for c in columns) if columns else "*"
+        sql = f"SELECT {projection} FROM {quote_identifier(table)}"
+        if where:
+            sql += f" WHERE {where}"
+        async for batch in self.query_batches(sql, params, batch_size):
+            yield batch
+
+    async def query_batches(self, sql: str, params: Any = None, batch_size: int = 1000):
+        """Потоковое чтение результата запроса пачками без материализации в памяти"""
+        params = params or []
+        sink: "queue.Queue" = queue.Queue(4)
+        stop = threading.Event()
+
+        def emit(item) -> bool:
+            while not stop.is_set():
+                try:
+                    sink.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(conn):
+            sent = []
+
+            def send(batch) -> bool:
+                sent.append(True)
+                return emit((0, batch))
+
+            try:
+                self._retry_locked(self._select, conn, sql, params, batch_size, send, retry=lambda: not sent)
+            except Exception as e:
+                emit((0, e))
+                return
+            emit((0, None))
+
+        self.submit(produce)
+        try:
+            while True:
+                _, batch = await take_from_queue(sink)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            stop.set()
+
+    @staticmethod
+    def _bulk_insert(conn: sqlite3.Connection, sql: str, rows: List[tuple]) -> int:
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise BackendError(str(e))
+        return len(rows)
+
+    @staticmethod
+    def _execute_batch(conn: sqlite3.Connection, statements: List[Tuple[str, List[Any]]]) -> int:
+        affected = 0
+        try:
+            conn.execute("BEGIN")
+            for sql, rows in statements:
+                affected += conn.executemany(sql, [row if row is not None else () for row in rows]).rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise BackendError(str(e))
+        return affected
+
+    async def execute_batch(self, statements: List[Tuple[str, List[Any]]]) -> int:
+        """Несколько запросов, каждый со списком наборов параметров, одной транзакцией писателя"""
+        return await self._run_write(self._execute_batch, statements)
+
+    async def bulk_insert(self, table: str, columns: List[str], rows: List[tuple]) -> int:
+        """Самый быстрый путь загрузки в SQLite: executemany пачкой в одной транзакции писателя"""
+        sql = (
+            f"INSERT INTO {quote_identifier(table)} ({', '.join(quote_identifier(c) for c in columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})"
+        )
+        return await self._run_write(self._bulk_insert, sql, rows)
+
+    def _data_version(self) -> int:
+        if self._watcher is None:
+            self._watcher = self._connect(read_only=True)
+        return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    async def data_version(self) -> Optional[int]:
+        """Версия данных, меняется при записи другим соединением (None для in-memory базы)"""
+        if self._uri:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._data_version)
+
+    def submit(self, func, *args) -> Future:
+        """Запускает блокирующую операцию на соединении из пула, не дожидаясь результата"""
+        return self._executor.submit(self._with_connection, func, *args)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        self._write_executor.shutdown(wait=True)
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+        for conn in self._session_pool:
+            conn.close()
+        if self._watcher is not None:
+            self._watcher.close()
+        self._writer.close()
+
+
+class SQLiteTransaction:
+    """Транзакция SQLite, закреплённая за одним соединением"""
+
+    def __init__(self, backend: SQLiteBackend, conn: sqlite3.Connection):
+        self.backend = backend
+        self.conn = conn
+        self.closed = False
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        return await run_in_context(None, self.backend._retry_locked, self.backend._execute, self.conn, query, params)
+
+    async def _finish(self, statement: str):
+        if self.closed:
+            return
+        self.closed = True
+        self.backend.writes_in_progress += 1
+        try:
+            await self.execute(statement)
+        except BackendError:
+            # Соединение в неизвестном состоянии - не возвращаем его в пул
+            self.conn.close()
+            raise
+        finally:
+            self.backend.writes_in_progress -= 1
+            self.backend.local_writes += 1
+        self.backend._release_session_connection(self.conn)
+
+    async def commit(self):
+        await self._finish("COMMIT")
+
+    async def rollback(self):
+        await self._finish("ROLLBACK")
+
+
+class SimulatedTransaction:
+    """Имитация транзакции: запросы выполняются как обычно"""
+
+    def __init__(self, backend: SimulatedBackend):
+        self.backend = backend
+        self.closed = False
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        return await self.backend.execute(query, params)
+
+    async def commit(self):
+        self.closed = True
+
+    async def rollback(self):
+        self.closed = True
+
+
+class RedisBackend:
+    """
+    Источник данных Redis: вместо SQL - команды Redis (HGETALL user:1, SCAN MATCH user:* ...)
+
+    Перебор ключей и коллекций идёт только курсором (SCAN, HSCAN, SSCAN,
+    ZSCAN): каждая итерация - короткая команда, которая не блокирует сервер
+    Redis, а MATCH и COUNT передаются ему как есть. KEYS выполняется как
+    SCAN MATCH. Через query_batches результат читается пачками по мере
+    продвижения курсора; execute собирает его целиком, но не больше max_rows
+    строк. SCAN может вернуть ключ повторно, если он менялся во время обхода.
+    """
+
+    SCAN_COMMANDS = {"scan", "hscan", "sscan", "zscan", "keys"}
+    # Кэш результатов помечает записи таблицами запроса, а у команд Redis их нет:
+    # SET/HSET не сбросили бы прочитанное, поэтому источник идёт мимо кэша
+    cacheable = False
+
+    def __init__(self, name: str, url: str, scan_count: int = 1000, max_rows: int = 100000, client=None):
+        self.name = name
+        self.scan_count = scan_count
+        self.max_rows = max_rows
+        if client is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                raise ValueError("Redis datasource requires the 'redis' package: pip install redis")
+            client = redis_asyncio.from_url(url, decode_responses=True)
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url) -> "RedisBackend":
+        """redis://host:6379/0?scan_count=1000&max_rows=100000&name=cache"""
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return cls(
+            name=query.get("name", url.hostname or "redis"),
+            url=url._replace(query="").geturl(),
+            scan_count=int(query.get("scan_count", "1000")),
+            max_rows=int(query.get("max_rows", "100000")),
+        )
+
+    @staticmethod
+    def parse(query: str, params: Any = None) -> List[str]:
+        """Команда и аргументы; '?' заменяются параметрами по порядку"""
+        try:
+            args = shlex.split(query)
+        except ValueError as e:
+            raise BackendError(f"Malformed Redis command: {e}")
+        if not args:
+            raise BackendError("Empty Redis command")
+        values = iter(params or [])
+        try:
+            return [str(next(values)) if arg == "?" else arg for arg in args]
+        except StopIteration:
+            raise BackendError("Not enough parameters for Redis command")
+
+    def _scan(self, args: List[str]):
+        """Асинхронный итератор строк для SCAN-подобной команды"""
+        command = args[0].lower()
+        if command == "keys":
+            # KEYS блокирует Redis на всё время обхода - вместо него курсор
+            if len(args) != 2:
+                raise BackendError("KEYS takes exactly one pattern")
+            command, args = "scan", ["scan", "match", args[1]]
+        position = 1
+        if command != "scan":
+            if len(args) < 2:
+                raise BackendError(f"{command.upper()} requires a key")
+            key = args[1]
+            position = 2
+        options = args[position:]
+        if command == "scan" and options and options[0].isdigit():
+            # Курсор ведёт сервер AetherQuery: обход всегда с начала
+            options = options[1:]
+        if len(options) % 2:
+            raise BackendError(f"{command.upper()} options must be pairs: MATCH pattern, COUNT n, TYPE type")
+        pairs = {name.lower(): value for name, value in zip(options[::2], options[1::2])}
+        unknown = set(pairs) - ({"match", "count", "type"} if command == "scan" else {"match", "count"})
+        if unknown:
+            raise BackendError(f"Unsupported {command.upper()} options: {', '.join(sorted(unknown))}")
+        match = pairs.get("match")
+        count = int(pairs.get("count", self.scan_count))
+
+        async def rows():
+            if command == "scan":
+                async for name in self.client.scan_iter(match=match, count=count, _type=pairs.get("type")):
+                    yield {"key": name}
+            elif command == "hscan":
+                async for field, value in self.client.hscan_iter(key, match=match, count=count):
+                    yield {"field": field, "value": value}
+            elif command == "sscan":
+                async for member in self.client.sscan_iter(key, match=match, count=count):
+                    yield {"member": member}
+            else:
+                async for member, score in self.client.zscan_iter(key, match=match, count=count):
+                    yield {"member": member, "score": score}
+
+        return rows()
+
+    @staticmethod
+    def _rows(result: Any) -> List[Dict[str, Any]]:
+        if isinstance(result, dict):
+            return [{"field": field, "value": value} for field, value in result.items()]
+        if isinstance(result, (list, tuple, set)):
+            return [{"value": value} for value in result]
+        return [{"result": result}]
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        args = self.parse(query, params)
+        try:
+            with timed("execute"):
+                if args[0].lower() not in self.SCAN_COMMANDS:
+                    return self._rows(await self.client.execute_command(*args))
+                rows = []
+                async for row in self._scan(args):
+                    rows.append(row)
+                    if len(rows) > self.max_rows:
+                        raise BackendError(
+                            f"{args[0].upper()} matched more than {self.max_rows} rows: "
+                            f"stream it with batch_size or narrow MATCH"
+                        )
+                return rows
+        except BackendError:
+            raise
+        except Exception as e:
+            raise BackendError(str(e))
+
+    async def query_batches(self, query: str, params: Any = None, batch_size: int = 1000):
+        """Пачки строк по мере продвижения курсора SCAN (остальные команды - одной пачкой)"""
+        args = self.parse(query, params)
+        if args[0].lower() not in self.SCAN_COMMANDS:
+            rows = await self.execute(query, params)
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+        batch: List[Dict[str, Any]] = []
+        try:
+            async for row in self._scan(args):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        except BackendError:
+            raise
+        except Exception as e:
+            raise BackendError(str(e))
+        if batch:
+            yield batch
+
+    async def replication_lag(self) -> float:
+        return 0.0
+
+    # Каталога таблиц у Redis нет
+    async def get_tables(self) -> List[str]:
+        return []
+
+    async def get_table_schema(self, table: str) -> List[Dict[str, Any]]:
+        return []
+
+    async def table_stats(self, table: str) -> Dict[str, Any]:
+        return {"estimated_rows": 0}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# Бэкенд по схеме URL: класс или путь "модуль:Класс". Модуль по пути
+# импортируется при первом источнике с этой схемой, поэтому драйверы
+# внешних СУБД не загружаются, пока ими никто не пользуется
+BACKENDS: Dict[str, Any] = {
+    "simulated": SimulatedBackend,
+    "sqlite": SQLiteBackend,
+    "redis": RedisBackend,
+}
+
+
+def register_backend(scheme: str, target: Any):
+    """Регистрирует бэкенд для схемы: класс или 'package.module:Class'"""
+    BACKENDS[scheme] = target
+
+
+def resolve_backend(scheme: str):
+    """Класс бэкенда для схемы; ленивые записи реестра импортируются здесь"""
+    target = BACKENDS.get(scheme)
+    if isinstance(target, str):
+        module_name, _, attr = target.partition(":")
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            raise ValueError(f"Datasource scheme {scheme!r} requires {module_name}: {e}")
+        target = BACKENDS[scheme] = getattr(module, attr)
+        logger.info(f"Loaded backend {scheme}:// from {module_name}")
+    return target
+
+
+def create_backend(url: str):
+    """Создает бэкенд по URL вида scheme://..."""
+    parsed = urlparse(url)
+    backend_cls = resolve_backend(parsed.scheme)
+    if backend_cls is None:
+        raise ValueError(f"Unsupported datasource scheme: {parsed.scheme!r}")
+    return backend_cls.from_url(parsed)
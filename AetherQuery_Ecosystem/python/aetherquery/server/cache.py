@@ -0,0 +1,404 @@
+"""Кэш результатов запросов и метаданных, статистика частых запросов"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from .backends import BackendError
+from .sql import canonical_query, extract_tables, query_fingerprint
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+def encode_result(rows: List[Dict[str, Any]], compress_threshold: int = 1024) -> bytes:
+    """Компактная сериализация: колонки + массивы значений, zlib для больших результатов"""
+    columns: List[str] = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    payload = json.dumps(
+        {"c": columns, "r": [[row.get(c) for c in columns] for row in rows]},
+        separators=(",", ":"), default=str
+    ).encode()
+    if len(payload) >= compress_threshold:
+        return b"z" + zlib.compress(payload, 6)
+    return b"j" + payload
+
+
+def decode_result(blob: bytes) -> List[Dict[str, Any]]:
+    payload = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    decoded = json.loads(payload)
+    columns = decoded["c"]
+    return [dict(zip(columns, values)) for values in decoded["r"]]
+
+
+class MemoryCacheStore:
+    """Кэш в памяти процесса (LRU), для одного экземпляра сервера"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        # Обратный индекс: вытесненная или истёкшая запись уходит и из наборов тегов
+        self._key_tags: Dict[str, List[str]] = {}
+
+    def _forget(self, key: str):
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[key]
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    async def set(self, key: str, value: bytes, ttl: float, tags: List[str]):
+        self._forget(key)
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        if tags:
+            self._key_tags[key] = list(tags)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._forget(evicted)
+
+    async def invalidate(self, tags: List[str]) -> int:
+        removed = 0
+        for tag in tags:
+            for key in list(self._tags.get(tag, ())):
+                self._forget(key)
+                if self._entries.pop(key, None) is not None:
+                    removed += 1
+        return removed
+
+    async def close(self):
+        pass
+
+
+class RedisCacheStore:
+    """Общий кэш в Redis для нескольких экземпляров сервера"""
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            raise ValueError("Redis cache requires the 'redis' package: pip install redis")
+        self.client = redis_asyncio.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float, tags: List[str]):
+        expire = max(1, int(ttl))
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(key, value, ex=expire)
+            for tag in tags:
+                pipe.sadd(tag, key)
+                # Набор тега живёт не меньше самой долгой записи в нём
+                pipe.expire(tag, expire, gt=True)
+                pipe.expire(tag, expire, nx=True)
+            await pipe.execute()
+
+    async def invalidate(self, tags: List[str]) -> int:
+        # SSCAN вместо SMEMBERS: тег популярной таблицы может держать миллионы ключей,
+        # а SMEMBERS вернул бы их одним ответом, заблокировав Redis
+        removed = 0
+        for tag in tags:
+            keys: List[bytes] = []
+            async for key in self.client.sscan_iter(tag, count=500):
+                keys.append(key)
+                if len(keys) >= 500:
+                    removed += await self.client.delete(*keys)
+                    keys = []
+            if keys:
+                removed += await self.client.delete(*keys)
+            await self.client.delete(tag)
+        return removed
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_cache_store(url: str):
+    """Создает хранилище кэша по URL: memory:// или redis://"""
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        max_entries = parse_qs(urlparse(url).query).get("max_entries", ["10000"])[0]
+        return MemoryCacheStore(int(max_entries))
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisCacheStore(url)
+    raise ValueError(f"Unsupported cache scheme: {scheme!r}")
+
+
+class QueryCache:
+    """
+    Cache-aside слой перед источником данных с инвалидацией по тегам-таблицам
+
+    Запись хранит момент, до которого она свежая (по часам, а не monotonic:
+    Redis общий для нескольких серверов). При stale_ttl > 0 запись живёт в
+    хранилище ещё stale_ttl секунд после TTL и отдаётся как устаревшая -
+    источник данных обновляет её в фоне.
+    """
+
+    FRESHNESS = struct.Struct("!d")
+
+    def __init__(self, store, ttl: float = 60.0, jitter: float = 0.1, prefix: str = "aq", stale_ttl: float = 0.0):
+        self.store = store
+        self.ttl = ttl
+        self.jitter = jitter
+        self.prefix = prefix
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.prewarmed = 0
+
+    def key(self, datasource: str, query: str, params: Any) -> str:
+        """Ключ: отпечаток формы запроса + хеш текста с параметрами (литералы сравниваются точно)"""
+        digest = hashlib.sha1(
+            (canonical_query(query) + "\0" + json.dumps(params, sort_keys=True, default=str)).encode()
+        ).hexdigest()[:20]
+        return f"{self.prefix}:q:{datasource}:{query_fingerprint(query)}:{digest}"
+
+    def tag(self, datasource: str, table: str) -> str:
+        return f"{self.prefix}:t:{datasource}:{table}"
+
+    def _unpack(self, blob: bytes) -> Tuple[float, bytes]:
+        """Момент, до которого запись свежая, и сам результат"""
+        if blob[:1] == b"s":
+            return self.FRESHNESS.unpack_from(blob, 1)[0], blob[1 + self.FRESHNESS.size:]
+        # Запись без метки (от предыдущей версии сервера) свежая, пока жива в хранилище
+        return float("inf"), blob
+
+    async def _read(self, key: str) -> Optional[bytes]:
+        try:
+            return await self.store.get(key)
+        except Exception as e:
+            # Недоступный кэш не должен ронять запросы
+            self.errors += 1
+            logger.warning(f"Cache get failed: {e}")
+            return None
+
+    async def lookup(self, datasource: str, query: str, params: Any) -> Optional[Tuple[List[Dict[str, Any]], bool]]:
+        """Результат из кэша и признак того, что он устарел и его пора обновить"""
+        blob = await self._read(self.key(datasource, query, params))
+        if blob is None:
+            self.misses += 1
+            return None
+        fresh_until, payload = self._unpack(blob)
+        stale = self.stale_ttl > 0 and fresh_until <= time.time()
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return decode_result(payload), stale
+
+    async def get(self, datasource: str, query: str, params: Any) -> Optional[List[Dict[str, Any]]]:
+        found = await self.lookup(datasource, query, params)
+        return found[0] if found is not None else None
+
+    async def fresh_until(self, datasource: str, query: str, params: Any) -> Optional[float]:
+        """До какого момента запись свежая (None - записи нет); счётчики не меняются"""
+        blob = await self._read(self.key(datasource, query, params))
+        return self._unpack(blob)[0] if blob is not None else None
+
+    async def put(self, datasource: str, query: str, params: Any, rows: List[Dict[str, Any]]):
+        ttl = self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        tags = [self.tag(datasource, table) for table in extract_tables(query)]
+        blob = b"s" + self.FRESHNESS.pack(time.time() + ttl) + encode_result(rows)
+        try:
+            await self.store.set(self.key(datasource, query, params), blob, ttl + self.stale_ttl, tags)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache put failed: {e}")
+
+    async def invalidate(self, datasource: str, tables: List[str]):
+        if not tables:
+            return
+        try:
+            self.invalidations += await self.store.invalidate([self.tag(datasource, t) for t in tables])
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache invalidation failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "invalidated_entries": self.invalidations,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "prewarmed": self.prewarmed,
+        }
+
+
+def make_etag(payload: Any) -> str:
+    return '"' + hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:20] + '"'
+
+
+class MetadataCache:
+    """Кэш каталога источника данных: список таблиц, схемы, оценки строк и размера"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._tables: Optional[Tuple[Dict[str, Any], str]] = None
+        self._table_info: Dict[str, Tuple[Dict[str, Any], str]] = {}
+        self.loads = 0
+        self.hits = 0
+
+    async def tables(self) -> Tuple[Dict[str, Any], str]:
+        """Список таблиц и ETag"""
+        if self._tables is None:
+            self._tables = await self._load_tables()
+        else:
+            self.hits += 1
+        return self._tables
+
+    async def table(self, name: str) -> Tuple[Dict[str, Any], str]:
+        """Описание таблицы и ETag"""
+        entry = self._table_info.get(name)
+        if entry is None:
+            entry = await self._load_table(name)
+            self._table_info[name] = entry
+        else:
+            self.hits += 1
+        return entry
+
+    async def _load_tables(self) -> Tuple[Dict[str, Any], str]:
+        self.loads += 1
+        tables = []
+        for name in await self.backend.get_tables():
+            stats = await self.backend.table_stats(name)
+            tables.append({"name": name, "type": "table", "rows": stats["estimated_rows"]})
+        payload = {"tables": tables}
+        return payload, make_etag(payload)
+
+    async def _load_table(self, name: str) -> Tuple[Dict[str, Any], str]:
+        self.loads += 1
+        columns = await self.backend.get_table_schema(name)
+        if not columns:
+            raise BackendError(f"no such table: {name}")
+        payload = {"name": name, "columns": columns, **await self.backend.table_stats(name)}
+        return payload, make_etag(payload)
+
+    def invalidate(self, tables: Optional[List[str]] = None):
+        """Сбрасывает кэш (после DDL); без списка таблиц - целиком"""
+        self._tables = None
+        if not tables:
+            self._table_info.clear()
+            return
+        for table in tables:
+            self._table_info.pop(table, None)
+
+    async def refresh(self):
+        """Перечитывает закэшированные записи из каталога"""
+        if self._tables is not None:
+            self._tables = await self._load_tables()
+        for name in list(self._table_info):
+            try:
+                self._table_info[name] = await self._load_table(name)
+            except BackendError:
+                self._table_info.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"loads": self.loads, "hits": self.hits, "cached_tables": len(self._table_info)}
+
+
+# Частота форм запросов для прогрева кэша
+class QueryStats:
+    """
+    Затухающая частота кэшируемых форм запросов
+
+    Для каждой формы (query_fingerprint) хранится последний текст с
+    параметрами - его и повторяет прогрев. Частота затухает с периодом
+    полураспада HALF_LIFE, поэтому дашборд, который перестали открывать,
+    со временем уступает место новым запросам.
+    """
+
+    HALF_LIFE = 600.0
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.entries: Dict[str, Dict[str, Any]] = {}
+
+    def _score(self, entry: Dict[str, Any], now: float) -> float:
+        return entry["score"] * 0.5 ** ((now - entry["last_seen"]) / self.HALF_LIFE)
+
+    def record(self, query: str, params: Any, elapsed_ms: Optional[float] = None, weight: float = 1.0):
+        now = time.time()
+        fingerprint = query_fingerprint(query)
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            if len(self.entries) >= self.max_entries:
+                coldest = min(self.entries, key=lambda key: self._score(self.entries[key], now))
+                del self.entries[coldest]
+            entry = self.entries[fingerprint] = {
+                "fingerprint": fingerprint, "score": 0.0, "count": 0, "executions": 0,
+                "total_ms": 0.0, "last_seen": now,
+            }
+        entry["score"] = self._score(entry, now) + weight
+        entry["last_seen"] = now
+        entry["count"] += 1
+        entry["query"] = query
+        entry["params"] = params
+        if elapsed_ms is not None:
+            entry["executions"] += 1
+            entry["total_ms"] += elapsed_ms
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        now = time.time()
+        ranked = sorted(self.entries.values(), key=lambda entry: self._score(entry, now), reverse=True)
+        return [
+            {
+                "fingerprint": entry["fingerprint"],
+                "query": entry["query"],
+                "params": entry["params"],
+                "score": round(self._score(entry, now), 3),
+                "count": entry["count"],
+                "avg_ms": round(entry["total_ms"] / entry["executions"], 3) if entry["executions"] else None,
+            }
+            for entry in ranked[:limit]
+        ]
+
+    def save(self, path: str, limit: int):
+        """Сохраняет частые запросы, чтобы прогреть кэш после рестарта"""
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.top(limit), f, default=str)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> int:
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return 0
+        for entry in saved:
+            self.record(entry["query"], entry.get("params"), weight=entry.get("score") or 1.0)
+        return len(saved)
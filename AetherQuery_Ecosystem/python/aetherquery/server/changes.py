@@ -0,0 +1,108 @@
+"""Лента изменений источника данных для подписок"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+from .sql import LEADING_COMMENTS, extract_tables, is_ddl
+
+
+# Поток изменений
+class ChangeSubscription:
+    """Подписка на изменения с фильтром по таблицам"""
+
+    def __init__(self, tables: Optional[List[str]] = None, size: int = 1000):
+        self.tables = set(tables) if tables else None
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(size)
+        self.overflowed = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        # Изменение неизвестной таблицы касается всех
+        return self.tables is None or event["table"] is None or event["table"] in self.tables
+
+    def offer(self, event: Dict[str, Any]):
+        if self.overflowed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Медленный подписчик должен перечитать данные целиком
+            self.overflowed = True
+
+
+class ChangeFeed:
+    """
+    Изменения данных источника: внутренние обработчики и подписчики
+
+    Обработчики (инвалидация кэшей) вызываются до возврата из publish(),
+    поэтому чтение сразу после записи не получит устаревший результат.
+    Последние события хранятся для продолжения потока по Last-Event-ID.
+    """
+
+    def __init__(self, datasource: str, history: int = 1000):
+        self.datasource = datasource
+        self.seq = 0
+        self.history: "deque[Dict[str, Any]]" = deque(maxlen=history)
+        self.listeners: List[Any] = []
+        self.subscribers: List[ChangeSubscription] = []
+
+    def listen(self, callback):
+        """Регистрирует async обработчик списка событий"""
+        self.listeners.append(callback)
+
+    def subscribe(self, tables: Optional[List[str]] = None, after: Optional[int] = None) -> ChangeSubscription:
+        subscription = ChangeSubscription(tables)
+        if after is not None:
+            if self.history and after < self.history[0]["seq"] - 1:
+                subscription.overflowed = True
+            for event in self.history:
+                if event["seq"] > after:
+                    subscription.offer(event)
+        self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChangeSubscription):
+        if subscription in self.subscribers:
+            self.subscribers.remove(subscription)
+
+    async def publish(self, changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Публикует изменения {"table", "operation", "source"}"""
+        events = []
+        for change in changes:
+            self.seq += 1
+            events.append({
+                "seq": self.seq,
+                "datasource": self.datasource,
+                "table": change.get("table"),
+                "operation": change.get("operation", "write"),
+                "source": change.get("source", "server"),
+                "timestamp": time.time(),
+            })
+        if not events:
+            return events
+        self.history.extend(events)
+        for listener in self.listeners:
+            await listener(events)
+        for subscription in self.subscribers:
+            for event in events:
+                subscription.offer(event)
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "subscribers": len(self.subscribers)}
+
+
+def changes_from_queries(queries: List[str]) -> List[Dict[str, Any]]:
+    """События изменений по выполненным запросам записи"""
+    changes = []
+    for query in queries:
+        body = LEADING_COMMENTS.sub("", query).lstrip()
+        operation = body.split(None, 1)[0].lower() if body else "write"
+        if is_ddl(query):
+            operation = "ddl"
+        tables = extract_tables(query)
+        if not tables and operation == "ddl":
+            tables = [None]
+        changes.extend({"table": table, "operation": operation} for table in tables)
+    return changes
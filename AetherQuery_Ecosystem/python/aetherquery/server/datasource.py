@@ -0,0 +1,568 @@
+"""Источник данных: первичный узел, реплики и параллельное сканирование"""
+
+import asyncio
+import heapq
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+from .backends import BackendError, create_backend, take_from_queue
+from .cache import MetadataCache, QueryCache, QueryStats, create_cache_store
+from .changes import ChangeFeed, changes_from_queries
+from .diagnostics import SlowQueryLog
+from .limits import ConcurrencyLimiter
+from .models import DatasourceConfig
+from .sql import classify_statement, is_ddl, query_fingerprint
+from .timings import current_timings, timed
+from .write_behind import WriteBehindBuffer
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+class DatasourceNode:
+    """Узел источника данных (primary или реплика) с учетом нагрузки"""
+
+    def __init__(self, backend, role: str, config: Optional[DatasourceConfig] = None):
+        self.backend = backend
+        self.role = role
+        self.in_flight = 0
+        self.queries = 0
+        self.lag = 0.0
+        self.healthy = True
+        self.limiter: Optional[ConcurrencyLimiter] = None
+        if config is not None and config.concurrency_limit != "fixed":
+            self.limiter = ConcurrencyLimiter(
+                config.concurrency_limit,
+                limit=getattr(backend, "pool_size", config.min_concurrency),
+                min_limit=config.min_concurrency,
+                max_limit=config.max_concurrency,
+                window=config.concurrency_window,
+                tolerance=config.latency_tolerance,
+                on_change=getattr(backend, "resize", None),
+            )
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "in_flight": self.in_flight,
+            "queries": self.queries,
+            "lag": self.lag,
+            "healthy": self.healthy,
+            **({"concurrency": self.limiter.stats()} if self.limiter is not None else {}),
+        }
+
+
+class Datasource:
+    """Источник данных с разделением чтения и записи между primary и репликами"""
+
+    def __init__(self, config: DatasourceConfig):
+        self.config = config
+        self.primary = DatasourceNode(create_backend(config.primary), "primary", config)
+        self.replicas = [DatasourceNode(create_backend(url), "replica", config) for url in config.replicas]
+        self._last_write: Dict[str, float] = {}
+        cacheable = getattr(self.primary.backend, "cacheable", True)
+        if config.cache and not cacheable:
+            logger.warning(f"Datasource {config.name!r}: result cache is not supported by its backend, disabled")
+        self.cache = (
+            QueryCache(create_cache_store(config.cache), config.cache_ttl, config.cache_ttl_jitter,
+                       stale_ttl=config.cache_stale_ttl)
+            if config.cache and cacheable else None
+        )
+        self.metadata = MetadataCache(self.primary.backend)
+        self.changes = ChangeFeed(config.name)
+        self.changes.listen(self._invalidate)
+        self._data_version: Optional[Tuple[int, int]] = None
+        self.slow_queries = SlowQueryLog(config.slow_query_ms, config.slow_query_log_size)
+        self._plan_captures: set = set()
+        self.query_stats = QueryStats()
+        # Ключи кэша, обновляемые в фоне, и поколение кэша: обновление, начатое
+        # до инвалидации, не должно вернуть в кэш старый результат
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._cache_generation = 0
+        self.write_behind: Optional[WriteBehindBuffer] = None
+        # Журнал без правил тоже поднимается: подтверждённые записи из него должны дойти до базы
+        if config.write_behind or config.write_behind_log:
+            if not hasattr(self.primary.backend, "execute_batch"):
+                raise ValueError(f"Datasource {config.name!r} does not support write-behind batches")
+            self.write_behind = WriteBehindBuffer(
+                config.name, config, self.primary.backend.execute_batch, self.invalidate_after_write
+            )
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    @property
+    def nodes(self) -> List[DatasourceNode]:
+        return [self.primary] + self.replicas
+
+    def route(self, query: str, options: Optional[Dict[str, Any]] = None,
+              client_key: Optional[str] = None) -> DatasourceNode:
+        """Выбирает узел для запроса"""
+        options = options or {}
+        if options.get("transaction") or not self.replicas:
+            return self.primary
+        if not options.get("read_only") and classify_statement(query) != "read":
+            return self.primary
+        if self._recently_wrote(client_key):
+            return self.primary
+
+        candidates = [
+            node for node in self.replicas
+            if node.healthy and node.lag <= self.config.max_replica_lag
+        ]
+        if not candidates:
+            return self.primary
+        # Меньше нагрузка и отставание - выше приоритет
+        return min(candidates, key=lambda node: ((node.in_flight + 1) * (1 + node.lag), node.queries))
+
+    def _recently_wrote(self, client_key: Optional[str]) -> bool:
+        if not client_key or self.config.read_your_writes <= 0:
+            return False
+        last_write = self._last_write.get(client_key)
+        return last_write is not None and time.monotonic() - last_write < self.config.read_your_writes
+
+    def note_write(self, client_key: Optional[str]):
+        """Запоминает запись клиента для read-your-writes"""
+        if not client_key or self.config.read_your_writes <= 0:
+            return
+        now = time.monotonic()
+        self._last_write[client_key] = now
+        # Удаляем истекшие окна, чтобы словарь не рос бесконечно
+        if len(self._last_write) > 10000:
+            expired = [key for key, ts in self._last_write.items()
+                       if now - ts >= self.config.read_your_writes]
+            for key in expired:
+                del self._last_write[key]
+
+    async def execute(self, query: str, params: Any = None,
+                      options: Optional[Dict[str, Any]] = None,
+                      client_key: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[DatasourceNode]]:
+        """Выполняет запрос на выбранном узле (узел None - результат из кэша)"""
+        options = options or {}
+        kind = classify_statement(query)
+        if kind == "write" and self.write_behind is not None and not options.get("transaction"):
+            rule = self.write_behind.match(query)
+            if rule is not None:
+                # Подтверждаем сразу: запись уйдёт в базу со следующим пакетом
+                coalesced = await self.write_behind.submit(query, params, rule)
+                return [{"rows_affected": None, "buffered": True, "coalesced": coalesced}], self.primary
+        use_cache = (
+            self.cache is not None and kind == "read"
+            and options.get("cache", True) and not options.get("transaction")
+        )
+        if use_cache:
+            with timed("cache"):
+                cached = await self.cache.lookup(self.name, query, params)
+            if cached is not None:
+                self.query_stats.record(query, params)
+                rows, stale = cached
+                if stale:
+                    # Устаревший результат отдаём сразу, обновляем один раз в фоне
+                    self.refresh(query, params)
+                return rows, None
+
+        node = self.route(query, options, client_key)
+        # Запись, зафиксированная во время чтения, сбросит кэш раньше, чем мы положим в него результат
+        generation = self._cache_generation
+        started = time.perf_counter()
+        data = await self._run_on_node(node, query, params)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if self.slow_queries.enabled:
+            self._note_slow(query, params, node, elapsed_ms)
+        if use_cache:
+            self.query_stats.record(query, params, elapsed_ms)
+
+        if kind == "write":
+            if node is self.primary:
+                self.note_write(client_key)
+            await self.invalidate_after_write([query])
+        elif use_cache and generation == self._cache_generation:
+            with timed("cache"):
+                await self.cache.put(self.name, query, params, data)
+        return data, node
+
+    async def _run_on_node(self, node: DatasourceNode, query: str, params: Any) -> List[Dict[str, Any]]:
+        node.in_flight += 1
+        node.queries += 1
+        try:
+            if node.limiter is None:
+                return await node.backend.execute(query, params)
+            async with node.limiter.acquire():
+                return await node.backend.execute(query, params)
+        finally:
+            node.in_flight -= 1
+
+    def refresh(self, query: str, params: Any = None) -> asyncio.Task:
+        """Обновляет запись кэша в фоне; повторный вызов для того же ключа ждёт начатое обновление"""
+        key = self.cache.key(self.name, query, params)
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(query, params))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return task
+
+    async def _refresh(self, query: str, params: Any) -> bool:
+        # Замер фаз запроса, породившего обновление, уже отправлен клиенту
+        current_timings.set(None)
+        generation = self._cache_generation
+        try:
+            data = await self._run_on_node(self.route(query, {"read_only": True}), query, params)
+        except Exception as e:
+            self.cache.refresh_errors += 1
+            logger.warning(f"Cache refresh of {query_fingerprint(query)} on {self.name} failed: {e}")
+            return False
+        if generation != self._cache_generation:
+            return False
+        await self.cache.put(self.name, query, params, data)
+        self.cache.refreshes += 1
+        return True
+
+    async def prewarm(self, now: Optional[float] = None) -> int:
+        """Обновляет частые запросы, чьи записи в кэше истекают или отсутствуют"""
+        if self.cache is None or self.config.prewarm_top <= 0:
+            return 0
+        deadline = (now if now is not None else time.time()) + self.config.prewarm_margin
+        refreshes = []
+        for entry in self.query_stats.top(self.config.prewarm_top):
+            fresh_until = await self.cache.fresh_until(self.name, entry["query"], entry["params"])
+            if fresh_until is None or fresh_until <= deadline:
+                refreshes.append(self.refresh(entry["query"], entry["params"]))
+        warmed = sum(await asyncio.gather(*refreshes)) if refreshes else 0
+        self.cache.prewarmed += warmed
+        return warmed
+
+    def _note_slow(self, query: str, params: Any, node: DatasourceNode, elapsed_ms: float):
+        """Записывает медленный запрос в журнал и в фоне снимает его план"""
+        if elapsed_ms < self.slow_queries.threshold_ms:
+            return
+        fingerprint = self.slow_queries.record(query, elapsed_ms, params)
+        # У DDL нет плана, а повторная подготовка CREATE падает на уже созданном объекте
+        if fingerprint is None or is_ddl(query) or not hasattr(node.backend, "explain"):
+            return
+        task = asyncio.create_task(self._capture_plan(fingerprint, query, params, node))
+        self._plan_captures.add(task)
+        task.add_done_callback(self._plan_captures.discard)
+
+    async def _capture_plan(self, fingerprint: str, query: str, params: Any, node: DatasourceNode):
+        # Замер фаз запроса, породившего задачу, уже отправлен клиенту
+        current_timings.set(None)
+        try:
+            result = await node.backend.explain(query, params)
+        except Exception as e:
+            self.slow_queries.capture_errors += 1
+            logger.warning(f"Plan capture failed for {fingerprint} on {node.name}: {e}")
+            return
+        self.slow_queries.set_plan(fingerprint, result["plan"])
+
+    async def explain(self, query: str, params: Any = None, analyze: bool = False,
+                      client_key: Optional[str] = None) -> Tuple[Dict[str, Any], DatasourceNode]:
+        """План запроса на том узле, куда он был бы направлен"""
+        if analyze and classify_statement(query) != "read":
+            raise BackendError("EXPLAIN ANALYZE executes the statement: only read queries can be analyzed")
+        node = self.route(query, None, client_key)
+        if not hasattr(node.backend, "explain"):
+            raise BackendError(f"Datasource {self.name!r} does not support EXPLAIN")
+        node.in_flight += 1
+        node.queries += 1
+        try:
+            return await node.backend.explain(query, params, analyze), node
+        finally:
+            node.in_flight -= 1
+
+    async def invalidate_after_write(self, queries: List[str]):
+        """Публикует изменения таблиц, затронутых запросами (кэши сбрасываются обработчиком)"""
+        await self.changes.publish(changes_from_queries(queries))
+
+    async def _invalidate(self, events: List[Dict[str, Any]]):
+        """Сбрасывает кэш результатов и метаданных по событиям изменений"""
+        tables = [event["table"] for event in events]
+        self._cache_generation += 1
+        if None in tables:
+            # Неизвестно, что изменилось: сбрасываем всё
+            self.metadata.invalidate(None)
+            if self.cache is not None:
+                await self.cache.invalidate(self.name, await self.primary.backend.get_tables())
+            return
+        ddl_tables = [event["table"] for event in events if event["operation"] == "ddl"]
+        if ddl_tables:
+            # Оценки строк после DML обновляет фоновая задача, каталог сбрасываем только при DDL
+            self.metadata.invalidate(sorted(set(ddl_tables)))
+        if self.cache is not None:
+            await self.cache.invalidate(self.name, sorted(set(tables)))
+
+    async def poll_external_changes(self):
+        """
+        Замечает записи в базу в обход сервера
+
+        SQLite меняет PRAGMA data_version при фиксации транзакции любым другим
+        соединением; если за это время сервер сам не писал, изменение внешнее.
+        Своя запись фиксируется раньше, чем растёт local_writes, поэтому опрос,
+        заставший запись в процессе (writes_in_progress), только запоминает
+        версию: иначе своя фиксация выглядела бы внешним изменением.
+        """
+        backend = self.primary.backend
+        if not hasattr(backend, "data_version"):
+            return
+        # Счётчик читается до версии; идущая запись могла уже зафиксироваться, но ещё не
+        # попасть в счётчик - такой опрос ничего не заключает, а следующий увидит его рост
+        writes = backend.local_writes
+        busy = backend.writes_in_progress
+        version = await backend.data_version()
+        if version is None:
+            return
+        previous, self._data_version = self._data_version, (version, writes)
+        if previous is not None and not busy and version != previous[0] and writes == previous[1]:
+            logger.info(f"External change detected on {self.name}")
+            await self.changes.publish([{"table": None, "operation": "write", "source": "external"}])
+
+    async def open_transaction(self):
+        """Открывает транзакцию на выделенном соединении primary"""
+        backend = self.primary.backend
+        if not hasattr(backend, "open_transaction"):
+            raise BackendError(f"Datasource {self.name!r} does not support transactions")
+        return await backend.open_transaction()
+
+    def scan(self, table: str, client_key: Optional[str] = None, **kwargs) -> "ParallelScan":
+        """Параллельное чтение таблицы на узле для чтения"""
+        node = self.route(f"SELECT * FROM {table}", {"read_only": True}, client_key)
+        if not hasattr(node.backend, "scan_ranges"):
+            raise BackendError(f"Datasource {self.name!r} does not support parallel scans")
+        return ParallelScan(node, table, **kwargs)
+
+    async def select_batches(self, table: str, columns: Optional[List[str]] = None,
+                             filters: Optional[Dict[str, Any]] = None,
+                             client_key: Optional[str] = None, batch_size: int = 1000):
+        """Потоковое чтение таблицы с pushdown проекции и фильтра на узле для чтения"""
+        node = self.route(f"SELECT * FROM {table}", {"read_only": True}, client_key)
+        node.in_flight += 1
+        node.queries += 1
+        try:
+            async for batch in node.backend.select_batches(table, columns, filters, batch_size):
+                yield batch
+        finally:
+            node.in_flight -= 1
+
+    async def query_batches(self, query: str, params: Any = None,
+                            client_key: Optional[str] = None, batch_size: int = 1000):
+        """Потоковое выполнение читающего запроса пачками строк на узле для чтения"""
+        if classify_statement(query) != "read":
+            raise BackendError("Only read queries can be streamed")
+        node = self.route(query, {"read_only": True}, client_key)
+        node.in_flight += 1
+        node.queries += 1
+        try:
+            async for batch in node.backend.query_batches(query, params, batch_size):
+                yield batch
+        finally:
+            node.in_flight -= 1
+
+    async def bulk_insert(self, table: str, columns: List[str], rows: List[tuple],
+                          client_key: Optional[str] = None) -> int:
+        """Пакетная загрузка строк на primary самым быстрым способом бэкенда"""
+        backend = self.primary.backend
+        if not hasattr(backend, "bulk_insert"):
+            raise BackendError(f"Datasource {self.name!r} does not support bulk loading")
+        self.primary.in_flight += 1
+        self.primary.queries += 1
+        try:
+            loaded = await backend.bulk_insert(table, columns, rows)
+        finally:
+            self.primary.in_flight -= 1
+        self.note_write(client_key)
+        await self.changes.publish([{"table": table, "operation": "insert"}])
+        return loaded
+
+    async def probe_lag(self):
+        """Измеряет отставание реплик"""
+        for node in self.replicas:
+            try:
+                node.lag = await node.backend.replication_lag()
+                node.healthy = True
+            except Exception as e:
+                logger.warning(f"Replica {node.name} lag probe failed: {e}")
+                node.healthy = False
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        if self.write_behind is not None:
+            if self.write_behind.pending:
+                flushed = await self.write_behind.flush()
+                if self.write_behind.pending:
+                    kept = "kept in the log" if self.write_behind.log_path else "lost"
+                    logger.error(f"{len(self.write_behind.pending)} write-behind rows of {self.name} {kept}")
+                elif flushed:
+                    logger.info(f"Flushed {flushed} write-behind rows of {self.name} on shutdown")
+            self.write_behind.close()
+        for node in self.nodes:
+            await node.backend.close()
+        if self.cache is not None:
+            await self.cache.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {node.name: node.stats() for node in self.nodes}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+            if self.config.prewarm_top > 0:
+                # Параметры запросов в статистику не попадают
+                stats["cache"]["prewarm"] = [
+                    {key: value for key, value in entry.items() if key != "params"}
+                    for entry in self.query_stats.top(self.config.prewarm_top)
+                ]
+        stats["metadata"] = self.metadata.stats()
+        if self.slow_queries.enabled:
+            stats["slow_queries"] = self.slow_queries.stats()
+        if self.write_behind is not None:
+            stats["write_behind"] = self.write_behind.stats()
+        return stats
+
+
+# Параллельное сканирование таблиц
+class ParallelScan:
+    """Чтение таблицы диапазонами ключа на нескольких соединениях пула с объединением потоков"""
+
+    END = object()
+
+    def __init__(self, node: DatasourceNode, table: str, partitions: int = 4,
+                 columns: Optional[List[str]] = None, order_by: Optional[str] = None,
+                 batch_size: int = 1000, prefetch: int = 4, min_rows: int = 10000):
+        self.node = node
+        self.backend = node.backend
+        self.table = table
+        self.partitions = max(1, min(partitions, self.backend.pool_size))
+        self.columns = columns
+        self.order_by = order_by
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        self.min_rows = min_rows  # Минимум строк на партицию, мелкие таблицы не дробятся
+
+    async def batches(self):
+        """Асинхронно выдает пачки строк (списки словарей)"""
+        key, table_columns, ranges = await self.backend.scan_ranges(
+            self.table, self.partitions, self.min_rows
+        )
+        columns = self.columns or table_columns
+        unknown = [c for c in columns if c not in table_columns]
+        if unknown:
+            raise BackendError(f"Unknown columns for {self.table}: {', '.join(unknown)}")
+        if self.order_by and self.order_by != key and self.order_by not in columns:
+            raise BackendError(f"order_by column must be selected: {self.order_by}")
+        if not ranges:
+            return
+
+        order_by = self.order_by or key
+        stop = threading.Event()
+        if self.order_by is None:
+            # Порядок не важен - общая очередь, пачки отдаются по мере готовности
+            shared = queue.Queue(self.prefetch * len(ranges))
+            sinks = [shared] * len(ranges)
+        else:
+            sinks = [queue.Queue(self.prefetch) for _ in ranges]
+
+        for index, bounds in enumerate(ranges):
+            self.backend.submit(
+                self._produce, index, key, columns, bounds, order_by, sinks[index], stop
+            )
+
+        self.node.in_flight += 1
+        self.node.queries += 1
+        try:
+            if self.order_by is None:
+                merged = self._unordered(sinks[0], len(ranges))
+            elif order_by == key:
+                # Диапазоны ключа не пересекаются - достаточно склеить по порядку
+                merged = self._concatenated(sinks)
+            else:
+                merged = self._merged(sinks, order_by)
+            async for batch in merged:
+                yield batch
+        finally:
+            stop.set()
+            self.node.in_flight -= 1
+
+    async def fetch_all(self) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        async for batch in self.batches():
+            rows.extend(batch)
+        return rows
+
+    def _produce(self, conn, index: int, key: str, columns: List[str], bounds: Tuple[int, int],
+                 order_by: str, sink: "queue.Queue", stop: threading.Event):
+        def emit(item) -> bool:
+            while not stop.is_set():
+                try:
+                    sink.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            self.backend.scan_partition(
+                conn, self.table, key, columns, bounds, order_by, self.batch_size,
+                lambda batch: emit((index, batch))
+            )
+        except Exception as e:
+            emit((index, e))
+            return
+        emit((index, self.END))
+
+    async def _unordered(self, sink: "queue.Queue", producers: int):
+        while producers:
+            _, batch = await take_from_queue(sink)
+            if batch is self.END:
+                producers -= 1
+            else:
+                yield batch
+
+    async def _concatenated(self, sinks: List["queue.Queue"]):
+        for sink in sinks:
+            while True:
+                _, batch = await take_from_queue(sink)
+                if batch is self.END:
+                    break
+                yield batch
+
+    async def _merged(self, sinks: List["queue.Queue"], order_by: str):
+        """K-way слияние отсортированных потоков партиций"""
+        def sort_key(row):
+            value = row[order_by]
+            return (value is not None, value)
+
+        pending: Dict[int, List[Dict[str, Any]]] = {}
+        heap = []
+        for index, sink in enumerate(sinks):
+            _, batch = await take_from_queue(sink)
+            if batch is not self.END:
+                pending[index] = batch
+                heapq.heappush(heap, (sort_key(batch[0]), index, 0))
+
+        out: List[Dict[str, Any]] = []
+        while heap:
+            _, index, position = heapq.heappop(heap)
+            batch = pending[index]
+            out.append(batch[position])
+            position += 1
+            if position == len(batch):
+                _, batch = await take_from_queue(sinks[index])
+                if batch is self.END:
+                    del pending[index]
+                    batch = None
+                else:
+                    pending[index] = batch
+                    position = 0
+            if batch is not None:
+                heapq.heappush(heap, (sort_key(batch[position]), index, position))
+            if len(out) >= self.batch_size:
+                yield out
+                out = []
+        if out:
+            yield out
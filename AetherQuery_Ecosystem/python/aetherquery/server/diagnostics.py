@@ -0,0 +1,263 @@
+"""Диагностика: журнал медленных запросов и профилировщики работающего сервера"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List
+
+from .sql import extract_tables, query_fingerprint
+
+
+# Журнал медленных запросов
+class SlowQueryLog:
+    """
+    Медленные запросы, сгруппированные по отпечатку формы
+
+    Для каждой формы хранятся последний пример, число и длительность
+    выполнений и план, снятый при первом попадании в журнал и обновляемый
+    не чаще раза в plan_ttl секунд. Вытесняются давно не встречавшиеся формы.
+    """
+
+    def __init__(self, threshold_ms: float = 0.0, max_entries: int = 200, plan_ttl: float = 300.0):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self.plan_ttl = plan_ttl
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.captured = 0
+        self.capture_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def record(self, query: str, elapsed_ms: float, params: Any = None) -> Optional[str]:
+        """Учитывает выполнение; возвращает отпечаток, если для формы пора снять план"""
+        fingerprint = query_fingerprint(query)
+        now = time.time()
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            entry = {
+                "fingerprint": fingerprint,
+                "tables": extract_tables(query),
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "first_seen": now,
+                "plan": None,
+                "plan_captured_at": None,
+            }
+            self.entries[fingerprint] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(fingerprint)
+        entry["query"] = query
+        # Параметры нужны советнику по индексам для прогона запроса; наружу не отдаются
+        entry["params"] = params
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["last_seen"] = now
+
+        captured_at = entry["plan_captured_at"]
+        if captured_at is not None and now - captured_at < self.plan_ttl:
+            return None
+        # Отмечаем сразу, чтобы параллельные медленные запросы не снимали план повторно
+        entry["plan_captured_at"] = now
+        return fingerprint
+
+    def set_plan(self, fingerprint: str, plan: Dict[str, Any]):
+        entry = self.entries.get(fingerprint)
+        if entry is not None:
+            entry["plan"] = plan
+            self.captured += 1
+
+    def report(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Формы запросов по суммарному времени, самые дорогие первыми"""
+        entries = sorted(self.entries.values(), key=lambda entry: -entry["total_ms"])[:limit]
+        return [
+            {**{key: value for key, value in entry.items() if key != "params"},
+             "avg_ms": entry["total_ms"] / entry["count"]}
+            for entry in entries
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "entries": len(self.entries),
+            "plans_captured": self.captured,
+            "capture_errors": self.capture_errors,
+        }
+
+
+# Профилирование работающего сервера по запросу
+class StackSampler:
+    """
+    Сэмплирующий профайлер: фоновый поток периодически снимает стеки
+    всех потоков (event loop и пулы исполнителей) через sys._current_frames()
+
+    Результат - свёрнутые стеки ("поток;функция;функция N"), которые
+    понимают flamegraph.pl, speedscope и другие построители flame graph.
+    Сам интерпретатор не инструментируется, поэтому накладные расходы
+    ограничены частотой снимков.
+    """
+
+    MAX_SECONDS = 60.0
+    MIN_INTERVAL = 0.001
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.samples = 0
+
+    @staticmethod
+    def frame_label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self, seconds: float, interval: float = 0.005) -> Dict[str, int]:
+        """Снимает стеки в течение seconds секунд; блокирует вызывающий поток"""
+        seconds = min(max(seconds, 0.0), self.MAX_SECONDS)
+        interval = max(interval, self.MIN_INTERVAL)
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Profiler is already running")
+        try:
+            stacks: Dict[str, int] = {}
+            own = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            samples = 0
+            while True:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(self.frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    key = ";".join(reversed(labels))
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(interval)
+            self.runs += 1
+            self.samples += samples
+            return stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapsed(stacks: Dict[str, int]) -> str:
+        """Свёрнутые стеки, самые частые первыми"""
+        lines = [f"{stack} {count}" for stack, count in sorted(stacks.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._lock.locked(), "runs": self.runs, "samples": self.samples}
+
+
+class AllocationTracker:
+    """
+    Снимки tracemalloc до и после окна наблюдения
+
+    Пока окно открыто, AllocationRouteMiddleware относит прирост
+    отслеживаемой памяти к маршруту, обработавшему запрос. При параллельных
+    запросах приросты перемешиваются, так что разбивка по маршрутам -
+    оценка; точные места аллокаций даёт diff снимков.
+    """
+
+    MAX_SECONDS = 300.0
+
+    def __init__(self):
+        self.active = False
+        self.routes: Dict[str, Dict[str, int]] = {}
+        self._lock = asyncio.Lock()
+        self.runs = 0
+
+    def record(self, route: str, delta: int):
+        entry = self.routes.setdefault(route, {"requests": 0, "net_bytes": 0, "allocated_bytes": 0})
+        entry["requests"] += 1
+        entry["net_bytes"] += delta
+        if delta > 0:
+            entry["allocated_bytes"] += delta
+
+    async def capture(self, seconds: float, limit: int = 25, frames: int = 1) -> Dict[str, Any]:
+        """Открывает окно на seconds секунд и возвращает diff снимков"""
+        import tracemalloc
+
+        if self._lock.locked():
+            raise RuntimeError("Allocation tracking is already running")
+        async with self._lock:
+            seconds = min(max(seconds, 0.0), self.MAX_SECONDS)
+            # Трассировку, запущенную извне (PYTHONTRACEMALLOC), не останавливаем
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(max(frames, 1))
+            self.routes = {}
+            try:
+                before = tracemalloc.take_snapshot()
+                self.active = True
+                await asyncio.sleep(seconds)
+                self.active = False
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                self.active = False
+                if started:
+                    tracemalloc.stop()
+            self.runs += 1
+
+            # Аллокации самого tracemalloc в отчёт не попадают
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            group_by = "traceback" if frames > 1 else "lineno"
+            diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), group_by)
+            top = []
+            for stat in diff[:limit]:
+                top.append({
+                    "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                    "size": stat.size,
+                    "count": stat.count,
+                })
+            routes = sorted(self.routes.items(), key=lambda item: -item[1]["net_bytes"])
+            return {
+                "seconds": seconds,
+                "traced_bytes": current,
+                "peak_bytes": peak,
+                "size_diff": sum(stat.size_diff for stat in diff),
+                "top": top,
+                "routes": [{"route": route, **entry} for route, entry in routes],
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._lock.locked(), "runs": self.runs}
+
+
+class AllocationRouteMiddleware:
+    """ASGI middleware: прирост памяти за запрос по шаблону маршрута (только пока открыто окно)"""
+
+    def __init__(self, app, tracker: AllocationTracker):
+        self.app = app
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        tracker = self.tracker
+        if scope["type"] != "http" or not tracker.active:
+            await self.app(scope, receive, send)
+            return
+        import tracemalloc
+
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if tracker.active:
+                # Роутер Starlette кладёт найденный маршрут в тот же scope
+                route = getattr(scope.get("route"), "path", None) or scope.get("path", "")
+                tracker.record(f"{scope.get('method', '')} {route}", tracemalloc.get_traced_memory()[0] - before)
@@ -0,0 +1,741 @@
+"""Фоновые задания, экспорт в файлы и импорт CSV/Parquet"""
+
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Callable, Dict, Any, Optional, List, Tuple
+
+from fastapi import HTTPException
+
+from .backends import BackendError, quote_identifier
+from .datasource import Datasource
+from .models import ExportRequest, ImportRequest, QueryRequest
+from .sql import classify_statement
+
+logger = logging.getLogger("AetherQueryServer")
+
+# Допуск фоновой работы к источнику: (ключ API, источник, класс нагрузки) -> контекст,
+# в котором она ждёт квоту арендатора и слот класса нагрузки (ServerState.admit_background)
+Admission = Callable[[Optional[str], str, str], AsyncContextManager[None]]
+
+
+@asynccontextmanager
+async def unrestricted(api_key: Optional[str], datasource: str, workload: str):
+    """Допуск без квот и классов нагрузки - для менеджеров вне сервера"""
+    yield
+
+
+# Фоновые задания для долгих запросов
+class Job:
+    """Запрос, выполняемый в фоне с записью результата в файл"""
+
+    def __init__(self, datasource: Datasource, request: QueryRequest, client_key: Optional[str], path: str,
+                 workload: str = "background", api_key: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.datasource = datasource
+        self.request = request
+        self.client_key = client_key
+        self.workload = workload
+        self.api_key = api_key
+        self.path = path
+        self.status = "queued"
+        self.rows = 0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "datasource": self.datasource.name,
+            "workload": self.workload,
+            "query": self.request.query,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+        }
+
+
+class JobManager:
+    """
+    Очередь фоновых заданий
+
+    Одновременно выполняется не более max_running заданий, остальные ждут.
+    Результат пишется в файл: первая строка - {"columns": [...]}, далее по
+    строке JSON-массив значений на каждую строку результата. Файлы готовых
+    заданий удаляются через ttl секунд. Квоту арендатора и слот класса
+    нагрузки задание ждёт в admission.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_running: int = 2,
+                 max_jobs: int = 100, ttl: float = 3600.0, batch_size: int = 1000,
+                 admission: Admission = unrestricted):
+        self.directory = directory
+        self.admission = admission
+        self.max_running = max_running
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.jobs: Dict[str, Job] = {}
+        self.expired = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="aetherquery-job")
+
+    def submit(self, datasource: Datasource, request: QueryRequest, client_key: Optional[str],
+               workload: str = "background", api_key: Optional[str] = None) -> Job:
+        active = sum(1 for job in self.jobs.values() if not job.finished)
+        if active >= self.max_jobs:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many jobs in progress",
+                headers={"Retry-After": "5"},
+            )
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="aetherquery-jobs-")
+        os.makedirs(self.directory, exist_ok=True)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_running)
+        job = Job(datasource, request, client_key, "", workload, api_key)
+        job.path = os.path.join(self.directory, f"{job.id}.ndjson")
+        job.task = asyncio.create_task(self._run(job))
+        self.jobs[job.id] = job
+        logger.info(f"Job {job.id} queued: {request.query}")
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired job: {job_id}")
+        return job
+
+    async def _run(self, job: Job):
+        async with self._slots:
+            if job.status == "cancelled":
+                return
+            try:
+                # Квоту арендатора задание ждёт, а не получает 429: check_rate был при постановке
+                async with self.admission(job.api_key, job.datasource.name, job.workload):
+                    await self._execute(job)
+            except HTTPException as e:
+                job.status = "failed"
+                job.error = e.detail
+                job.finished_at = time.time()
+                job.expires_at = job.finished_at + self.ttl
+
+    async def _execute(self, job: Job):
+        job.status = "running"
+        job.started_at = time.time()
+        loop = asyncio.get_running_loop()
+        spill = await loop.run_in_executor(self._executor, open, job.path + ".part", "wb")
+        try:
+            columns = None
+            async for batch in self._batches(job):
+                if columns is None and batch:
+                    columns = list(batch[0])
+                    await loop.run_in_executor(self._executor, spill.write, self._header(columns))
+                chunk = "".join(
+                    json.dumps([row.get(column) for column in columns], default=str, separators=(",", ":")) + "\n"
+                    for row in batch
+                ).encode()
+                await loop.run_in_executor(self._executor, spill.write, chunk)
+                job.rows += len(batch)
+            if columns is None:
+                await loop.run_in_executor(self._executor, spill.write, self._header([]))
+            await loop.run_in_executor(self._executor, spill.close)
+            os.replace(job.path + ".part", job.path)
+            job.bytes = os.path.getsize(job.path)
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.warning(f"Job {job.id} failed: {e}")
+        finally:
+            spill.close()
+            self._remove(job.path + ".part")
+            job.finished_at = time.time()
+            job.expires_at = job.finished_at + self.ttl
+            logger.info(f"Job {job.id} {job.status}: {job.rows} rows")
+
+    async def _batches(self, job: Job):
+        """Чтение идёт потоком с узла для чтения; запись выполняется целиком на primary"""
+        request = job.request
+        params = request.params if request.params is not None else request.parameters
+        if classify_statement(request.query) == "read":
+            async for batch in job.datasource.query_batches(
+                request.query, params, job.client_key, self.batch_size
+            ):
+                yield batch
+        else:
+            data, _ = await job.datasource.execute(request.query, params, request.options, job.client_key)
+            yield data
+
+    @staticmethod
+    def _header(columns: List[str]) -> bytes:
+        return (json.dumps({"columns": columns}) + "\n").encode()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def cancel(self, job_id: str) -> Job:
+        """Отменяет задание и удаляет его результат"""
+        job = self.get(job_id)
+        if job.task is not None and not job.task.done():
+            job.status = "cancelled"
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+        del self.jobs[job_id]
+        self._remove(job.path)
+        return job
+
+    def expire(self):
+        """Удаляет результаты заданий с истёкшим TTL"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.expires_at is not None and job.expires_at <= now:
+                del self.jobs[job_id]
+                self._remove(job.path)
+                self.expired += 1
+
+    async def close_all(self):
+        for job_id in list(self.jobs):
+            await self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self.jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {"max_running": self.max_running, "expired": self.expired, **by_status}
+
+
+# Экспорт результатов в файлы
+EXPORT_COMPRESSION = {
+    "csv": (None, "gzip"),
+    "parquet": (None, "snappy", "gzip", "zstd", "brotli", "lz4"),
+}
+
+SAFE_EXPORT_NAME = re.compile(r"^[A-Za-z0-9_.-]+(/[A-Za-z0-9_.-]+)*$")
+
+
+def write_export_file(path: str, file_format: str, compression: Optional[str],
+                      columns: List[str], rows: List[List[Any]]) -> int:
+    """Кодирует и сжимает часть выгрузки в файл (выполняется в процессе пула)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if file_format == "csv":
+        opener = gzip.open if compression == "gzip" else open
+        with opener(path, "wt", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    else:
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+        pyarrow.parquet.write_table(table, path, compression=compression or "none")
+    return os.path.getsize(path)
+
+
+class Exporter:
+    """
+    Потоковая выгрузка результата запроса в CSV/Parquet
+
+    Строки читаются пачками и раскладываются по частям (partition_rows строк,
+    при partition_by - отдельно для каждого значения ключа); готовые части
+    кодируются и сжимаются в пуле процессов, пока читаются следующие.
+    """
+
+    def __init__(self, directory: Optional[str] = None, workers: Optional[int] = None):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.exports = 0
+        self.files = 0
+        self.rows = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: рабочие процессы не наследуют потоки пулов соединений сервера
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def validate(self, request: ExportRequest):
+        if request.format not in EXPORT_COMPRESSION:
+            raise BackendError(f"Unsupported export format: {request.format}")
+        if request.compression not in EXPORT_COMPRESSION[request.format]:
+            raise BackendError(f"Unsupported compression for {request.format}: {request.compression}")
+        if request.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise BackendError("Parquet export requires pyarrow: pip install pyarrow")
+        if request.name is not None and (not SAFE_EXPORT_NAME.match(request.name) or ".." in request.name):
+            raise BackendError(f"Invalid export name: {request.name}")
+        if request.partition_rows < 1:
+            raise BackendError("partition_rows must be positive")
+
+    async def export(self, datasource: Datasource, request: ExportRequest,
+                     client_key: Optional[str] = None) -> Dict[str, Any]:
+        self.validate(request)
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="aetherquery-exports-")
+        target = os.path.join(self.directory, request.name or uuid.uuid4().hex)
+        extension = request.format + (".gz" if request.compression == "gzip" and request.format == "csv" else "")
+
+        loop = asyncio.get_running_loop()
+        columns: Optional[List[str]] = None
+        buffers: Dict[Any, List[List[Any]]] = {}
+        parts: Dict[Any, int] = {}
+        pending: Dict[asyncio.Future, Dict[str, Any]] = {}
+        files: List[Dict[str, Any]] = []
+
+        async def collect(wait_for_all: bool = False):
+            while pending and (wait_for_all or len(pending) >= self.workers * 2):
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    info = pending.pop(future)
+                    info["bytes"] = future.result()
+                    files.append(info)
+
+        async def flush(key: Any):
+            rows = buffers.pop(key)
+            directory = target
+            if request.partition_by:
+                value = "__null__" if key is None else str(key).replace("/", "_")
+                directory = os.path.join(target, f"{request.partition_by}={value}")
+            number = parts.get(key, 0)
+            parts[key] = number + 1
+            path = os.path.join(directory, f"part-{number:05d}.{extension}")
+            future = loop.run_in_executor(
+                self.pool, write_export_file, path, request.format, request.compression, columns, rows
+            )
+            pending[future] = {
+                "path": os.path.relpath(path, self.directory),
+                "partition": key if request.partition_by else None,
+                "rows": len(rows),
+            }
+            # Ограничиваем число частей в памяти, пока пул их кодирует
+            await collect()
+
+        start_time = time.time()
+        total = 0
+        try:
+            async for batch in datasource.query_batches(request.query, request.params, client_key, request.batch_size):
+                if columns is None and batch:
+                    columns = list(batch[0])
+                    if request.partition_by and request.partition_by not in columns:
+                        raise BackendError(f"Partition column not in result: {request.partition_by}")
+                for row in batch:
+                    key = row.get(request.partition_by) if request.partition_by else None
+                    buffer = buffers.setdefault(key, [])
+                    buffer.append([row.get(column) for column in columns])
+                    if len(buffer) >= request.partition_rows:
+                        await flush(key)
+                total += len(batch)
+            for key in list(buffers):
+                await flush(key)
+            await collect(wait_for_all=True)
+        finally:
+            for future in pending:
+                future.cancel()
+
+        self.exports += 1
+        self.files += len(files)
+        self.rows += total
+        files.sort(key=lambda info: info["path"])
+        return {
+            "directory": target,
+            "format": request.format,
+            "compression": request.compression,
+            "rows": total,
+            "files": files,
+            "execution_time": time.time() - start_time,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "exports": self.exports, "files": self.files, "rows": self.rows}
+
+
+# Импорт файлов
+def column_kind(declared_type: str) -> str:
+    """Тип значения колонки по объявленному типу (правила affinity SQLite)"""
+    declared = (declared_type or "").lower()
+    if "bool" in declared:
+        return "boolean"
+    if "int" in declared:
+        return "integer"
+    if any(word in declared for word in ("char", "clob", "text")) or not declared:
+        return "text"
+    if "blob" in declared:
+        return "text"
+    if any(word in declared for word in ("real", "floa", "doub")):
+        return "real"
+    return "numeric"
+
+
+def convert_value(value: str, kind: str) -> Any:
+    """Преобразует строку CSV к типу колонки; пустая строка - NULL"""
+    if value == "":
+        return None
+    try:
+        if kind == "integer":
+            return int(value)
+        if kind == "real":
+            return float(value)
+        if kind == "numeric":
+            number = float(value)
+            return int(number) if number.is_integer() and "." not in value and "e" not in value.lower() else number
+        if kind == "boolean":
+            return value.strip().lower() in ("1", "true", "t", "yes", "y")
+    except ValueError:
+        # SQLite примет значение как есть
+        return value
+    return value
+
+
+def infer_kind(values: List[str]) -> str:
+    """Выводит тип колонки по образцу значений"""
+    present = [value for value in values if value != ""]
+    if not present:
+        return "text"
+    for kind, parse in (("integer", int), ("real", float)):
+        try:
+            for value in present:
+                parse(value)
+            return kind
+        except ValueError:
+            continue
+    return "text"
+
+
+def csv_chunk_bounds(mm: "mmap.mmap", start: int, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Делит файл на части по границам строк
+
+    Перевод строки внутри поля в кавычках границей не считается: чётность
+    числа кавычек от начала данных показывает, открыто ли поле.
+    """
+    size = len(mm)
+    bounds = []
+    offset = start
+    while offset < size:
+        end = min(offset + chunk_bytes, size)
+        quotes = mm[offset:end].count(b'"')
+        while end < size:
+            newline = mm.find(b"\n", end)
+            if newline == -1:
+                quotes += mm[end:size].count(b'"')
+                end = size
+                break
+            quotes += mm[end:newline + 1].count(b'"')
+            end = newline + 1
+            if quotes % 2 == 0:
+                break
+        bounds.append((offset, end - offset))
+        offset = end
+    return bounds
+
+
+def parse_csv_chunk(path: str, offset: int, length: int, delimiter: str, kinds: List[str]) -> List[tuple]:
+    """Разбирает часть CSV файла (выполняется в процессе пула, файл отображается в память)"""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[offset:offset + length].decode("utf-8")
+    return [
+        tuple(convert_value(value, kind) for value, kind in zip(record, kinds))
+        for record in csv.reader(io.StringIO(text, newline=""), delimiter=delimiter)
+        if record
+    ]
+
+
+def parse_parquet_row_group(path: str, row_group: int, columns: List[str]) -> List[tuple]:
+    """Читает группу строк Parquet (выполняется в процессе пула)"""
+    import pyarrow.parquet
+
+    table = pyarrow.parquet.ParquetFile(path, memory_map=True).read_row_group(row_group, columns=columns)
+    return list(zip(*(table.column(column).to_pylist() for column in columns)))
+
+
+class ImportTask:
+    """Загрузка одного файла с прогрессом и скоростью"""
+
+    def __init__(self, datasource: Datasource, request: ImportRequest, path: str, file_format: str,
+                 api_key: Optional[str] = None, workload: str = "background"):
+        self.id = uuid.uuid4().hex
+        self.datasource = datasource
+        self.api_key = api_key
+        self.workload = workload
+        self.request = request
+        self.path = path
+        self.format = file_format
+        self.status = "queued"
+        self.columns: List[str] = []
+        self.rows = 0
+        self.chunks = 0
+        self.chunks_done = 0
+        self.bytes = os.path.getsize(path)
+        self.created_table = False
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def info(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        done_bytes = self.bytes * self.chunks_done / self.chunks if self.chunks else 0
+        return {
+            "import_id": self.id,
+            "status": self.status,
+            "table": self.request.table,
+            "format": self.format,
+            "columns": self.columns,
+            "created_table": self.created_table,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "progress": self.chunks_done / self.chunks if self.chunks else (1.0 if self.status == "done" else 0.0),
+            "elapsed": elapsed,
+            "rows_per_second": self.rows / elapsed if elapsed else 0.0,
+            "mb_per_second": done_bytes / elapsed / (1 << 20) if elapsed else 0.0,
+            "error": self.error,
+            "expires_at": self.expires_at,
+        }
+
+
+class Importer:
+    """
+    Загрузка CSV/Parquet файлов из каталога импорта
+
+    Файл делится на части, которые разбираются параллельно в пуле процессов
+    (каждый процесс отображает файл в память сам); значения приводятся к
+    типам колонок из get_table_schema(), а разобранные пачки загружаются
+    самым быстрым путём бэкенда (bulk_insert), пока разбираются следующие.
+    Записи о завершённых загрузках удаляются через ttl секунд. Квоту арендатора
+    и слот класса нагрузки загрузка ждёт в admission.
+    """
+
+    def __init__(self, directory: Optional[str] = None, workers: Optional[int] = None, ttl: float = 3600.0,
+                 admission: Admission = unrestricted):
+        self.directory = directory
+        self.admission = admission
+        self.workers = workers or os.cpu_count() or 1
+        self.ttl = ttl
+        self.imports: Dict[str, ImportTask] = {}
+        self.expired = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def resolve(self, path: str) -> str:
+        """Путь к файлу внутри каталога импорта"""
+        if self.directory is None:
+            raise HTTPException(status_code=403, detail="Import directory is not configured (--import-dir)")
+        root = os.path.realpath(self.directory)
+        full = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, full]) != root:
+            raise HTTPException(status_code=400, detail=f"Path outside of import directory: {path}")
+        if not os.path.isfile(full):
+            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+        return full
+
+    def start(self, datasource: Datasource, request: ImportRequest, client_key: Optional[str],
+              api_key: Optional[str] = None, workload: str = "background") -> ImportTask:
+        path = self.resolve(request.path)
+        file_format = request.format or ("parquet" if path.endswith(".parquet") else "csv")
+        if file_format not in ("csv", "parquet"):
+            raise HTTPException(status_code=400, detail=f"Unsupported import format: {file_format}")
+        if file_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise HTTPException(status_code=400, detail="Parquet import requires pyarrow: pip install pyarrow")
+        task = ImportTask(datasource, request, path, file_format, api_key, workload)
+        task.task = asyncio.create_task(self._run(task, client_key))
+        self.imports[task.id] = task
+        return task
+
+    def get(self, import_id: str) -> ImportTask:
+        task = self.imports.get(import_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired import: {import_id}")
+        return task
+
+    async def _run(self, task: ImportTask, client_key: Optional[str]):
+        # Квоту арендатора и слот класса нагрузки загрузка ждёт в очереди: check_rate был при постановке
+        try:
+            async with self.admission(task.api_key, task.datasource.name, task.workload):
+                await self._load(task, client_key)
+        except HTTPException as e:
+            # Очередь класса нагрузки переполнена - загрузка так и не началась
+            task.status = "failed"
+            task.error = e.detail
+            task.finished_at = time.time()
+        finally:
+            task.expires_at = (task.finished_at or time.time()) + self.ttl
+
+    async def _load(self, task: ImportTask, client_key: Optional[str]):
+        task.status = "running"
+        task.started_at = time.time()
+        loop = asyncio.get_running_loop()
+        request = task.request
+        try:
+            if task.format == "csv":
+                header, sample, bounds = await loop.run_in_executor(None, self._plan_csv, task.path, request)
+                kinds = await self._prepare_table(task, header, {c: infer_kind(v) for c, v in zip(header, zip(*sample))})
+                jobs = [(parse_csv_chunk, task.path, offset, length, request.delimiter, kinds) for offset, length in bounds]
+            else:
+                header, inferred, row_groups = await loop.run_in_executor(None, self._plan_parquet, task.path)
+                await self._prepare_table(task, header, inferred)
+                jobs = [(parse_parquet_row_group, task.path, group, header) for group in range(row_groups)]
+            task.chunks = len(jobs)
+
+            # Разбор опережает загрузку не более чем на 2 части на процесс
+            pending: List[asyncio.Future] = []
+            next_job = 0
+            while next_job < len(jobs) or pending:
+                while next_job < len(jobs) and len(pending) < self.workers * 2:
+                    pending.append(loop.run_in_executor(self.pool, *jobs[next_job]))
+                    next_job += 1
+                rows = await pending.pop(0)
+                for start in range(0, len(rows), request.batch_size):
+                    task.rows += await task.datasource.bulk_insert(
+                        request.table, task.columns, rows[start:start + request.batch_size], client_key
+                    )
+                task.chunks_done += 1
+            task.status = "done"
+        except asyncio.CancelledError:
+            task.status = "cancelled"
+            raise
+        except HTTPException as e:
+            task.status = "failed"
+            task.error = e.detail
+        except Exception as e:
+            task.status = "failed"
+            task.error = str(e)
+            logger.warning(f"Import {task.id} into {request.table} failed: {e}")
+        finally:
+            task.finished_at = time.time()
+            info = task.info()
+            logger.info(
+                f"Import {task.id} {task.status}: {task.rows} rows into {request.table} "
+                f"({info['rows_per_second']:.0f} rows/s, {info['mb_per_second']:.1f} MB/s)"
+            )
+
+    @staticmethod
+    def _plan_csv(path: str, request: ImportRequest) -> Tuple[List[str], List[List[str]], List[Tuple[int, int]]]:
+        """Заголовок, образец строк для вывода типов и границы частей"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise BackendError(f"Empty file: {request.path}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_bound = csv_chunk_bounds(mm, 0, 1)[0]
+                header_end = header_bound[1]
+                header = next(csv.reader([mm[:header_end].decode("utf-8-sig").rstrip("\r\n")], delimiter=request.delimiter))
+                sample_bytes = mm[header_end:header_end + (64 << 10)].decode("utf-8", errors="ignore")
+                sample = [
+                    record for record in csv.reader(io.StringIO(sample_bytes.rsplit("\n", 1)[0], newline=""),
+                                                    delimiter=request.delimiter)
+                    if len(record) == len(header)
+                ]
+                bounds = csv_chunk_bounds(mm, header_end, request.chunk_bytes)
+        return header, sample, bounds
+
+    @staticmethod
+    def _plan_parquet(path: str) -> Tuple[List[str], Dict[str, str], int]:
+        import pyarrow.parquet
+        import pyarrow.types as pa_types
+
+        parquet_file = pyarrow.parquet.ParquetFile(path, memory_map=True)
+        schema = parquet_file.schema_arrow
+        inferred = {}
+        for field in schema:
+            if pa_types.is_integer(field.type):
+                inferred[field.name] = "integer"
+            elif pa_types.is_floating(field.type) or pa_types.is_decimal(field.type):
+                inferred[field.name] = "real"
+            else:
+                inferred[field.name] = "text"
+        return schema.names, inferred, parquet_file.num_row_groups
+
+    async def _prepare_table(self, task: ImportTask, header: List[str], inferred: Dict[str, str]) -> List[str]:
+        """Сверяет колонки файла со схемой таблицы (или создаёт её) и возвращает типы колонок файла"""
+        datasource = task.datasource
+        table = task.request.table
+        tables = await datasource.primary.backend.get_tables()
+        if table not in tables:
+            if not task.request.create:
+                raise BackendError(f"Table not found: {table}")
+            definition = ", ".join(
+                f"{quote_identifier(column)} {inferred.get(column, 'text').upper()}" for column in header
+            )
+            await datasource.execute(f"CREATE TABLE {quote_identifier(table)} ({definition})")
+            task.created_table = True
+        schema = {column["name"]: column["type"] for column in await datasource.primary.backend.get_table_schema(table)}
+        unknown = [column for column in header if column not in schema]
+        if unknown:
+            raise BackendError(f"Columns not in table {table}: {', '.join(unknown)}")
+        task.columns = header
+        return [column_kind(schema[column]) for column in header]
+
+    def expire(self):
+        """Удаляет записи о загрузках с истёкшим TTL"""
+        now = time.time()
+        for import_id, task in list(self.imports.items()):
+            if task.expires_at is not None and task.expires_at <= now:
+                del self.imports[import_id]
+                self.expired += 1
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for task in self.imports.values():
+            by_status[task.status] = by_status.get(task.status, 0) + 1
+        return {"workers": self.workers, "rows": sum(t.rows for t in self.imports.values()),
+                "expired": self.expired, **by_status}
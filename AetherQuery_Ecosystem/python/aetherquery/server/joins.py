@@ -0,0 +1,165 @@
+"""Хеш-соединение для федеративных запросов со сбросом на диск"""
+
+import asyncio
+import os
+import pickle
+import tempfile
+from typing import Dict, Any, Optional, List
+
+from .backends import BackendError
+
+
+# Федеративные запросы
+class HashJoin:
+    """Хеш-соединение двух потоков с ограничением памяти (grace hash join со сбросом на диск)"""
+
+    def __init__(self, left_keys: List[str], right_keys: List[str], how: str = "inner",
+                 right_alias: str = "right", memory_rows: int = 100000, spill_partitions: int = 16):
+        if len(left_keys) != len(right_keys) or not left_keys:
+            raise BackendError("Join keys must be non-empty and of equal length")
+        if how not in ("inner", "left"):
+            raise BackendError(f"Unsupported join type: {how}")
+        self.left_keys = left_keys
+        self.right_keys = right_keys
+        self.how = how
+        self.right_alias = right_alias
+        self.memory_rows = memory_rows
+        self.spill_partitions = spill_partitions
+        self.right_columns: List[str] = []
+        self.spilled = False
+
+    @staticmethod
+    def _key(row: Dict[str, Any], keys: List[str]) -> Optional[tuple]:
+        key = tuple(row.get(k) for k in keys)
+        # NULL не равен ничему, как в SQL
+        return None if any(v is None for v in key) else key
+
+    def _combine(self, left: Dict[str, Any], right: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        row = dict(left)
+        for column in self.right_columns:
+            name = column if column not in left else f"{self.right_alias}.{column}"
+            row[name] = right.get(column) if right is not None else None
+        return row
+
+    def _probe(self, table: Dict[tuple, List[Dict[str, Any]]], batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        out = []
+        for left in batch:
+            key = self._key(left, self.left_keys)
+            matches = table.get(key) if key is not None else None
+            if matches:
+                out.extend(self._combine(left, right) for right in matches)
+            elif self.how == "left":
+                out.append(self._combine(left, None))
+        return out
+
+    def _remember_columns(self, batch: List[Dict[str, Any]]):
+        for row in batch:
+            for column in row:
+                if column not in self.right_columns:
+                    self.right_columns.append(column)
+
+    async def run(self, left_batches, right_batches):
+        """Строит хеш-таблицу по правому потоку и прогоняет через неё левый"""
+        table: Dict[tuple, List[Dict[str, Any]]] = {}
+        in_memory = 0
+        spill = None
+        try:
+            async for batch in right_batches:
+                self._remember_columns(batch)
+                if spill is None:
+                    for row in batch:
+                        key = self._key(row, self.right_keys)
+                        if key is not None:
+                            table.setdefault(key, []).append(row)
+                            in_memory += 1
+                    if in_memory > self.memory_rows:
+                        # Не помещаемся в память - раскладываем по партициям на диске
+                        spill = JoinSpill(self.spill_partitions)
+                        self.spilled = True
+                        spill.write_build([row for rows in table.values() for row in rows], self.right_keys, self._key)
+                        table = {}
+                else:
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, spill.write_build, batch, self.right_keys, self._key
+                    )
+
+            if spill is None:
+                async for batch in left_batches:
+                    joined = self._probe(table, batch)
+                    if joined:
+                        yield joined
+                return
+
+            async for batch in left_batches:
+                unmatched = await asyncio.get_running_loop().run_in_executor(
+                    None, spill.write_probe, batch, self.left_keys, self._key
+                )
+                # Строки с NULL в ключе не попадают ни в одну партицию
+                if self.how == "left" and unmatched:
+                    yield [self._combine(left, None) for left in unmatched]
+
+            for partition in range(self.spill_partitions):
+                table = {}
+                for row in spill.read_build(partition):
+                    table.setdefault(self._key(row, self.right_keys), []).append(row)
+                for batch in spill.read_probe(partition):
+                    joined = self._probe(table, batch)
+                    if joined:
+                        yield joined
+        finally:
+            if spill is not None:
+                spill.close()
+
+
+class JoinSpill:
+    """Партиции хеш-соединения во временных файлах"""
+
+    def __init__(self, partitions: int, batch_size: int = 1000):
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.directory = tempfile.TemporaryDirectory(prefix="aetherquery-join-")
+        self._files = {
+            (side, i): open(os.path.join(self.directory.name, f"{side}-{i}.bin"), "w+b")
+            for side in ("build", "probe") for i in range(partitions)
+        }
+
+    def _write(self, side: str, rows: List[Dict[str, Any]], keys: List[str], key_func) -> List[Dict[str, Any]]:
+        buckets: Dict[int, List[Dict[str, Any]]] = {}
+        without_key = []
+        for row in rows:
+            key = key_func(row, keys)
+            if key is None:
+                without_key.append(row)
+            else:
+                buckets.setdefault(hash(key) % self.partitions, []).append(row)
+        for partition, bucket in buckets.items():
+            pickle.dump(bucket, self._files[(side, partition)], protocol=pickle.HIGHEST_PROTOCOL)
+        return without_key
+
+    def write_build(self, rows, keys, key_func):
+        self._write("build", rows, keys, key_func)
+
+    def write_probe(self, rows, keys, key_func) -> List[Dict[str, Any]]:
+        return self._write("probe", rows, keys, key_func)
+
+    def _read(self, side: str, partition: int):
+        f = self._files[(side, partition)]
+        f.flush()
+        f.seek(0)
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
+
+    def read_build(self, partition: int):
+        for batch in self._read("build", partition):
+            yield from batch
+
+    def read_probe(self, partition: int):
+        return self._read("probe", partition)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self.directory.cleanup()
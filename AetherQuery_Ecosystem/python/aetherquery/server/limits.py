@@ -0,0 +1,599 @@
+"""Ограничение параллельности: узлы, классы нагрузки и квоты арендаторов"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+from fastapi import HTTPException
+
+from .models import DEFAULT_WORKLOAD_CLASSES, TenantQuotaConfig, WorkloadClassConfig
+from .sql import query_fingerprint
+from .timings import timed
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+# Адаптивный предел параллельности узла
+class ConcurrencyLimiter:
+    """
+    Предел одновременных запросов к узлу, подстраиваемый по задержке
+
+    Средние задержки окон сглаживаются (LATENCY_SMOOTHING), чтобы одно окно
+    с выбросом не двигало предел; сглаженная задержка сравнивается с базовой
+    (медленное скользящее среднее). gradient: предел умножается на
+    tolerance * базовая / текущая (в границах 0.5..1) и к нему добавляется
+    sqrt(предела) как запас очереди; aimd: при росте задержки сверх
+    tolerance предел уменьшается на 10%, иначе растёт на 1. Если узел
+    загружен меньше чем наполовину, предел не меняется ни в одну сторону -
+    задержка без нагрузки ничего не говорит о ёмкости, а её колебания не
+    вызваны параллельностью. Запросы сверх предела ждут свободного места.
+    """
+
+    ALGORITHMS = ("gradient", "aimd")
+    MIN_SAMPLES = 5
+    BASELINE_WINDOWS = 50   # Сколько окон усредняет базовая задержка
+    SMOOTHING = 0.2         # Доля нового значения при сглаживании предела gradient
+    LATENCY_SMOOTHING = 0.5 # Доля нового окна в сглаженной задержке
+    BACKOFF = 0.9
+
+    def __init__(self, algorithm: str = "gradient", limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 window: float = 1.0, tolerance: float = 1.5, on_change=None):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown concurrency limit algorithm: {algorithm!r}")
+        self.algorithm = algorithm
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self._limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self.window = window
+        self.tolerance = tolerance
+        self.on_change = on_change
+        self.in_flight = 0
+        self.waiters: deque = deque()
+        self.baseline: Optional[float] = None
+        self.recent: Optional[float] = None
+        self.gradient = 1.0
+        self._samples: List[float] = []
+        self._peak = 0
+        self._window_started = time.monotonic()
+        self.queued = 0
+        self.increases = 0
+        self.decreases = 0
+        self.decisions: deque = deque(maxlen=50)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Место для одного запроса; задержка успешных запросов учитывается в окне"""
+        if self.in_flight >= self.limit or self.waiters:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+            self.queued += 1
+            try:
+                with timed("lease"):
+                    await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Место выдано одновременно с отменой: отдаём следующему
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    future.cancel()
+                raise
+        else:
+            self.in_flight += 1
+        self._peak = max(self._peak, self.in_flight)
+        started = time.perf_counter()
+        try:
+            yield
+            self.observe(time.perf_counter() - started)
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        while self.waiters and self.in_flight < self.limit:
+            future = self.waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def observe(self, rtt: float):
+        """Добавляет задержку запроса; по окончании окна пересчитывает предел"""
+        self._samples.append(rtt)
+        now = time.monotonic()
+        if now - self._window_started < self.window or len(self._samples) < self.MIN_SAMPLES:
+            return
+        recent = sum(self._samples) / len(self._samples)
+        peak = max(self._peak, self.in_flight)
+        self._samples = []
+        self._peak = self.in_flight
+        self._window_started = now
+        self._update(recent, peak)
+
+    def _update(self, recent: float, peak: int):
+        if self.recent is not None:
+            recent = self.recent + (recent - self.recent) * self.LATENCY_SMOOTHING
+        if self.baseline is None:
+            self.baseline = recent
+        else:
+            self.baseline += (recent - self.baseline) / self.BASELINE_WINDOWS
+            if self.baseline > 2 * recent:
+                # Задержка резко упала (например, прогрелся кэш): базовая догоняет быстрее
+                self.baseline = max(recent, self.baseline * 0.95)
+        self.recent = recent
+        self.gradient = max(0.5, min(1.0, self.tolerance * self.baseline / recent)) if recent > 0 else 1.0
+        previous = self._limit
+
+        if self.algorithm == "gradient":
+            target = previous * self.gradient + previous ** 0.5
+            limit = previous * (1 - self.SMOOTHING) + target * self.SMOOTHING
+        elif self.gradient < 1.0:
+            limit = previous * self.BACKOFF
+        else:
+            limit = previous + 1
+        if peak * 2 < previous:
+            limit = previous
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        self._limit = limit
+
+        if int(limit) != int(previous):
+            increased = int(limit) > int(previous)
+            if increased:
+                self.increases += 1
+            else:
+                self.decreases += 1
+            self.decisions.append({
+                "timestamp": time.time(),
+                "limit": int(limit),
+                "previous": int(previous),
+                "reason": "increase" if increased else "latency",
+                "latency_ms": round(recent * 1000, 3),
+                "baseline_ms": round(self.baseline * 1000, 3),
+                "in_flight_peak": peak,
+            })
+            if self.on_change is not None:
+                try:
+                    self.on_change(int(limit))
+                except Exception as e:
+                    logger.warning(f"Pool resize to {int(limit)} failed: {e}")
+            self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "algorithm": self.algorithm,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "queued": self.queued,
+            "latency_ms": round(self.recent * 1000, 3) if self.recent is not None else None,
+            "baseline_ms": round(self.baseline * 1000, 3) if self.baseline is not None else None,
+            "gradient": round(self.gradient, 3),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "decisions": list(self.decisions)[-10:],
+        }
+
+
+# Классы нагрузки и планирование запросов
+class WorkloadClass:
+    """Очередь и счётчики одного класса нагрузки"""
+
+    def __init__(self, config: WorkloadClassConfig):
+        self.config = config
+        self.waiters: deque = deque()
+        self.running = 0
+        # Виртуальное время (stride scheduling): растёт на 1/weight за каждый выданный слот
+        self.pass_value = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits: deque = deque(maxlen=1000)
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def note_wait(self, seconds: float):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self.recent_waits.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.recent_waits)
+        return {
+            "priority": self.config.priority,
+            "weight": self.config.weight,
+            "max_concurrency": self.config.max_concurrency,
+            "running": self.running,
+            "queue_depth": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_total / self.admitted * 1000, 3) if self.admitted else 0.0,
+            "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3) if waits else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class WorkloadScheduler:
+    """
+    Допуск запросов к выполнению по классам нагрузки
+
+    Всего одновременно выполняется не больше max_concurrency запросов, у
+    каждого класса своя квота и очередь. Освободившийся слот получает класс
+    с наименьшим виртуальным временем (доли слотов пропорциональны весам),
+    при равенстве - с большим приоритетом. Квота класса не даёт фоновой
+    нагрузке занять все слоты, поэтому интерактивные запросы не голодают.
+    """
+
+    def __init__(self, classes: Optional[List[WorkloadClassConfig]] = None,
+                 max_concurrency: int = 32, default_class: str = "interactive"):
+        self.max_concurrency = max_concurrency
+        self.configure(classes or DEFAULT_WORKLOAD_CLASSES, default_class)
+
+    def configure(self, classes: List[WorkloadClassConfig], default_class: Optional[str] = None):
+        self.classes: Dict[str, WorkloadClass] = {config.name: WorkloadClass(config) for config in classes}
+        self.default_class = default_class if default_class in self.classes else classes[0].name
+        self._by_api_key = {key: config.name for config in classes for key in config.api_keys}
+        self._by_fingerprint = {
+            fingerprint: config.name for config in classes for fingerprint in config.fingerprints
+        }
+        self.running = 0
+        self.virtual_time = 0.0
+
+    def classify(self, api_key: Optional[str] = None, requested: Optional[str] = None,
+                 query: Optional[str] = None, default: Optional[str] = None) -> str:
+        """Класс запроса: по отпечатку, затем по ключу API, затем по заголовку, иначе по умолчанию"""
+        if query and self._by_fingerprint:
+            name = self._by_fingerprint.get(query_fingerprint(query))
+            if name:
+                return name
+        if api_key and api_key in self._by_api_key:
+            return self._by_api_key[api_key]
+        if requested in self.classes:
+            return requested
+        return default if default in self.classes else self.default_class
+
+    @asynccontextmanager
+    async def slot(self, name: str, timeout: Any = "default"):
+        """Ждёт слот для запроса класса name (timeout=None - без ограничения ожидания)"""
+        workload = self.classes.get(name) or self.classes[self.default_class]
+        if timeout == "default":
+            timeout = workload.config.queue_timeout
+        if not workload.waiters and self._can_run(workload) and not self._others_waiting():
+            self._grant(workload)
+            workload.note_wait(0.0)
+        else:
+            await self._wait(workload, timeout)
+        try:
+            yield workload
+        finally:
+            self._release(workload)
+
+    def _can_run(self, workload: WorkloadClass) -> bool:
+        return self.running < self.max_concurrency and workload.running < workload.config.max_concurrency
+
+    def _others_waiting(self) -> bool:
+        return any(other.waiters and self._can_run(other) for other in self.classes.values())
+
+    def _grant(self, workload: WorkloadClass):
+        self.running += 1
+        workload.running += 1
+        workload.admitted += 1
+        workload.pass_value += 1.0 / max(workload.config.weight, 1e-6)
+        self.virtual_time = workload.pass_value
+
+    async def _wait(self, workload: WorkloadClass, timeout: Optional[float]):
+        if len(workload.waiters) >= workload.config.max_queue:
+            workload.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Workload class {workload.name!r} queue is full",
+                headers={"Retry-After": str(self._retry_after(workload))},
+            )
+        if not workload.waiters and not workload.running:
+            # Класс, долго стоявший без дела, не получает накопленный кредит слотов
+            workload.pass_value = max(workload.pass_value, self.virtual_time)
+        future = asyncio.get_running_loop().create_future()
+        workload.waiters.append(future)
+        workload.queued += 1
+        started = time.perf_counter()
+        self._dispatch()
+        try:
+            with timed("admission"):
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот выдан одновременно с отменой: возвращаем его
+                self._release(workload)
+            else:
+                future.cancel()
+                try:
+                    workload.waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                workload.timed_out += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Timed out waiting for a {workload.name!r} slot",
+                    headers={"Retry-After": str(self._retry_after(workload))},
+                )
+            raise
+        workload.note_wait(time.perf_counter() - started)
+
+    def _dispatch(self):
+        """Раздаёт свободные слоты ожидающим классам"""
+        while self.running < self.max_concurrency:
+            eligible = [workload for workload in self.classes.values()
+                        if workload.waiters and workload.running < workload.config.max_concurrency]
+            if not eligible:
+                return
+            workload = min(eligible, key=lambda item: (item.pass_value, -item.config.priority))
+            future = workload.waiters.popleft()
+            if future.done():
+                continue
+            self._grant(workload)
+            future.set_result(None)
+
+    def _release(self, workload: WorkloadClass):
+        self.running -= 1
+        workload.running -= 1
+        self._dispatch()
+
+    @staticmethod
+    def _retry_after(workload: WorkloadClass) -> int:
+        waits = workload.recent_waits
+        average = sum(waits) / len(waits) if waits else 1.0
+        return max(1, int(average + 0.999))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self.running,
+            "default_class": self.default_class,
+            "classes": {name: workload.stats() for name, workload in self.classes.items()},
+        }
+
+
+# Квоты арендаторов по ключу API
+class TokenBucket:
+    """Корзина токенов: rate запросов в секунду с всплеском до burst"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = float(burst if burst is not None else max(1, int(rate)))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Забирает токен; если его нет - возвращает, через сколько секунд он появится"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Tenant:
+    """Квота и счётчики использования одного ключа API"""
+
+    def __init__(self, name: str, config: TenantQuotaConfig):
+        self.name = name
+        self.config = config
+        self.bucket = TokenBucket(config.rate, config.burst) if config.rate > 0 else None
+        self.in_flight = 0
+        self.connections: Dict[str, int] = {}
+        self.queries = 0
+        self.rows = 0
+        self.execution_time = 0.0
+        self.sessions = 0
+        self.rejected = {"rate": 0, "concurrency": 0, "connections": 0}
+        self.last_seen = time.monotonic()
+        # Фоновая работа, ждущая квоты: (future, источники, занимает ли соединение)
+        self.waiters: deque = deque()
+
+    @property
+    def idle(self) -> bool:
+        return not self.in_flight and not any(self.connections.values()) and not self.waiters
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.config.rate,
+            "max_concurrent_queries": self.config.max_concurrent_queries,
+            "max_connections": self.config.max_connections,
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "connections": {name: count for name, count in self.connections.items() if count},
+            "queries": self.queries,
+            "rows": self.rows,
+            "execution_time": round(self.execution_time, 3),
+            "sessions": self.sessions,
+            "rejected": dict(self.rejected),
+        }
+
+
+class TenantLimits:
+    """
+    Изоляция арендаторов: у каждого ключа API своя корзина токенов, предел
+    одновременных запросов и доля соединений каждого источника данных
+
+    Превышение квоты - сразу 429 с Retry-After: запрос шумного арендатора
+    не ждёт в общей очереди и не занимает слоты остальных.
+    """
+
+    MAX_TENANTS = 10000
+
+    def __init__(self, quotas: Optional[List[TenantQuotaConfig]] = None):
+        self.configure(quotas or [])
+
+    def configure(self, quotas: List[TenantQuotaConfig]):
+        self.quotas = {quota.api_key: quota for quota in quotas}
+        self.default = self.quotas.pop("*", TenantQuotaConfig())
+        self.tenants: Dict[Optional[str], Tenant] = {}
+
+    def tenant(self, api_key: Optional[str]) -> Tenant:
+        tenant = self.tenants.get(api_key)
+        if tenant is None:
+            config = self.quotas.get(api_key, self.default) if api_key else self.default
+            if config.name and api_key in self.quotas:
+                name = config.name
+            elif api_key:
+                name = "key-" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+            else:
+                name = "anonymous"
+            if len(self.tenants) >= self.MAX_TENANTS:
+                self._evict()
+            tenant = self.tenants[api_key] = Tenant(name, config)
+        tenant.last_seen = time.monotonic()
+        return tenant
+
+    def _evict(self):
+        """Забывает самых давних простаивающих арендаторов без явной квоты"""
+        idle = sorted(
+            (tenant.last_seen, key) for key, tenant in self.tenants.items()
+            if tenant.idle and key not in self.quotas
+        )
+        for _, key in idle[:max(1, len(idle) // 10)]:
+            del self.tenants[key]
+
+    @staticmethod
+    def _reject(tenant: Tenant, resource: str, detail: str, retry_after: float = 1.0):
+        tenant.rejected[resource] += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Tenant {tenant.name!r}: {detail}",
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999))), "X-Quota-Exceeded": resource},
+        )
+
+    def check_rate(self, api_key: Optional[str]) -> Tenant:
+        """Списывает запрос с корзины токенов арендатора"""
+        tenant = self.tenant(api_key)
+        if tenant.bucket is not None:
+            wait = tenant.bucket.take()
+            if wait:
+                self._reject(tenant, "rate", f"rate limit of {tenant.config.rate:g} queries/s exceeded", wait)
+        return tenant
+
+    @staticmethod
+    def _exceeded(tenant: Tenant, datasources: List[str], connection: bool) -> Optional[Tuple[str, str]]:
+        """Какая квота не даёт начать запрос: (ресурс, описание) или None"""
+        limit = tenant.config.max_concurrent_queries
+        if limit and tenant.in_flight >= limit:
+            return "concurrency", f"{limit} queries already in flight"
+        limit = tenant.config.max_connections
+        for datasource in datasources if connection else ():
+            if limit and tenant.connections.get(datasource, 0) >= limit:
+                return "connections", f"{limit} connections to {datasource!r} already in use"
+        return None
+
+    def _check_connections(self, tenant: Tenant, datasource: str):
+        limit = tenant.config.max_connections
+        if limit and tenant.connections.get(datasource, 0) >= limit:
+            self._reject(tenant, "connections", f"{limit} connections to {datasource!r} already in use")
+
+    @asynccontextmanager
+    async def query(self, api_key: Optional[str], datasource: Union[str, List[str]], connection: bool = True,
+                    queued: bool = False):
+        """
+        Квоты на время выполнения запроса
+
+        datasource - имя источника или список имён, если запрос читает
+        несколько источников (федеративное соединение): запрос один, соединение
+        занимается в каждом. connection=False - запрос идёт по уже открытому
+        соединению транзакции и не занимает новое. queued=True - фоновая работа
+        (задание, импорт, пересчёт живого запроса), которая прошла check_rate
+        при постановке: вместо 429 она ждёт, пока у арендатора освободится квота.
+        """
+        datasources = [datasource] if isinstance(datasource, str) else list(dict.fromkeys(datasource))
+        if queued:
+            tenant = self.tenant(api_key)
+            if tenant.waiters or self._exceeded(tenant, datasources, connection):
+                # Очередь FIFO: место выдаёт освобождающий запрос, новые фоновые не обгоняют старые
+                future = asyncio.get_running_loop().create_future()
+                tenant.waiters.append((future, datasources, connection))
+                try:
+                    await future
+                except asyncio.CancelledError:
+                    if future.done() and not future.cancelled():
+                        self._release(tenant, datasources, connection)
+                    else:
+                        future.cancel()
+                        self._wake(tenant)
+                    raise
+            else:
+                self._admit(tenant, datasources, connection)
+        else:
+            tenant = self.check_rate(api_key)
+            exceeded = self._exceeded(tenant, datasources, connection)
+            if exceeded:
+                self._reject(tenant, *exceeded)
+            self._admit(tenant, datasources, connection)
+        started = time.perf_counter()
+        try:
+            yield tenant
+        finally:
+            tenant.execution_time += time.perf_counter() - started
+            self._release(tenant, datasources, connection)
+
+    @staticmethod
+    def _admit(tenant: Tenant, datasources: List[str], connection: bool):
+        if connection:
+            for name in datasources:
+                tenant.connections[name] = tenant.connections.get(name, 0) + 1
+        tenant.in_flight += 1
+        tenant.queries += 1
+
+    @classmethod
+    def _release(cls, tenant: Tenant, datasources: List[str], connection: bool):
+        tenant.in_flight -= 1
+        if connection:
+            for name in datasources:
+                tenant.connections[name] -= 1
+        cls._wake(tenant)
+
+    @classmethod
+    def _wake(cls, tenant: Tenant):
+        """Пускает ожидающих по порядку, пока первому в очереди хватает квоты"""
+        while tenant.waiters:
+            future, datasources, connection = tenant.waiters[0]
+            if future.done():
+                tenant.waiters.popleft()
+                continue
+            if cls._exceeded(tenant, datasources, connection):
+                return
+            tenant.waiters.popleft()
+            cls._admit(tenant, datasources, connection)
+            future.set_result(None)
+
+    def open_connection(self, api_key: Optional[str], datasource: str) -> Tenant:
+        """Закрепляет за арендатором соединение (транзакция /session)"""
+        tenant = self.check_rate(api_key)
+        self._check_connections(tenant, datasource)
+        tenant.connections[datasource] = tenant.connections.get(datasource, 0) + 1
+        tenant.sessions += 1
+        return tenant
+
+    @classmethod
+    def close_connection(cls, tenant: Tenant, datasource: str):
+        tenant.connections[datasource] = max(0, tenant.connections.get(datasource, 0) - 1)
+        cls._wake(tenant)
+
+    def stats(self) -> Dict[str, Any]:
+        return {tenant.name: tenant.stats() for tenant in self.tenants.values()}
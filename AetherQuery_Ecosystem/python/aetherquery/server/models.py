@@ -0,0 +1,195 @@
+"""Модели запросов и ответов API и конфигурации источников данных"""
+
+from typing import Dict, Any, Optional, List
+
+from pydantic import BaseModel
+
+
+# Модели данных
+class HealthResponse(BaseModel):
+    status: str
+    timestamp: str
+    version: str
+    uptime: float
+
+
+class QueryRequest(BaseModel):
+    query: str
+    params: Optional[List[Any]] = None
+    parameters: Optional[Dict[str, Any]] = None
+    options: Optional[Dict[str, Any]] = None
+    timeout: Optional[int] = 30
+
+
+class QueryResponse(BaseModel):
+    success: bool
+    data: Optional[List[Dict[str, Any]]] = None
+    error: Optional[str] = None
+    execution_time: float
+    query: str
+    node: Optional[str] = None
+    cached: bool = False
+    timings: Optional[Dict[str, float]] = None  # Фазы запроса в мс (options.timings)
+
+
+class ScanRequest(BaseModel):
+    table: str
+    columns: Optional[List[str]] = None
+    partitions: int = 4
+    order_by: Optional[str] = None
+    batch_size: int = 1000
+    stream: bool = False
+    datasource: Optional[str] = None
+
+
+class FederatedSource(BaseModel):
+    datasource: str = "default"
+    table: str
+    columns: Optional[List[str]] = None
+    filters: Optional[Dict[str, Any]] = None
+    alias: Optional[str] = None
+
+
+class FederatedQueryRequest(BaseModel):
+    left: FederatedSource
+    right: FederatedSource
+    on: Dict[str, str]              # {"колонка слева": "колонка справа"}
+    how: str = "inner"              # inner | left
+    limit: Optional[int] = None
+    memory_rows: int = 100000       # Порог строк правой стороны в памяти до сброса на диск
+    stream: bool = False
+
+
+class ExportRequest(BaseModel):
+    query: str
+    params: List[Any] = []
+    format: str = "csv"                   # csv | parquet
+    compression: Optional[str] = None     # csv: gzip; parquet: snappy, zstd, gzip, ...
+    name: Optional[str] = None            # Подкаталог в каталоге экспорта (по умолчанию - случайный)
+    partition_rows: int = 100000          # Строк в одном файле
+    partition_by: Optional[str] = None    # Колонка для разбиения по каталогам key=value
+    batch_size: int = 5000
+    datasource: Optional[str] = None
+
+
+class ImportRequest(BaseModel):
+    path: str                             # Файл относительно каталога импорта сервера
+    table: str
+    format: Optional[str] = None          # csv | parquet (по умолчанию - по расширению)
+    delimiter: str = ","
+    create: bool = True                   # Создать таблицу с выведенными типами, если её нет
+    batch_size: int = 10000               # Строк в одной пачке загрузки
+    chunk_bytes: int = 8 << 20            # Размер части файла для разбора в отдельном процессе
+    datasource: Optional[str] = None
+
+
+class ServerInfo(BaseModel):
+    name: str
+    version: str
+    description: str
+    endpoints: List[str]
+    started_at: str
+
+
+class PlanNode(BaseModel):
+    """Узел нормализованного плана выполнения (одинаковый для всех бэкендов)"""
+    operation: str                        # query, scan, search, sort, subquery, compound, ...
+    detail: str = ""                      # Описание узла в исходном плане бэкенда
+    table: Optional[str] = None
+    index: Optional[str] = None           # Используемый индекс ("PRIMARY KEY" - по первичному ключу)
+    covering: bool = False                # Индекс покрывает запрос, таблица не читается
+    estimated_rows: Optional[float] = None
+    actual_rows: Optional[int] = None     # Только при analyze
+    cost: Optional[float] = None
+    children: List["PlanNode"] = []
+
+
+class ExplainRequest(BaseModel):
+    query: str
+    params: Optional[List[Any]] = None
+    analyze: bool = False                 # Выполнить запрос и добавить фактические строки и время
+    datasource: Optional[str] = None
+
+
+class ExplainResponse(BaseModel):
+    query: str
+    node: str
+    plan: PlanNode
+    analyzed: bool = False
+    execution_time: Optional[float] = None  # мс, только при analyze
+    raw: List[Dict[str, Any]] = []          # План в формате бэкенда
+
+
+class WorkloadClassConfig(BaseModel):
+    """Класс нагрузки: своя квота, очередь, приоритет и доля слотов"""
+    name: str
+    priority: int = 0                 # При равной доле слот получает класс с большим приоритетом
+    weight: float = 1.0               # Доля слотов при конкуренции классов
+    max_concurrency: int = 8          # Квота одновременно выполняемых запросов класса
+    max_queue: int = 1000             # Длина очереди; при переполнении - 429
+    queue_timeout: float = 30.0       # Сколько запрос ждёт слот, сек
+    api_keys: List[str] = []          # Ключи API, запросы которых относятся к классу
+    fingerprints: List[str] = []      # Отпечатки запросов (query_fingerprint), закреплённые за классом
+
+
+DEFAULT_WORKLOAD_CLASSES = [
+    WorkloadClassConfig(name="interactive", priority=10, weight=8.0, max_concurrency=32),
+    WorkloadClassConfig(name="background", priority=0, weight=1.0, max_concurrency=2, queue_timeout=3600.0),
+]
+
+
+class TenantQuotaConfig(BaseModel):
+    """Квоты арендатора (ключа API); у каждого ключа свои счётчики"""
+    api_key: str = "*"                # "*" - квота ключей, не перечисленных явно, и запросов без ключа
+    name: Optional[str] = None        # Имя в статистике (ключ туда не попадает)
+    rate: float = 0.0                 # Запросов в секунду (token bucket), 0 - без ограничения
+    burst: Optional[int] = None       # Ёмкость корзины; по умолчанию - секунда запросов
+    max_concurrent_queries: int = 0   # Запросов одновременно по всем источникам, 0 - без ограничения
+    max_connections: int = 0          # Соединений на источник: запросы в работе и открытые транзакции
+
+
+class WriteBehindRule(BaseModel):
+    """Какие записи буферизуются и как сливаются записи в одну строку"""
+    table: Optional[str] = None        # Все INSERT/UPDATE в таблицу
+    fingerprint: Optional[str] = None  # Или только запросы этой формы (query_fingerprint)
+    key_params: List[int] = []         # Позиции параметров, задающих строку; пусто - записи не сливаются
+    coalesce: str = "last"             # last - остаётся последняя запись ключа; sum - складываются sum_params
+    sum_params: List[int] = []
+
+
+class DatasourceConfig(BaseModel):
+    """Конфигурация источника данных: primary + список реплик"""
+    name: str = "default"
+    primary: str = "simulated://primary"
+    replicas: List[str] = []
+    max_replica_lag: float = 5.0      # Максимально допустимое отставание реплики, сек
+    read_your_writes: float = 0.0     # Окно чтения своих записей с primary, сек (0 - выключено)
+    lag_probe_interval: float = 1.0   # Период измерения отставания реплик, сек
+    cache: Optional[str] = None       # Кэш результатов: redis://host:6379/0 или memory://
+    cache_ttl: float = 60.0           # Время жизни записи кэша, сек
+    cache_ttl_jitter: float = 0.1     # Разброс TTL (доля), чтобы записи не истекали одновременно
+    cache_stale_ttl: float = 0.0      # Сколько после TTL отдавать устаревший результат, обновляя его в фоне, сек
+    prewarm_top: int = 0              # Сколько самых частых форм запросов держать прогретыми в кэше; 0 - выключено
+    prewarm_margin: float = 5.0       # За сколько секунд до истечения TTL прогрев обновляет запись
+    prewarm_state: Optional[str] = None  # JSON файл с частыми запросами для прогрева после рестарта
+    metadata_refresh: float = 300.0   # Период фонового обновления кэша метаданных, сек
+    max_sessions: int = 8             # Максимум одновременно открытых транзакций через /session
+    session_idle_timeout: float = 30.0  # Простаивающая транзакция откатывается через, сек
+    change_poll_interval: float = 1.0   # Период проверки внешних изменений (PRAGMA data_version), сек; 0 - выключено
+    slow_query_ms: float = 0.0          # Запросы дольше порога попадают в журнал с планом, мс; 0 - выключено
+    slow_query_log_size: int = 200      # Сколько форм медленных запросов хранить
+    write_behind: List[WriteBehindRule] = []  # Отложенная запись: правила буферизации
+    write_behind_max_rows: int = 1000         # Сброс буфера при наборе строк
+    write_behind_interval: float = 1.0        # Сброс буфера не реже, сек
+    write_behind_max_buffered: int = 100000   # Больше строк в буфере - новые записи отклоняются
+    write_behind_log: Optional[str] = None    # Журнал отложенных записей (append-only) для восстановления после падения
+    write_behind_fsync: bool = False          # fsync журнала на каждую запись (переживает отключение питания)
+    concurrency_limit: str = "fixed"    # Предел параллельности узла: fixed, gradient или aimd
+    min_concurrency: int = 1            # Границы адаптивного предела (и пула читателей)
+    max_concurrency: int = 64
+    concurrency_window: float = 1.0     # Окно усреднения задержки для пересчёта предела, сек
+    latency_tolerance: float = 1.5      # Во сколько раз задержка может превысить базовую без снижения предела
+
+
+class SessionRequest(BaseModel):
+    datasource: Optional[str] = None
@@ -0,0 +1,125 @@
+"""Транзакционные сессии клиентов"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, Any, Optional, List
+
+from fastapi import HTTPException
+
+from .backends import BackendError
+from .datasource import Datasource
+from .limits import Tenant, TenantLimits
+from .sql import classify_statement
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+# HTTP транзакции
+class TransactionSession:
+    """Транзакция, открытая через /session и закреплённая за соединением"""
+
+    def __init__(self, datasource: Datasource, transaction, client_key: Optional[str],
+                 tenant: Optional["Tenant"] = None):
+        self.id = uuid.uuid4().hex
+        self.datasource = datasource
+        self.transaction = transaction
+        self.client_key = client_key
+        self.tenant = tenant
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.queries = 0
+        self.writes: List[str] = []
+        self.lock = asyncio.Lock()
+
+    @property
+    def idle(self) -> float:
+        return time.monotonic() - self.last_used
+
+    async def execute(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        # Запросы одной транзакции выполняются строго по очереди
+        async with self.lock:
+            self.last_used = time.monotonic()
+            self.queries += 1
+            try:
+                data = await self.transaction.execute(query, params)
+            finally:
+                self.last_used = time.monotonic()
+            if classify_statement(query) == "write":
+                self.writes.append(query)
+            return data
+
+
+class SessionManager:
+    """Реестр открытых транзакций с лимитами и откатом простаивающих"""
+
+    def __init__(self):
+        self.sessions: Dict[str, TransactionSession] = {}
+        self.expired = 0
+
+    def count(self, datasource: Datasource) -> int:
+        return sum(1 for session in self.sessions.values() if session.datasource is datasource)
+
+    async def open(self, datasource: Datasource, client_key: Optional[str],
+                   tenant: Optional["Tenant"] = None) -> TransactionSession:
+        """Открывает транзакцию; tenant - арендатор, за которым уже закреплено соединение"""
+        try:
+            if self.count(datasource) >= datasource.config.max_sessions:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Too many open sessions for datasource {datasource.name!r}",
+                    headers={"Retry-After": str(max(1, int(datasource.config.session_idle_timeout)))},
+                )
+            transaction = await datasource.open_transaction()
+        except BaseException:
+            if tenant is not None:
+                TenantLimits.close_connection(tenant, datasource.name)
+            raise
+        session = TransactionSession(datasource, transaction, client_key, tenant)
+        self.sessions[session.id] = session
+        logger.info(f"Session {session.id} opened on {datasource.name}")
+        return session
+
+    def get(self, session_id: str) -> TransactionSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+        return session
+
+    async def finish(self, session_id: str, commit: bool) -> TransactionSession:
+        session = self.get(session_id)
+        async with session.lock:
+            del self.sessions[session_id]
+            if session.tenant is not None:
+                TenantLimits.close_connection(session.tenant, session.datasource.name)
+            if commit:
+                await session.transaction.commit()
+                if session.writes:
+                    session.datasource.note_write(session.client_key)
+                    await session.datasource.invalidate_after_write(session.writes)
+            else:
+                await session.transaction.rollback()
+        logger.info(f"Session {session_id} {'committed' if commit else 'rolled back'}")
+        return session
+
+    async def expire_idle(self):
+        """Откатывает транзакции, простаивающие дольше таймаута"""
+        for session_id, session in list(self.sessions.items()):
+            if session.idle > session.datasource.config.session_idle_timeout and not session.lock.locked():
+                logger.warning(f"Session {session_id} idle for {session.idle:.1f}s, rolling back")
+                self.expired += 1
+                try:
+                    await self.finish(session_id, commit=False)
+                except (BackendError, HTTPException) as e:
+                    logger.warning(f"Rollback of idle session {session_id} failed: {e}")
+
+    async def close_all(self):
+        for session_id in list(self.sessions):
+            try:
+                await self.finish(session_id, commit=False)
+            except (BackendError, HTTPException):
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"open": len(self.sessions), "expired": self.expired}
@@ -0,0 +1,74 @@
+"""Передача больших результатов через разделяемую память"""
+
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Any
+
+from fastapi.requests import HTTPConnection
+
+
+# Передача больших результатов локальным клиентам через разделяемую память
+SHARED_MEMORY_HEADER = "x-aetherquery-shm"
+
+
+class SharedResultStore:
+    """
+    Сегменты разделяемой памяти с результатами для клиентов на Unix socket
+
+    По сокету уходит только дескриптор (имя сегмента и размер); клиент
+    читает сегмент и удаляет его сам. Непрочитанные сегменты удаляются по TTL.
+    """
+
+    def __init__(self, threshold: int = 1 << 20, ttl: float = 60.0):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._segments: Dict[str, float] = {}
+        self.handed_over = 0
+        self.expired = 0
+        self.bytes = 0
+
+    def put(self, payload: bytes) -> Dict[str, Any]:
+        segment = shared_memory.SharedMemory(create=True, size=len(payload))
+        try:
+            segment.buf[:len(payload)] = payload
+        finally:
+            segment.close()
+        # Сегмент удаляет клиент, трекер ресурсов сервера не должен удалять его при выходе
+        resource_tracker.unregister(segment._name, "shared_memory")
+        self._segments[segment.name] = time.monotonic() + self.ttl
+        self.handed_over += 1
+        self.bytes += len(payload)
+        return {"name": segment.name, "size": len(payload)}
+
+    def expire(self, force: bool = False):
+        now = time.monotonic()
+        for name, deadline in list(self._segments.items()):
+            if force or deadline <= now:
+                del self._segments[name]
+                if self._unlink(name):
+                    self.expired += 1
+
+    @staticmethod
+    def _unlink(name: str) -> bool:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            # Клиент уже прочитал и удалил сегмент
+            return False
+        segment.close()
+        segment.unlink()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "handed_over": self.handed_over,
+            "expired": self.expired,
+            "bytes": self.bytes,
+            "pending": len(self._segments),
+        }
+
+
+def wants_shared_memory(http_request: HTTPConnection) -> bool:
+    """Клиент на Unix socket (адреса у такого соединения нет) согласен читать разделяемую память"""
+    return bool(http_request.headers.get(SHARED_MEMORY_HEADER)) and not http_request.scope.get("client")
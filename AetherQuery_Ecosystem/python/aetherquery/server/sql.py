@@ -0,0 +1,114 @@
+"""Разбор текста запросов: тип оператора, отпечатки, таблицы и псевдонимы"""
+
+import hashlib
+import re
+from typing import Dict, List
+
+
+# Маршрутизация чтения/записи
+READ_STATEMENTS = {"select", "show", "explain", "describe", "desc", "values"}
+
+# Читающие команды источника redis:// (для маршрутизации на реплики; в кэш они не попадают)
+READ_STATEMENTS |= {
+    "scan", "hscan", "sscan", "zscan", "keys", "get", "mget", "hget", "hmget", "hgetall", "hlen",
+    "lrange", "llen", "smembers", "sismember", "scard", "zrange", "zscore", "zcard", "exists", "ttl", "type",
+}
+
+WRITE_KEYWORDS = re.compile(r"\b(insert|update|delete|merge|replace|upsert|for\s+update|for\s+share)\b")
+
+LEADING_COMMENTS = re.compile(r"^\s*(--[^\n]*\n|/\*.*?\*/)\s*", re.DOTALL)
+
+
+def classify_statement(query: str) -> str:
+    """Классифицирует запрос как 'read' или 'write'"""
+    text = query.strip()
+    while True:
+        match = LEADING_COMMENTS.match(text)
+        if not match:
+            break
+        text = text[match.end():]
+    text = text.lower()
+    keyword = text.split(None, 1)[0] if text else ""
+
+    if keyword == "with" or keyword == "select":
+        # CTE может модифицировать данные, SELECT ... FOR UPDATE берёт блокировки
+        return "write" if WRITE_KEYWORDS.search(text) else "read"
+    if keyword == "pragma":
+        return "write" if "=" in text else "read"
+    return "read" if keyword in READ_STATEMENTS else "write"
+
+
+# Отпечатки запросов
+FINGERPRINT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+TABLE_REFERENCES = re.compile(
+    r"\b(?:from|join|into|update|table|exists)\s+(?:if\s+(?:not\s+)?exists\s+)?[`\"\[]?([A-Za-z_][\w.]*)",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Убирает комментарии и лишние пробелы, приводит к нижнему регистру"""
+    text = re.sub(r"--[^\n]*|/\*.*?\*/", " ", query, flags=re.DOTALL)
+    return " ".join(text.split()).rstrip(";").lower()
+
+
+QUOTED_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def canonical_query(query: str) -> str:
+    """Как normalize_query, но строковые литералы и идентификаторы в кавычках остаются как есть"""
+    parts, pending, pos = [], [], 0
+    for match in QUOTED_OR_COMMENT.finditer(query):
+        pending.append(query[pos:match.start()])
+        pos = match.end()
+        if match.group(1) is None:
+            pending.append(" ")
+            continue
+        parts.append(re.sub(r"\s+", " ", "".join(pending)).lower())
+        parts.append(match.group(1))
+        pending = []
+    pending.append(query[pos:])
+    parts.append(re.sub(r"\s+", " ", "".join(pending)).lower())
+    return "".join(parts).strip().rstrip(";").rstrip()
+
+
+def query_fingerprint(query: str) -> str:
+    """Отпечаток формы запроса: литералы заменены на ?"""
+    shape = FINGERPRINT_LITERALS.sub("?", normalize_query(query))
+    shape = re.sub(r"\s*([=<>!,()])\s*", r"\1", shape)
+    return hashlib.sha1(shape.encode()).hexdigest()[:16]
+
+
+def extract_tables(query: str) -> List[str]:
+    """Имена таблиц, упомянутых в запросе"""
+    tables = []
+    for name in TABLE_REFERENCES.findall(query):
+        name = name.lower().split(".")[-1]
+        if name not in tables and name != "select":
+            tables.append(name)
+    return tables
+
+
+TABLE_ALIASES = re.compile(r"\b(?:from|join)\s+[`\"\[]?(\w+)[`\"\]]?(?:\s+(?:as\s+)?(\w+))?", re.IGNORECASE)
+
+ALIAS_STOP_WORDS = {"where", "on", "join", "left", "right", "inner", "outer", "cross", "natural",
+                    "group", "order", "limit", "using", "union", "having", "window"}
+
+
+def table_aliases(query: str) -> Dict[str, str]:
+    """Псевдонимы таблиц запроса: {псевдоним: таблица}"""
+    aliases = {}
+    for table, alias in TABLE_ALIASES.findall(query):
+        if alias and alias.lower() not in ALIAS_STOP_WORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+DDL_STATEMENTS = {"create", "alter", "drop", "rename", "truncate", "analyze", "vacuum", "reindex"}
+
+
+def is_ddl(query: str) -> bool:
+    """Запрос меняет схему или статистику каталога"""
+    words = normalize_query(query).split(None, 1)
+    return bool(words) and words[0] in DDL_STATEMENTS
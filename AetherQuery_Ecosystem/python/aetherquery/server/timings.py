@@ -0,0 +1,67 @@
+"""Замеры этапов запроса для заголовка Server-Timing"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+# Замер фаз запроса
+class RequestTimings:
+    """Длительность фаз запроса в миллисекундах (фазы из разных потоков суммируются)"""
+
+    PHASES = ("admission", "queue", "lease", "cache", "execute", "fetch", "serialize")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds * 1000
+
+    def snapshot(self) -> Dict[str, float]:
+        result = {phase: round(self.phases[phase], 3) for phase in self.PHASES if phase in self.phases}
+        result["total"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return result
+
+    def header(self) -> str:
+        """Значение заголовка Server-Timing"""
+        return ", ".join(f"{phase};dur={duration}" for phase, duration in self.snapshot().items())
+
+
+current_timings: "contextvars.ContextVar[Optional[RequestTimings]]" = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+@contextmanager
+def timed(phase: str):
+    """Замеряет фазу текущего запроса (без активного замера ничего не делает)"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+def run_in_context(executor, func, *args) -> "asyncio.Future":
+    """run_in_executor с контекстом запроса и замером ожидания свободного потока"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        timings = context.get(current_timings)
+        if timings is not None:
+            timings.add("queue", time.perf_counter() - submitted)
+        return context.run(func, *args)
+
+    return loop.run_in_executor(executor, call)
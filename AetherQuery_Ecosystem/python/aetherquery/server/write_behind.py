@@ -0,0 +1,288 @@
+"""Отложенная запись: буферизация, слияние и пакетный сброс"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from .backends import BackendError
+from .models import DatasourceConfig, WriteBehindRule
+from .sql import canonical_query, extract_tables, normalize_query, query_fingerprint
+
+logger = logging.getLogger("AetherQueryServer")
+
+
+# Отложенная запись
+class WriteBehindBuffer:
+    """
+    Буфер частых мелких записей со слиянием и пакетным сбросом
+
+    Запись, подходящая под правило, подтверждается сразу и ждёт в памяти.
+    Записи одного запроса с одинаковыми ключевыми параметрами сливаются
+    (последняя побеждает или суммируются счётчики), если после ожидающей
+    записи в ту же таблицу не вставал другой запрос - порядок подтверждённых
+    записей одной таблицы сохраняется. Буфер сбрасывается одной транзакцией
+    в порядке поступления при наборе max_rows строк или раз в interval секунд.
+    Если сброс не удался, записи возвращаются в буфер и сброс повторяется
+    с нарастающей паузой. С журналом каждая запись сначала дописывается в
+    сегмент на диске; сегмент удаляется только после успешного сброса всех
+    его записей, а при старте оставшиеся сегменты загружаются обратно.
+    """
+
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, name: str, config: DatasourceConfig, execute_batch, on_flushed=None):
+        self.name = name
+        self.rules = config.write_behind
+        self.max_rows = config.write_behind_max_rows
+        self.interval = config.write_behind_interval
+        self.max_buffered = config.write_behind_max_buffered
+        self.fsync = config.write_behind_fsync
+        self.execute_batch = execute_batch
+        self.on_flushed = on_flushed
+        self.pending: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        self.oldest: Optional[float] = None
+        self._seq = 0
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+        self.failures = 0
+        self.accepted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.log_path = config.write_behind_log
+        self._log = None
+        self._segments: List[str] = []
+        if self.log_path:
+            self._replay()
+
+    def match(self, query: str) -> Optional[WriteBehindRule]:
+        words = normalize_query(query).split(None, 1)
+        if not words or words[0] not in ("insert", "update", "replace"):
+            return None
+        fingerprint = query_fingerprint(query)
+        tables = extract_tables(query)
+        for rule in self.rules:
+            if rule.fingerprint == fingerprint or (rule.table and tables and tables[0] == rule.table.lower()):
+                return rule
+        return None
+
+    def _key(self, query: str, params: Any, rule: Optional[WriteBehindRule]) -> Any:
+        if rule is not None and rule.key_params and isinstance(params, list) \
+                and all(i < len(params) for i in rule.key_params):
+            return (canonical_query(query), json.dumps([params[i] for i in rule.key_params], default=str))
+        self._seq += 1
+        return self._seq
+
+    @staticmethod
+    def _entry(query: str, params: Any, rule: Optional[WriteBehindRule]) -> Dict[str, Any]:
+        tables = extract_tables(query)
+        return {"query": query, "params": params, "rule": rule, "merged": 1,
+                "table": tables[0] if tables else None, "shape": canonical_query(query)}
+
+    @staticmethod
+    def _overtaken(pending: "OrderedDict[Any, Dict[str, Any]]", key: Any, entry: Dict[str, Any]) -> bool:
+        """После ожидающей записи key в ту же таблицу встал другой запрос: сливать нельзя"""
+        for later in reversed(pending):
+            if later == key:
+                return False
+            other = pending[later]
+            if other["table"] == entry["table"] and other["shape"] != entry["shape"]:
+                return True
+        return False
+
+    def _add(self, pending: "OrderedDict[Any, Dict[str, Any]]", key: Any, entry: Dict[str, Any]) -> bool:
+        """Добавляет запись в буфер; True - слита с уже ожидающей"""
+        current = pending.get(key)
+        if current is not None and self._overtaken(pending, key, entry):
+            # Слияние подняло бы запись выше другой записи той же таблицы: ожидающая остаётся
+            # на месте под своим номером, а новая встаёт в конец и принимает следующие слияния
+            self._seq += 1
+            items = [(self._seq if k == key else k, v) for k, v in pending.items()]
+            pending.clear()
+            pending.update(items)
+            current = None
+        if current is None:
+            pending[key] = entry
+            return False
+        rule = entry["rule"]
+        if rule.coalesce == "sum":
+            params = list(entry["params"])
+            for i in rule.sum_params:
+                params[i] = current["params"][i] + params[i]
+            entry = dict(entry, params=params)
+        # Слитая запись остаётся на месте первой, чтобы не обгонять записи других ключей
+        pending[key] = dict(entry, merged=current["merged"] + entry["merged"])
+        return True
+
+    async def submit(self, query: str, params: Any, rule: WriteBehindRule) -> bool:
+        """Ставит запись в буфер; True - запись слита с ожидающей записью той же строки"""
+        if len(self.pending) >= self.max_buffered:
+            self.rejected += 1
+            raise BackendError(f"Write-behind buffer of {self.name!r} is full ({self.max_buffered} rows)")
+        if self._log is not None:
+            self._append_log(query, params)
+        now = time.monotonic()
+        coalesced = self._add(self.pending, self._key(query, params, rule), self._entry(query, params, rule))
+        self.accepted += 1
+        self.coalesced += coalesced
+        if self.oldest is None:
+            self.oldest = now
+        if len(self.pending) >= self.max_rows:
+            self.flush_soon()
+        return coalesced
+
+    @property
+    def lag(self) -> float:
+        """Сколько секунд ждёт самая старая несброшенная запись"""
+        return time.monotonic() - self.oldest if self.oldest is not None else 0.0
+
+    def due(self) -> bool:
+        return bool(self.pending) and time.monotonic() >= self._retry_at and (
+            len(self.pending) >= self.max_rows or self.lag >= self.interval
+        )
+
+    def flush_soon(self):
+        if (self._flush_task is None or self._flush_task.done()) and time.monotonic() >= self._retry_at:
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> int:
+        """Сбрасывает буфер одной транзакцией; при ошибке записи возвращаются в буфер"""
+        async with self._lock:
+            if not self.pending:
+                return 0
+            batch, oldest = self.pending, self.oldest
+            self.pending, self.oldest = OrderedDict(), None
+            segments = self._rotate_log()
+            # Записи одного запроса подряд выполняются одним executemany; порядок записей не меняется
+            statements: List[Tuple[str, List[Any]]] = []
+            for entry in batch.values():
+                if statements and statements[-1][0] == entry["query"]:
+                    statements[-1][1].append(entry["params"])
+                else:
+                    statements.append((entry["query"], [entry["params"]]))
+            started = time.perf_counter()
+            lag_ms = (time.monotonic() - oldest) * 1000
+            try:
+                await self.execute_batch(statements)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # Отмена при остановке сервера: записи остаются в буфере и журнале
+                    self._restore(batch, oldest, segments)
+                    raise
+                self.flush_errors += 1
+                self.failures += 1
+                self.last_error = str(e)
+                self._retry_at = time.monotonic() + min(self.MAX_BACKOFF, 0.5 * 2 ** self.failures)
+                logger.warning(f"Write-behind flush of {len(batch)} rows to {self.name} failed: {e}")
+                self._restore(batch, oldest, segments)
+                return 0
+            self.failures = 0
+            self._retry_at = 0.0
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            for segment in segments:
+                os.remove(segment)
+        if self.on_flushed is not None:
+            await self.on_flushed(list(dict.fromkeys(query for query, _ in statements)))
+        return len(batch)
+
+    def _restore(self, batch: "OrderedDict[Any, Dict[str, Any]]", oldest: float, segments: List[str]):
+        """Возвращает несброшенные записи в начало буфера; новые записи того же ключа сливаются поверх"""
+        for key, entry in self.pending.items():
+            self.coalesced += self._add(batch, key, entry)
+        self.pending, self.oldest = batch, oldest
+        self._segments = segments + self._segments
+
+    # Журнал: сегменты <log>.000001, <log>.000002, ... - запись идёт в последний
+    def _segment_paths(self) -> List[str]:
+        directory = os.path.dirname(self.log_path) or "."
+        prefix = os.path.basename(self.log_path) + "."
+        names = [name for name in os.listdir(directory) if name.startswith(prefix) and name[len(prefix):].isdigit()]
+        return [os.path.join(directory, name) for name in sorted(names, key=lambda name: int(name[len(prefix):]))]
+
+    def _open_segment(self):
+        existing = self._segment_paths()
+        number = int(existing[-1].rsplit(".", 1)[1]) + 1 if existing else 1
+        path = f"{self.log_path}.{number:06d}"
+        self._log = open(path, "a", encoding="utf-8")
+        self._segments.append(path)
+
+    def _append_log(self, query: str, params: Any):
+        self._log.write(json.dumps({"q": query, "p": params}, default=str) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def _rotate_log(self) -> List[str]:
+        """Закрывает текущий сегмент: он удаляется после успешного сброса"""
+        if self._log is None:
+            return []
+        self._log.close()
+        segments, self._segments = self._segments, []
+        self._open_segment()
+        return segments
+
+    def _replay(self):
+        """Загружает в буфер записи, не сброшенные до остановки или падения"""
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        segments = self._segment_paths()
+        replayed = unmatched = 0
+        for segment in segments:
+            with open(segment, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная при падении последняя строка
+                        continue
+                    rule = self.match(record["q"])
+                    if rule is None:
+                        # Правило убрали из конфигурации, но запись уже подтверждена:
+                        # она уходит в базу со следующим сбросом, без слияния
+                        unmatched += 1
+                    self._add(self.pending, self._key(record["q"], record["p"], rule),
+                              self._entry(record["q"], record["p"], rule))
+                    self.oldest = self.oldest or time.monotonic()
+                    replayed += 1
+        self._segments = segments
+        self._open_segment()
+        if replayed:
+            logger.info(f"Write-behind {self.name}: replayed {replayed} writes from {len(segments)} log segments")
+        if unmatched:
+            logger.error(
+                f"Write-behind {self.name}: {unmatched} logged writes match no write-behind rule; "
+                f"they will be flushed as is"
+            )
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self.pending),
+            "accepted": self.accepted,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "last_error": self.last_error,
+            "lag_ms": round(self.lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "log_segments": len(self._segments),
+        }
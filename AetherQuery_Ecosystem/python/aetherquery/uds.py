@@ -0,0 +1,87 @@
+"""Транспорт через Unix domain socket и разделяемую память для клиентов на том же хосте"""
+
+import json
+import socket
+from multiprocessing import shared_memory
+from typing import Any, Dict
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from .exceptions import AetherQueryError
+
+# Фиктивный адрес, под которым сессия requests ходит в сокет
+UNIX_BASE_URL = 'http://aetherquery.sock'
+
+# Заголовок, которым клиент сообщает, что готов читать результаты из разделяемой памяти
+SHARED_MEMORY_HEADER = 'X-AetherQuery-Shm'
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    """HTTP соединение поверх Unix domain socket"""
+
+    def __init__(self, socket_path: str, **kwargs):
+        super().__init__('localhost', **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class _UnixConnectionPool(HTTPConnectionPool):
+    """Пул keep-alive соединений к одному сокету"""
+
+    def __init__(self, socket_path: str, maxsize: int = 10):
+        super().__init__('localhost', maxsize=maxsize)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> _UnixHTTPConnection:
+        return _UnixHTTPConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """Адаптер requests, отправляющий все запросы в Unix domain socket"""
+
+    def __init__(self, socket_path: str, pool_maxsize: int = 10):
+        super().__init__()
+        self.socket_path = socket_path
+        self._pool = _UnixConnectionPool(socket_path, maxsize=pool_maxsize)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def close(self):
+        self._pool.close()
+        super().close()
+
+
+def read_shared_result(descriptor: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Читает результат, переданный сервером через сегмент разделяемой памяти
+
+    Сегмент принадлежит клиенту: после чтения он удаляется.
+    """
+    try:
+        segment = shared_memory.SharedMemory(name=descriptor['name'])
+    except FileNotFoundError:
+        raise AetherQueryError(
+            f"Shared memory result {descriptor['name']} expired before it was read",
+            code="SHARED_MEMORY_EXPIRED",
+        )
+    try:
+        payload = bytes(segment.buf[:descriptor['size']])
+    finally:
+        segment.close()
+        segment.unlink()
+    return json.loads(payload)
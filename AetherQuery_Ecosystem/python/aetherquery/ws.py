@@ -0,0 +1,246 @@
+"""WebSocket транспорт: много запросов через одно соединение с сервером"""
+
+import itertools
+import json
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, Any, Iterator, List, Callable
+
+try:
+    import websocket  # пакет websocket-client
+except ImportError:
+    websocket = None
+
+from .exceptions import (
+    ConfigurationError,
+    ConnectionError,
+    QueryError,
+    ResourceError,
+    TimeoutError,
+)
+
+_END = object()
+
+
+class _Pending:
+    """Запрос, ожидающий ответа сервера"""
+
+    def __init__(self, on_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+        self.future: Future = Future()
+        self.on_batch = on_batch
+        self.rows: List[Dict[str, Any]] = []
+
+
+class WebSocketChannel:
+    """
+    Мультиплексированный канал запросов к эндпоинту /ws
+
+    Каждый запрос получает свой id; ответы приходят в порядке готовности
+    и разбираются фоновым потоком, поэтому запросы из разных потоков
+    выполняются одновременно через один сокет.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 30.0,
+    ):
+        """
+        Открывает соединение
+
+        Args:
+            url: Адрес канала (ws://host:port/ws)
+            headers: Заголовки рукопожатия (Authorization, User-Agent, ...)
+            timeout: Таймаут ожидания ответа в секундах
+        """
+        if websocket is None:
+            raise ConfigurationError(
+                "WebSocket transport requires websocket-client: pip install websocket-client",
+                config_key="transport",
+                config_value="ws",
+            )
+        self.url = url
+        self.timeout = timeout
+
+        try:
+            self._ws = websocket.create_connection(
+                url,
+                header=[f"{name}: {value}" for name, value in (headers or {}).items()],
+                timeout=timeout,
+            )
+        except Exception as e:
+            raise ConnectionError("WebSocket connection failed", url=url, original_error=e)
+        # Чтение идёт в отдельном потоке без таймаута - ожидание ограничивает query()
+        self._ws.settimeout(None)
+
+        self._ids = itertools.count(1)
+        self._pending: Dict[str, _Pending] = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, name="aetherquery-ws", daemon=True)
+        self._reader.start()
+
+    def submit(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        options: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        on_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> Future:
+        """
+        Отправляет запрос, не дожидаясь ответа
+
+        Returns:
+            Future с результатом в формате ответа /query; его атрибут
+            request_id можно передать в cancel()
+        """
+        request_id = str(next(self._ids))
+        pending = _Pending(on_batch)
+        pending.future.request_id = request_id
+        self._pending[request_id] = pending
+
+        message: Dict[str, Any] = {'id': request_id, 'type': 'query', 'query': sql}
+        if params:
+            message['params'] = params
+        if options:
+            message['options'] = options
+        if session_id:
+            message['session_id'] = session_id
+        if batch_size:
+            message['batch_size'] = batch_size
+
+        try:
+            self._send(message)
+        except Exception as e:
+            self._pending.pop(request_id, None)
+            raise ConnectionError("WebSocket send failed", url=self.url, original_error=e)
+        return pending.future
+
+    def query(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        options: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Выполняет запрос и ждёт результат"""
+        future = self.submit(sql, params, options, session_id)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.cancel(future.request_id)
+            raise TimeoutError(self.timeout, operation="websocket query", url=self.url)
+
+    def stream(
+        self,
+        sql: str,
+        params: Optional[list] = None,
+        options: Optional[Dict[str, Any]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Итератор по пачкам строк результата по мере их поступления"""
+        batches: queue.Queue = queue.Queue()
+        future = self.submit(sql, params, options, batch_size=batch_size, on_batch=batches.put)
+        future.add_done_callback(lambda _: batches.put(_END))
+        try:
+            while True:
+                try:
+                    batch = batches.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError(self.timeout, operation="websocket stream", url=self.url)
+                if batch is _END:
+                    break
+                yield batch
+            result = future.result()
+            if not result.get('success'):
+                raise QueryError(result.get('error') or "Query failed", sql=sql)
+        finally:
+            if not future.done():
+                self.cancel(future.request_id)
+
+    def cancel(self, request_id: str) -> bool:
+        """Отменяет запрос по id; возвращает False, если он уже завершён"""
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return False
+        pending.future.cancel()
+        try:
+            self._send({'id': request_id, 'type': 'cancel'})
+        except Exception:
+            pass
+        return True
+
+    def _send(self, message: Dict[str, Any]):
+        with self._send_lock:
+            self._ws.send(json.dumps(message, default=str))
+
+    def _read_loop(self):
+        """Разбирает ответы сервера и раздаёт их ожидающим запросам"""
+        try:
+            while True:
+                frame = self._ws.recv()
+                if not frame:
+                    break
+                self._dispatch(json.loads(frame))
+        except Exception:
+            pass
+        finally:
+            for request_id in list(self._pending):
+                pending = self._pending.pop(request_id, None)
+                if pending is not None:
+                    self._resolve(pending, error=ConnectionError("WebSocket connection closed", url=self.url))
+
+    def _dispatch(self, message: Dict[str, Any]):
+        request_id = message.pop('id', None)
+        kind = message.pop('type', None)
+        if kind == 'batch':
+            pending = self._pending.get(request_id)
+            if pending is None:
+                return
+            if pending.on_batch is not None:
+                pending.on_batch(message['data'])
+            else:
+                pending.rows.extend(message['data'])
+            return
+
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            return
+        if kind == 'result':
+            if pending.on_batch is None and message.get('data') is None and pending.rows:
+                message['data'] = pending.rows
+            self._resolve(pending, result=message)
+        elif kind == 'cancelled':
+            pending.future.cancel()
+        elif kind == 'error':
+            error = message.get('error') or "Query failed"
+            if message.get('status') == 429:
+                self._resolve(pending, error=ResourceError(
+                    error,
+                    resource_type=message.get('resource', "queries_in_flight"),
+                    retry_after=message.get('retry_after'),
+                ))
+            else:
+                self._resolve(pending, error=QueryError(error))
+
+    @staticmethod
+    def _resolve(pending: _Pending, result: Any = None, error: Optional[Exception] = None):
+        try:
+            if error is not None:
+                pending.future.set_exception(error)
+            else:
+                pending.future.set_result(result)
+        except InvalidStateError:
+            # Запрос уже отменён на стороне клиента
+            pass
+
+    def close(self):
+        """Закрывает соединение; незавершённые запросы получают ConnectionError"""
+        try:
+            self._ws.close()
+        finally:
+            self._reader.join(timeout=1.0)
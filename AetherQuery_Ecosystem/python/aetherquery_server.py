@@ -1,18 +1,72 @@
 """
-Простой тестовый сервер AetherQuery для проверки подключения
+Тестовый сервер AetherQuery: приложение FastAPI, эндпоинты и запуск
 Запуск: python aetherquery_server.py
+
+Источники данных, кэш, лимиты, фоновые задания и диагностика живут в
+пакете aetherquery.server; здесь они собираются в ServerState.
 """
 
 import asyncio
-import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, Dict, Any, Optional, List
+import hmac
+import json
 import logging
+import os
+import re
 import sys
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from concurrent.futures import Future
 from datetime import datetime
 
+# Компоненты сервера импортируются и отсюда (from aetherquery_server import SQLiteBackend):
+# на этот модуль опираются тесты и внешние бэкенды
+from aetherquery.server.models import (
+    DatasourceConfig,
+    ExplainRequest,
+    ExplainResponse,
+    ExportRequest,
+    FederatedQueryRequest,
+    FederatedSource,
+    HealthResponse,
+    ImportRequest,
+    PlanNode,
+    QueryRequest,
+    QueryResponse,
+    ScanRequest,
+    ServerInfo,
+    SessionRequest,
+    TenantQuotaConfig,
+    WorkloadClassConfig,
+    WriteBehindRule,
+)
+from aetherquery.server.timings import RequestTimings, current_timings, timed
+from aetherquery.server.sql import classify_statement, extract_tables, query_fingerprint
+from aetherquery.server.backends import (
+    BACKENDS,
+    BackendError,
+    RedisBackend,
+    SQLiteBackend,
+    SimulatedBackend,
+    create_backend,
+    register_backend,
+)
+from aetherquery.server.cache import MemoryCacheStore, QueryCache, RedisCacheStore, make_etag
+from aetherquery.server.limits import ConcurrencyLimiter, TenantLimits, WorkloadScheduler
+from aetherquery.server.diagnostics import AllocationRouteMiddleware, AllocationTracker, StackSampler
+from aetherquery.server.advisor import IndexAdvisor
+from aetherquery.server.datasource import Datasource
+from aetherquery.server.joins import HashJoin
+from aetherquery.server.sessions import SessionManager
+from aetherquery.server.jobs import Exporter, Importer, JobManager
+from aetherquery.server.shm import SharedResultStore, wants_shared_memory
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -20,13 +74,229 @@ logging.basicConfig(
 )
 logger = logging.getLogger("AetherQueryServer")
 
+def api_key_of(connection: HTTPConnection) -> Optional[str]:
+    """Ключ API из заголовка Authorization: Bearer <ключ>"""
+    scheme, _, token = connection.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
+
+def workload_class(connection: HTTPConnection, query: Optional[str] = None,
+                   default: Optional[str] = None) -> str:
+    """Класс нагрузки запроса по ключу API, заголовку X-Workload-Class и отпечатку запроса"""
+    return server_state.scheduler.classify(
+        api_key_of(connection), connection.headers.get("x-workload-class"), query, default
+    )
+
+def require_debug_token(http_request: Request):
+    """Отладочные эндпоинты доступны только с токеном; без настроенного токена их нет"""
+    token = server_state.debug_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(http_request.headers.get("x-debug-token", "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+# Состояние сервера
+class ServerState:
+    def __init__(self):
+        self.start_time = datetime.now()
+        self.query_count = 0
+        self.is_healthy = True
+        self.datasources: Dict[str, Datasource] = {}
+        self.sessions = SessionManager()
+        self.shared_results = SharedResultStore()
+        self.jobs = JobManager(admission=self.admit_background)
+        self.exporter = Exporter()
+        self.importer = Importer(admission=self.admit_background)
+        self.debug_token = os.environ.get("AETHERQUERY_DEBUG_TOKEN")
+        self.profiler = StackSampler()
+        self.allocations = AllocationTracker()
+        self.scheduler = WorkloadScheduler()
+        self.tenants = TenantLimits()
+        self.configure([DatasourceConfig()])
+
+    @property
+    def uptime(self) -> float:
+        return (datetime.now() - self.start_time).total_seconds()
+
+    def configure(self, configs: List[DatasourceConfig]):
+        """Создает источники данных по конфигурации"""
+        self.datasources = {config.name: Datasource(config) for config in configs}
+
+    def get_datasource(self, name: Optional[str] = None) -> Datasource:
+        datasource = self.datasources.get(name or "default")
+        if datasource is None:
+            raise HTTPException(status_code=404, detail=f"Unknown datasource: {name}")
+        return datasource
+
+    @asynccontextmanager
+    async def admit_background(self, api_key: Optional[str], datasource: str, workload: Optional[str]):
+        """Квота арендатора и слот класса нагрузки для принятой фоновой работы: ждёт, а не получает 429"""
+        async with self.tenants.query(api_key, datasource, queued=True), \
+                self.scheduler.slot(workload, timeout=None):
+            yield
+
+server_state = ServerState()
+
+def client_key(http_request: HTTPConnection) -> Optional[str]:
+    """Идентификатор клиента для read-your-writes"""
+    return (
+        http_request.headers.get("x-client-id")
+        or http_request.headers.get("authorization")
+        or (http_request.client.host if http_request.client else None)
+    )
+
+def load_datasource_configs(path: str) -> List[DatasourceConfig]:
+    """Загружает конфигурацию источников данных из JSON файла"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return [DatasourceConfig(**item) for item in raw.get("datasources", [])]
+
+def load_workload_classes(path: str) -> List[WorkloadClassConfig]:
+    """Загружает классы нагрузки (workload_classes) из того же JSON файла"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return [WorkloadClassConfig(**item) for item in raw.get("workload_classes", [])]
+
+def load_tenant_quotas(path: str) -> List[TenantQuotaConfig]:
+    """Загружает квоты арендаторов (tenants) из того же JSON файла"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return [TenantQuotaConfig(**item) for item in raw.get("tenants", [])]
+
+async def replica_lag_monitor():
+    """Периодически измеряет отставание реплик"""
+    next_probe: Dict[str, float] = {}
+    while True:
+        now = time.monotonic()
+        for datasource in list(server_state.datasources.values()):
+            if datasource.replicas and now >= next_probe.get(datasource.name, 0.0):
+                await datasource.probe_lag()
+                next_probe[datasource.name] = now + datasource.config.lag_probe_interval
+        await asyncio.sleep(0.25)
+
+async def metadata_refresher():
+    """Периодически обновляет кэш метаданных из каталога"""
+    next_refresh: Dict[str, float] = {}
+    while True:
+        now = time.monotonic()
+        for datasource in list(server_state.datasources.values()):
+            due = next_refresh.setdefault(datasource.name, now + datasource.config.metadata_refresh)
+            if now >= due:
+                try:
+                    await datasource.metadata.refresh()
+                except Exception as e:
+                    logger.warning(f"Metadata refresh for {datasource.name} failed: {e}")
+                next_refresh[datasource.name] = now + datasource.config.metadata_refresh
+        await asyncio.sleep(1.0)
+
+async def change_watcher():
+    """Проверяет источники на изменения в обход сервера"""
+    next_poll: Dict[str, float] = {}
+    while True:
+        now = time.monotonic()
+        for datasource in list(server_state.datasources.values()):
+            interval = datasource.config.change_poll_interval
+            if interval > 0 and now >= next_poll.get(datasource.name, 0.0):
+                try:
+                    await datasource.poll_external_changes()
+                except Exception as e:
+                    logger.warning(f"Change poll for {datasource.name} failed: {e}")
+                next_poll[datasource.name] = now + interval
+        await asyncio.sleep(0.25)
+
+async def cache_prewarmer():
+    """Прогревает кэш частыми запросами до истечения TTL и сохраняет их для следующего запуска"""
+    next_save: Dict[str, float] = {}
+    while True:
+        now = time.monotonic()
+        for datasource in list(server_state.datasources.values()):
+            config = datasource.config
+            if datasource.cache is None or config.prewarm_top <= 0:
+                continue
+            try:
+                await datasource.prewarm()
+                if config.prewarm_state and now >= next_save.get(datasource.name, now):
+                    datasource.query_stats.save(config.prewarm_state, config.prewarm_top)
+                    next_save[datasource.name] = now + 60.0
+            except Exception as e:
+                logger.warning(f"Cache prewarm for {datasource.name} failed: {e}")
+        await asyncio.sleep(1.0)
+
+async def write_behind_flusher():
+    """Сбрасывает буферы отложенной записи по времени"""
+    while True:
+        for datasource in list(server_state.datasources.values()):
+            if datasource.write_behind is not None and datasource.write_behind.due():
+                datasource.write_behind.flush_soon()
+        await asyncio.sleep(0.05)
+
+async def session_reaper():
+    """Откатывает простаивающие транзакции"""
+    while True:
+        await server_state.sessions.expire_idle()
+        await asyncio.sleep(1.0)
+
+async def shared_result_reaper():
+    """Удаляет непрочитанные сегменты разделяемой памяти"""
+    while True:
+        server_state.shared_results.expire()
+        await asyncio.sleep(1.0)
+
+async def job_reaper():
+    """Удаляет результаты фоновых заданий и записи о загрузках по TTL"""
+    while True:
+        server_state.jobs.expire()
+        server_state.importer.expire()
+        await asyncio.sleep(1.0)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Фоновые задачи живут, пока работает приложение; при остановке состояние сохраняется"""
+    for datasource in server_state.datasources.values():
+        if datasource.config.prewarm_state and datasource.cache is not None:
+            try:
+                loaded = datasource.query_stats.load(datasource.config.prewarm_state)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Prewarm state of {datasource.name} is unreadable: {e}")
+                continue
+            logger.info(f"Loaded {loaded} queries to prewarm {datasource.name}")
+    background_tasks = [
+        asyncio.create_task(cache_prewarmer()),
+        asyncio.create_task(write_behind_flusher()),
+        asyncio.create_task(replica_lag_monitor()),
+        asyncio.create_task(metadata_refresher()),
+        asyncio.create_task(session_reaper()),
+        asyncio.create_task(shared_result_reaper()),
+        asyncio.create_task(job_reaper()),
+        asyncio.create_task(change_watcher()),
+    ]
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await server_state.sessions.close_all()
+        server_state.shared_results.expire(force=True)
+        await server_state.jobs.close_all()
+        server_state.exporter.close()
+        server_state.importer.close()
+        for datasource in server_state.datasources.values():
+            if datasource.config.prewarm_state and datasource.config.prewarm_top > 0:
+                try:
+                    datasource.query_stats.save(datasource.config.prewarm_state, datasource.config.prewarm_top)
+                except OSError as e:
+                    logger.warning(f"Saving prewarm state of {datasource.name} failed: {e}")
+            await datasource.close()
+
 # Создаем приложение FastAPI
 app = FastAPI(
     title="AetherQuery Test Server",
     description="Тестовый сервер для проверки подключения клиента",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # Добавляем CORS middleware
@@ -37,45 +307,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Модели данных
-class HealthResponse(BaseModel):
-    status: str
-    timestamp: str
-    version: str
-    uptime: float
-
-class QueryRequest(BaseModel):
-    query: str
-    parameters: Optional[Dict[str, Any]] = None
-    timeout: Optional[int] = 30
-
-class QueryResponse(BaseModel):
-    success: bool
-    data: Optional[List[Dict[str, Any]]] = None
-    error: Optional[str] = None
-    execution_time: float
-    query: str
-
-class ServerInfo(BaseModel):
-    name: str
-    version: str
-    description: str
-    endpoints: List[str]
-    started_at: str
-
-# Состояние сервера
-class ServerState:
-    def __init__(self):
-        self.start_time = datetime.now()
-        self.query_count = 0
-        self.is_healthy = True
-    
-    @property
-    def uptime(self) -> float:
-        return (datetime.now() - self.start_time).total_seconds()
-
-server_state = ServerState()
+app.add_middleware(AllocationRouteMiddleware, tracker=server_state.allocations)
 
 # Эндпоинты
 @app.get("/")
@@ -107,11 +339,30 @@ async def server_info():
         "GET /health",
         "GET /info",
         "POST /query",
+        "WS /ws",
+        "POST /scan",
+        "POST /federated",
+        "POST /session",
+        "POST /session/{id}/commit",
+        "POST /session/{id}/rollback",
+        "POST /jobs",
+        "GET /jobs/{id}",
+        "GET /jobs/{id}/result",
+        "DELETE /jobs/{id}",
+        "POST /export",
+        "POST /import",
+        "GET /import/{id}",
         "GET /stats",
         "POST /execute",
         "GET /tables",
+        "GET /changes",
+        "POST /explain",
+        "GET /slow-queries",
+        "GET /advisor/indexes",
         "GET /table/{table_name}"
     ]
+    if server_state.debug_token:
+        endpoints += ["GET /debug/profile", "GET /debug/allocations"]
     
     return ServerInfo(
         name="AetherQuery Test Server",
@@ -121,57 +372,546 @@ async def server_info():
         started_at=server_state.start_time.isoformat()
     )
 
-@app.post("/query", response_model=QueryResponse)
-async def execute_query(request: QueryRequest):
-    """Выполнение SQL запроса"""
-    import time
-    start_time = time.time()
+async def run_query(request: QueryRequest, key: Optional[str], session_id: Optional[str] = None,
+                    workload: Optional[str] = None, api_key: Optional[str] = None) -> QueryResponse:
+    """Выполняет запрос (общая часть /query и /ws); фазы пишутся в current_timings"""
+    if current_timings.get() is None:
+        current_timings.set(RequestTimings())
+    start_time = time.perf_counter()
     server_state.query_count += 1
     
     logger.info(f"Executing query: {request.query}")
     
-    # Имитация выполнения запроса
-    await asyncio.sleep(0.1)
+    options = request.options or {}
+    datasource = server_state.get_datasource(options.get("datasource"))
+    params = request.params if request.params is not None else request.parameters
     
-    # Примеры ответов для разных запросов
-    query_lower = request.query.lower().strip()
-    
-    if "select" in query_lower and "users" in query_lower:
-        data = [
-            {"id": 1, "name": "Alice", "email": "alice@example.com", "created_at": "2024-01-01"},
-            {"id": 2, "name": "Bob", "email": "bob@example.com", "created_at": "2024-01-02"},
-            {"id": 3, "name": "Charlie", "email": "charlie@example.com", "created_at": "2024-01-03"}
-        ]
-        success = True
-        error = None
-    elif "select" in query_lower and "products" in query_lower:
-        data = [
-            {"id": 1, "name": "Product A", "price": 100, "stock": 50},
-            {"id": 2, "name": "Product B", "price": 200, "stock": 30},
-            {"id": 3, "name": "Product C", "price": 150, "stock": 20}
-        ]
+    node = None
+    try:
+        scan_table = parallel_scan_table(request.query) if options.get("parallel_scan") else None
+        if session_id:
+            # Транзакция уже держит соединение: её запросы не ждут в очереди класса
+            session = server_state.sessions.get(session_id)
+            async with server_state.tenants.query(api_key, session.datasource.name, connection=False) as tenant:
+                data = await session.execute(request.query, params)
+            node = session.datasource.primary
+        else:
+            async with server_state.tenants.query(api_key, datasource.name) as tenant, \
+                    server_state.scheduler.slot(workload or server_state.scheduler.default_class):
+                if scan_table:
+                    scan = datasource.scan(scan_table, key, partitions=int(options["parallel_scan"]))
+                    node = scan.node
+                    data = await scan.fetch_all()
+                else:
+                    data, node = await datasource.execute(request.query, params, options, key)
+        tenant.rows += len(data)
         success = True
         error = None
-    elif "error" in query_lower:
+    except BackendError as e:
         data = None
         success = False
-        error = "Simulated query error: Syntax error near 'ERROR'"
-    else:
-        # Общий ответ
-        data = [
-            {"result": "success", "rows_affected": 1, "message": "Query executed successfully"}
-        ]
-        success = True
-        error = None
+        error = str(e)
     
-    execution_time = time.time() - start_time
+    execution_time = time.perf_counter() - start_time
     
     return QueryResponse(
         success=success,
         data=data,
         error=error,
         execution_time=execution_time,
-        query=request.query
+        query=request.query,
+        node=node.name if node else None,
+        cached=success and node is None,
+        timings=current_timings.get().snapshot() if options.get("timings") else None
+    )
+
+@app.post("/query", response_model=QueryResponse)
+async def execute_query(request: QueryRequest, http_request: Request):
+    """Выполнение SQL запроса; фазы выполнения - в заголовке Server-Timing"""
+    timings = RequestTimings()
+    current_timings.set(timings)
+    response = await run_query(
+        request, client_key(http_request), http_request.headers.get("x-session-id"),
+        workload_class(http_request, request.query), api_key_of(http_request),
+    )
+    with timed("serialize"):
+        body = response.model_dump_json().encode()
+    if wants_shared_memory(http_request) and len(body) >= server_state.shared_results.threshold:
+        return JSONResponse(
+            {"shared_memory": server_state.shared_results.put(body)},
+            headers={"Server-Timing": timings.header()},
+        )
+    return Response(body, media_type="application/json", headers={"Server-Timing": timings.header()})
+
+# Мультиплексированный канал запросов поверх WebSocket
+class QueryChannel:
+    """
+    Несколько запросов одновременно через один WebSocket
+
+    Кадры - JSON-сообщения с полем id: запросы выполняются параллельно,
+    результаты возвращаются в порядке готовности и отменяются по id.
+    """
+
+    def __init__(self, websocket: WebSocket, max_in_flight: int = 64):
+        self.websocket = websocket
+        self.key = client_key(websocket)
+        self.max_in_flight = max_in_flight
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: Dict[str, Any]):
+        async with self._send_lock:
+            await self.websocket.send_text(json.dumps(message, default=str))
+
+    async def serve(self):
+        try:
+            while True:
+                try:
+                    message = json.loads(await self.websocket.receive_text())
+                except ValueError:
+                    await self.send({"id": None, "type": "error", "status": 400, "error": "Malformed frame"})
+                    continue
+                await self.dispatch(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in list(self.tasks.values()):
+                task.cancel()
+
+    async def dispatch(self, message: Dict[str, Any]):
+        request_id = message.get("id")
+        kind = message.get("type", "query")
+        if kind == "ping":
+            await self.send({"id": request_id, "type": "pong"})
+            return
+        if request_id is None:
+            await self.send({"id": None, "type": "error", "status": 400, "error": "Frame without id"})
+            return
+        request_id = str(request_id)
+        if kind == "cancel":
+            task = self.tasks.get(request_id)
+            if task is not None:
+                task.cancel()
+            return
+        if kind != "query":
+            await self.send({"id": request_id, "type": "error", "status": 400, "error": f"Unknown frame type: {kind}"})
+            return
+        if request_id in self.tasks:
+            await self.send({"id": request_id, "type": "error", "status": 400, "error": "Duplicate request id"})
+            return
+        if len(self.tasks) >= self.max_in_flight:
+            await self.send({"id": request_id, "type": "error", "status": 429, "error": "Too many queries in flight"})
+            return
+        try:
+            request = QueryRequest(**{k: v for k, v in message.items() if k in QueryRequest.model_fields})
+        except ValueError as e:
+            await self.send({"id": request_id, "type": "error", "status": 422, "error": str(e)})
+            return
+        self.tasks[request_id] = asyncio.create_task(
+            self.run(request_id, request, message.get("session_id"), message.get("batch_size"))
+        )
+
+    async def run(self, request_id: str, request: QueryRequest,
+                  session_id: Optional[str], batch_size: Optional[int]):
+        try:
+            table = parallel_scan_table(request.query)
+            if batch_size and not session_id and (table or is_scan_command(request.query)):
+                await self.stream(request_id, request, table, int(batch_size))
+                return
+            response = (await run_query(
+                request, self.key, session_id, workload_class(self.websocket, request.query),
+                api_key_of(self.websocket),
+            )).model_dump()
+            data = response.pop("data")
+            if batch_size and data:
+                # Большой результат уходит частями, не блокируя ответы на другие запросы
+                for start in range(0, len(data), int(batch_size)):
+                    await self.send({"id": request_id, "type": "batch", "data": data[start:start + int(batch_size)]})
+                data = None
+            await self.send({"id": request_id, "type": "result", **response, "data": data})
+        except asyncio.CancelledError:
+            await self.send_quietly({"id": request_id, "type": "cancelled"})
+        except HTTPException as e:
+            error = {"id": request_id, "type": "error", "status": e.status_code, "error": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+                error["resource"] = e.headers.get("X-Quota-Exceeded", "queries_in_flight")
+            await self.send_quietly(error)
+        finally:
+            self.tasks.pop(request_id, None)
+
+    async def stream(self, request_id: str, request: QueryRequest, table: Optional[str], batch_size: int):
+        """Потоковое чтение пачками прямо с узла: SELECT * FROM table или курсор SCAN источника Redis"""
+        start_time = time.time()
+        server_state.query_count += 1
+        datasource = server_state.get_datasource((request.options or {}).get("datasource"))
+        if table:
+            batches = datasource.select_batches(table, client_key=self.key, batch_size=batch_size)
+        else:
+            params = request.params if request.params is not None else request.parameters
+            batches = datasource.query_batches(request.query, params, self.key, batch_size)
+        rows = 0
+        try:
+            async with server_state.tenants.query(api_key_of(self.websocket), datasource.name) as tenant, \
+                    server_state.scheduler.slot(workload_class(self.websocket, request.query)):
+                async for batch in batches:
+                    rows += len(batch)
+                    tenant.rows += len(batch)
+                    await self.send({"id": request_id, "type": "batch", "data": batch})
+        except BackendError as e:
+            await self.send({"id": request_id, "type": "result", "success": False, "error": str(e),
+                             "query": request.query, "execution_time": time.time() - start_time})
+            return
+        await self.send({"id": request_id, "type": "result", "success": True, "error": None, "data": None, "rows": rows,
+                         "query": request.query, "execution_time": time.time() - start_time})
+
+    async def send_quietly(self, message: Dict[str, Any]):
+        try:
+            await self.send(message)
+        except Exception:
+            # Сокет уже закрыт - сообщать некому
+            pass
+
+@app.websocket("/ws")
+async def query_channel(websocket: WebSocket):
+    """Мультиплексированный канал запросов"""
+    await websocket.accept()
+    await QueryChannel(websocket).serve()
+
+@app.post("/session")
+async def open_session(http_request: Request, request: Optional[SessionRequest] = None):
+    """Открывает транзакцию; запросы с заголовком X-Session-Id выполняются внутри неё"""
+    datasource = server_state.get_datasource(request.datasource if request else None)
+    try:
+        # Транзакция держит соединение всё время жизни: оно входит в квоту арендатора
+        tenant = server_state.tenants.open_connection(api_key_of(http_request), datasource.name)
+        session = await server_state.sessions.open(datasource, client_key(http_request), tenant)
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "session_id": session.id,
+        "datasource": datasource.name,
+        "idle_timeout": datasource.config.session_idle_timeout,
+    }
+
+@app.get("/session/{session_id}")
+async def session_status(session_id: str):
+    """Состояние транзакции"""
+    session = server_state.sessions.get(session_id)
+    return {
+        "session_id": session.id,
+        "datasource": session.datasource.name,
+        "queries": session.queries,
+        "idle": session.idle,
+        "age": time.monotonic() - session.created_at,
+    }
+
+@app.post("/session/{session_id}/commit")
+async def commit_session(session_id: str):
+    """Фиксирует транзакцию и освобождает соединение"""
+    try:
+        session = await server_state.sessions.finish(session_id, commit=True)
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "status": "committed", "queries": session.queries}
+
+@app.post("/session/{session_id}/rollback")
+async def rollback_session(session_id: str):
+    """Откатывает транзакцию и освобождает соединение"""
+    try:
+        session = await server_state.sessions.finish(session_id, commit=False)
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session_id, "status": "rolled_back", "queries": session.queries}
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: QueryRequest, http_request: Request):
+    """Ставит долгий запрос в очередь; результат забирается через /jobs/{id}/result"""
+    datasource = server_state.get_datasource((request.options or {}).get("datasource"))
+    server_state.tenants.check_rate(api_key_of(http_request))
+    job = server_state.jobs.submit(
+        datasource, request, client_key(http_request),
+        workload_class(http_request, request.query, default="background"), api_key_of(http_request),
+    )
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "result_url": f"/jobs/{job.id}/result",
+    }
+
+@app.get("/jobs")
+async def list_jobs():
+    """Список фоновых заданий"""
+    return {"jobs": [job.info() for job in server_state.jobs.jobs.values()]}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Состояние фонового задания"""
+    return server_state.jobs.get(job_id).info()
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Результат задания в NDJSON; поддерживает Range для докачки"""
+    job = server_state.jobs.get(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}", headers={"Retry-After": "1"})
+    return FileResponse(job.path, media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Отменяет задание и удаляет его результат"""
+    job = await server_state.jobs.cancel(job_id)
+    return {"job_id": job.id, "status": job.status}
+
+@app.post("/export")
+async def export_query(request: ExportRequest, http_request: Request):
+    """Выгрузка результата запроса в CSV/Parquet файлы в каталоге экспорта сервера"""
+    datasource = server_state.get_datasource(request.datasource)
+    try:
+        async with server_state.tenants.query(api_key_of(http_request), datasource.name), \
+                server_state.scheduler.slot(workload_class(http_request, request.query, default="background")):
+            return await server_state.exporter.export(datasource, request, client_key(http_request))
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/import", status_code=202)
+async def import_file(request: ImportRequest, http_request: Request):
+    """Загрузка CSV/Parquet файла из каталога импорта в таблицу; прогресс - GET /import/{id}"""
+    datasource = server_state.get_datasource(request.datasource)
+    server_state.tenants.check_rate(api_key_of(http_request))
+    task = server_state.importer.start(
+        datasource, request, client_key(http_request), api_key_of(http_request),
+        workload_class(http_request, default="background"),
+    )
+    return {"import_id": task.id, "status": task.status, "status_url": f"/import/{task.id}"}
+
+@app.get("/import/{import_id}")
+async def import_status(import_id: str):
+    """Прогресс и скорость загрузки"""
+    return server_state.importer.get(import_id).info()
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """Кадр Server-Sent Events"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.insert(0, f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/changes")
+async def change_stream(http_request: Request, datasource: Optional[str] = None,
+                        tables: Optional[str] = None, query: Optional[str] = None,
+                        heartbeat: float = 15.0):
+    """
+    Поток изменений (Server-Sent Events)
+
+    tables - фильтр через запятую; query - живой запрос: пересчитывается при
+    изменении его таблиц, новый результат приходит событием result.
+    """
+    source = server_state.get_datasource(datasource)
+    watched = [t.strip() for t in tables.split(",") if t.strip()] if tables else None
+    if query:
+        if classify_statement(query) != "read":
+            raise HTTPException(status_code=400, detail="Live queries must be read-only")
+        watched = extract_tables(query) or None
+        server_state.tenants.check_rate(api_key_of(http_request))
+    last_event_id = http_request.headers.get("last-event-id")
+    try:
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after = None
+    subscription = source.changes.subscribe(watched, after)
+    if last_event_id and after is None:
+        # Точка возобновления не разобрана: клиент получит reset и перечитает данные
+        subscription.overflowed = True
+    key = client_key(http_request)
+    api_key = api_key_of(http_request)
+    workload = workload_class(http_request, query, default="background") if query else None
+
+    async def evaluate():
+        # Пересчёт идёт по квоте арендатора и классу нагрузки, но не отклоняется: подписка уже принята
+        async with server_state.admit_background(api_key, source.name, workload):
+            data, _ = await source.execute(query, None, None, key)
+        return data
+
+    async def events():
+        previous = None
+        try:
+            if query:
+                data = await evaluate()
+                previous = make_etag(data)
+                yield sse_event("result", {"data": data}, source.changes.seq)
+            while True:
+                if subscription.overflowed:
+                    # Пропущены события - клиент должен перечитать данные
+                    yield sse_event("reset", {"seq": source.changes.seq})
+                    return
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if not query:
+                    yield sse_event("change", event, event["seq"])
+                    continue
+                data = await evaluate()
+                etag = make_etag(data)
+                if etag != previous:
+                    previous = etag
+                    yield sse_event("result", {"data": data, "change": event}, event["seq"])
+        except BackendError as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            source.changes.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def streaming_under(stack: AsyncExitStack, chunks: AsyncIterator[str], **kwargs) -> StreamingResponse:
+    """Потоковый ответ, который держит квоты и слоты из stack до конца передачи"""
+    async def body():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await stack.aclose()
+
+    # Фоновая задача освобождает их, даже если передача так и не началась
+    return StreamingResponse(body(), background=BackgroundTask(stack.aclose), **kwargs)
+
+SELECT_ALL = re.compile(r"^\s*select\s+\*\s+from\s+([A-Za-z_][A-Za-z0-9_]*)\s*;?\s*$", re.IGNORECASE)
+
+def is_scan_command(query: str) -> bool:
+    """Команда обхода Redis (SCAN, HSCAN, SSCAN, ZSCAN, KEYS): результат лучше читать потоком"""
+    words = query.split(None, 1)
+    return bool(words) and words[0].lower() in RedisBackend.SCAN_COMMANDS
+
+def parallel_scan_table(query: str) -> Optional[str]:
+    """Имя таблицы, если запрос - полное чтение вида SELECT * FROM table"""
+    match = SELECT_ALL.match(query)
+    return match.group(1) if match else None
+
+@app.post("/scan")
+async def scan_table(request: ScanRequest, http_request: Request):
+    """Параллельное чтение таблицы диапазонами ключа"""
+    start_time = time.time()
+    datasource = server_state.get_datasource(request.datasource)
+    async with AsyncExitStack() as stack:
+        await stack.enter_async_context(server_state.tenants.query(api_key_of(http_request), datasource.name))
+        await stack.enter_async_context(server_state.scheduler.slot(
+            workload_class(http_request, f"SELECT * FROM {request.table}", default="background")
+        ))
+        try:
+            scan = datasource.scan(
+                request.table,
+                client_key(http_request),
+                partitions=request.partitions,
+                columns=request.columns,
+                order_by=request.order_by,
+                batch_size=request.batch_size,
+            )
+        except BackendError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if request.stream:
+            async def ndjson():
+                try:
+                    async for batch in scan.batches():
+                        yield "".join(json.dumps(row, default=str) + "\n" for row in batch)
+                except BackendError as e:
+                    yield json.dumps({"error": str(e)}) + "\n"
+
+            return streaming_under(stack.pop_all(), ndjson(), media_type="application/x-ndjson")
+
+        try:
+            data = await scan.fetch_all()
+        except BackendError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return QueryResponse(
+        success=True,
+        data=data,
+        execution_time=time.time() - start_time,
+        query=f"SELECT * FROM {request.table}",
+        node=scan.node.name
+    )
+
+def federated_columns(source: FederatedSource, keys: List[str]) -> Optional[List[str]]:
+    """Проекция источника с обязательными ключами соединения"""
+    if not source.columns:
+        return None
+    return source.columns + [key for key in keys if key not in source.columns]
+
+@app.post("/federated")
+async def federated_query(request: FederatedQueryRequest, http_request: Request):
+    """Соединение таблиц из разных источников данных"""
+    start_time = time.time()
+    left_keys = list(request.on.keys())
+    right_keys = list(request.on.values())
+    key = client_key(http_request)
+
+    left_source = server_state.get_datasource(request.left.datasource)
+    right_source = server_state.get_datasource(request.right.datasource)
+    try:
+        join = HashJoin(
+            left_keys, right_keys, how=request.how,
+            right_alias=request.right.alias or request.right.table,
+            memory_rows=request.memory_rows,
+        )
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def joined_rows():
+        left = left_source.select_batches(
+            request.left.table, federated_columns(request.left, left_keys), request.left.filters, key
+        )
+        right = right_source.select_batches(
+            request.right.table, federated_columns(request.right, right_keys), request.right.filters, key
+        )
+        remaining = request.limit
+        async for batch in join.run(left, right):
+            if remaining is not None:
+                batch = batch[:remaining]
+                remaining -= len(batch)
+            yield batch
+            if remaining == 0:
+                break
+
+    description = (
+        f"{request.left.datasource}.{request.left.table} {request.how.upper()} JOIN "
+        f"{request.right.datasource}.{request.right.table}"
+    )
+
+    async with AsyncExitStack() as stack:
+        # Одно соединение арендатора в каждом из источников соединения
+        await stack.enter_async_context(server_state.tenants.query(
+            api_key_of(http_request), [left_source.name, right_source.name]
+        ))
+        await stack.enter_async_context(server_state.scheduler.slot(workload_class(http_request, default="background")))
+        if request.stream:
+            async def ndjson():
+                try:
+                    async for batch in joined_rows():
+                        yield "".join(json.dumps(row, default=str) + "\n" for row in batch)
+                except BackendError as e:
+                    yield json.dumps({"error": str(e)}) + "\n"
+
+            return streaming_under(stack.pop_all(), ndjson(), media_type="application/x-ndjson")
+
+        data: List[Dict[str, Any]] = []
+        try:
+            async for batch in joined_rows():
+                data.extend(batch)
+        except BackendError as e:
+            return QueryResponse(
+                success=False, error=str(e), execution_time=time.time() - start_time, query=description
+            )
+    return QueryResponse(
+        success=True, data=data, execution_time=time.time() - start_time, query=description
     )
 
 @app.get("/stats")
@@ -182,9 +922,113 @@ async def get_stats():
         "query_count": server_state.query_count,
         "status": "running",
         "memory_usage": "simulated",
-        "active_connections": 1
+        "active_connections": 1,
+        "datasources": {
+            name: datasource.stats() for name, datasource in server_state.datasources.items()
+        },
+        "sessions": server_state.sessions.stats(),
+        "changes": {name: ds.changes.stats() for name, ds in server_state.datasources.items()},
+        "shared_memory": server_state.shared_results.stats(),
+        "jobs": server_state.jobs.stats(),
+        "exports": server_state.exporter.stats(),
+        "imports": server_state.importer.stats(),
+        "workloads": server_state.scheduler.stats(),
+        "tenants": server_state.tenants.stats(),
+        "debug": {
+            "profiler": server_state.profiler.stats(),
+            "allocations": server_state.allocations.stats(),
+        }
+    }
+
+@app.get("/debug/profile")
+async def debug_profile(http_request: Request, seconds: float = 5.0, interval: float = 0.005):
+    """Сэмплирование стеков потоков; ответ - свёрнутые стеки для flame graph"""
+    require_debug_token(http_request)
+    loop = asyncio.get_running_loop()
+    # Отдельный поток, а не пул: профайлер не должен занимать слот исполнителя запросов
+    future: Future = Future()
+
+    def sample():
+        try:
+            future.set_result(server_state.profiler.sample(seconds, interval))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=sample, name="aetherquery-profiler", daemon=True).start()
+    try:
+        stacks = await asyncio.wrap_future(future, loop=loop)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(StackSampler.collapsed(stacks), media_type="text/plain")
+
+@app.get("/debug/allocations")
+async def debug_allocations(http_request: Request, seconds: float = 10.0, limit: int = 25, frames: int = 1):
+    """Diff снимков tracemalloc за окно в seconds секунд с разбивкой по маршрутам"""
+    require_debug_token(http_request)
+    try:
+        return await server_state.allocations.capture(seconds, limit, frames)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/explain", response_model=ExplainResponse)
+async def explain_query(request: ExplainRequest, http_request: Request):
+    """Нормализованный план выполнения запроса"""
+    datasource = server_state.get_datasource(request.datasource)
+    try:
+        # EXPLAIN ANALYZE выполняет запрос целиком - это фоновая работа, если класс не задан явно
+        workload = workload_class(http_request, request.query, default="background" if request.analyze else None)
+        async with server_state.tenants.query(api_key_of(http_request), datasource.name), \
+                server_state.scheduler.slot(workload):
+            result, node = await datasource.explain(
+                request.query, request.params, request.analyze, client_key(http_request)
+            )
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ExplainResponse(
+        query=request.query,
+        node=node.name,
+        plan=PlanNode(**result["plan"]),
+        analyzed=request.analyze,
+        execution_time=result["execution_time"],
+        raw=result["raw"],
+    )
+
+@app.get("/slow-queries")
+async def slow_queries(datasource: Optional[str] = None, limit: int = 50):
+    """Журнал медленных запросов с планами (включается slow_query_ms источника)"""
+    source = server_state.get_datasource(datasource)
+    return {
+        "datasource": source.name,
+        **source.slow_queries.stats(),
+        "queries": source.slow_queries.report(limit),
     }
 
+@app.get("/advisor/indexes")
+async def index_advice(http_request: Request, datasource: Optional[str] = None, validate: bool = True,
+                       limit: int = 20):
+    """Кандидаты в индексы по журналу медленных запросов с DDL"""
+    source = server_state.get_datasource(datasource)
+    if not source.slow_queries.enabled:
+        raise HTTPException(status_code=409, detail="Slow query log is disabled: set slow_query_ms")
+    try:
+        async with server_state.tenants.query(api_key_of(http_request), source.name), \
+                server_state.scheduler.slot(workload_class(http_request, default="background")):
+            return await IndexAdvisor(source).advise(validate, limit)
+    except BackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/write-behind/flush")
+async def flush_write_behind(datasource: Optional[str] = None):
+    """Немедленно сбрасывает буфер отложенной записи (например, перед согласованным чтением)"""
+    source = server_state.get_datasource(datasource)
+    if source.write_behind is None:
+        raise HTTPException(status_code=409, detail=f"Write-behind is not configured for {source.name!r}")
+    flushed = await source.write_behind.flush()
+    stats = source.write_behind.stats()
+    if stats["pending"] and not flushed:
+        raise HTTPException(status_code=503, detail=f"Write-behind flush failed: {stats['last_error']}")
+    return {"datasource": source.name, "flushed": flushed, **stats}
+
 @app.post("/execute")
 async def execute_raw(request: Dict[str, Any]):
     """Выполнение сырого запроса"""
@@ -196,31 +1040,26 @@ async def execute_raw(request: Dict[str, Any]):
         "timestamp": datetime.now().isoformat()
     }
 
+def metadata_response(http_request: Request, payload: Dict[str, Any], etag: str):
+    """Ответ с ETag; 304 если клиент уже имеет актуальную версию"""
+    if etag in [tag.strip() for tag in http_request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(payload, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
 @app.get("/tables")
-async def list_tables():
+async def list_tables(http_request: Request, datasource: Optional[str] = None):
     """Список таблиц"""
-    return {
-        "tables": [
-            {"name": "users", "type": "table", "rows": 100},
-            {"name": "products", "type": "table", "rows": 50},
-            {"name": "orders", "type": "table", "rows": 200},
-            {"name": "customers", "type": "table", "rows": 150}
-        ]
-    }
+    payload, etag = await server_state.get_datasource(datasource).metadata.tables()
+    return metadata_response(http_request, payload, etag)
 
 @app.get("/table/{table_name}")
-async def table_info(table_name: str):
+async def table_info(table_name: str, http_request: Request, datasource: Optional[str] = None):
     """Информация о таблице"""
-    return {
-        "name": table_name,
-        "columns": [
-            {"name": "id", "type": "integer", "nullable": False},
-            {"name": "name", "type": "varchar(255)", "nullable": True},
-            {"name": "created_at", "type": "timestamp", "nullable": True}
-        ],
-        "estimated_rows": 100,
-        "size_mb": 10.5
-    }
+    try:
+        payload, etag = await server_state.get_datasource(datasource).metadata.table(table_name)
+    except BackendError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return metadata_response(http_request, payload, etag)
 
 # Простой HTTP сервер (альтернатива для тестирования)
 class SimpleTestServer:
@@ -280,12 +1119,21 @@ class SimpleTestServer:
         async with server:
             await server.serve_forever()
 
-def run_fastapi_server(host="0.0.0.0", port=8000, reload=False):
+def run_fastapi_server(host="0.0.0.0", port=8000, reload=False, uds=None):
     """Запуск FastAPI сервера"""
+    import uvicorn
+    
     logger.info(f"🚀 Starting AetherQuery Test Server on {host}:{port}")
     logger.info(f"📚 Documentation: http://{host}:{port}/docs")
     logger.info(f"🔧 Health check: http://{host}:{port}/health")
     
+    if uds:
+        logger.info(f"🔌 Unix socket: {uds}")
+        if reload:
+            logger.warning("Auto-reload is not supported together with --uds")
+        asyncio.run(serve_tcp_and_unix(host, port, uds))
+        return
+    
     uvicorn.run(
         app,
         host=host,
@@ -294,6 +1142,21 @@ def run_fastapi_server(host="0.0.0.0", port=8000, reload=False):
         log_level="info"
     )
 
+async def serve_tcp_and_unix(host: str, port: int, uds: str):
+    """TCP и Unix socket слушатели одного приложения в одном цикле событий"""
+    import uvicorn
+
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="info")),
+        # Фоновые задачи запускает TCP сервер, второй слушатель их не дублирует
+        uvicorn.Server(uvicorn.Config(app, uds=uds, lifespan="off", log_level="info")),
+    ]
+    tasks = [asyncio.create_task(server.serve()) for server in servers]
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for server in servers:
+        server.should_exit = True
+    await asyncio.gather(*tasks)
+
 def run_simple_server(host="0.0.0.0", port=8000):
     """Запуск простого сервера"""
     logger.info(f"Starting simple test server on {host}:{port}")
@@ -307,14 +1170,109 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=8000, help="Port to bind to")
     parser.add_argument("--simple", action="store_true", help="Use simple HTTP server instead of FastAPI")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload (FastAPI only)")
+    parser.add_argument("--config", help="JSON file with datasource configuration")
+    parser.add_argument("--backend", action="append", default=[], metavar="SCHEME=MODULE:CLASS",
+                        help="Register a datasource backend loaded on first use (repeatable)")
+    parser.add_argument("--primary", default="simulated://primary", help="Primary node URL of the default datasource")
+    parser.add_argument("--replica", action="append", default=[], help="Replica node URL (repeatable)")
+    parser.add_argument("--max-replica-lag", type=float, default=5.0, help="Max replica lag in seconds for reads")
+    parser.add_argument("--read-your-writes", type=float, default=0.0, help="Read-your-writes window in seconds")
+    parser.add_argument("--cache", help="Query result cache: redis://host:6379/0 or memory://")
+    parser.add_argument("--cache-ttl", type=float, default=60.0, help="Query cache TTL in seconds")
+    parser.add_argument("--cache-stale-ttl", type=float, default=0.0,
+                        help="Serve expired cache entries this many seconds longer while refreshing them")
+    parser.add_argument("--prewarm-top", type=int, default=0,
+                        help="Keep this many most frequent cached queries warm (0 - off)")
+    parser.add_argument("--prewarm-state", help="File to keep frequent queries in for prewarming after restarts")
+    parser.add_argument("--write-behind-table", action="append", default=[],
+                        help="Buffer INSERT/UPDATE into this table and flush them in batches (repeatable)")
+    parser.add_argument("--write-behind-interval", type=float, default=1.0, help="Flush write-behind buffers every N seconds")
+    parser.add_argument("--write-behind-log", help="Append-only log that keeps buffered writes across crashes")
+    parser.add_argument("--slow-query-ms", type=float, default=0.0,
+                        help="Log queries slower than this with their plans (0 - off)")
+    parser.add_argument("--concurrency-limit", choices=["fixed", "gradient", "aimd"], default="fixed",
+                        help="Adapt per-node in-flight limit and reader pool size to observed latency")
+    parser.add_argument("--min-node-concurrency", type=int, default=1, help="Lower bound of the adaptive limit")
+    parser.add_argument("--max-node-concurrency", type=int, default=64, help="Upper bound of the adaptive limit")
+    parser.add_argument("--max-concurrency", type=int, default=32,
+                        help="Queries executed at once across all workload classes")
+    parser.add_argument("--default-workload", default="interactive",
+                        help="Workload class for requests that match no rule")
+    parser.add_argument("--tenant-rate", type=float, default=0.0,
+                        help="Queries per second allowed per API key (0 - unlimited)")
+    parser.add_argument("--tenant-burst", type=int, help="Token bucket size per API key (default: one second of queries)")
+    parser.add_argument("--tenant-max-queries", type=int, default=0,
+                        help="Queries in flight per API key (0 - unlimited)")
+    parser.add_argument("--tenant-max-connections", type=int, default=0,
+                        help="Connections per API key in each datasource pool (0 - unlimited)")
+    parser.add_argument("--job-dir", help="Directory for background job results (default: temp dir)")
+    parser.add_argument("--max-running-jobs", type=int, default=2, help="Background jobs executed concurrently")
+    parser.add_argument("--job-ttl", type=float, default=3600.0, help="Seconds to keep finished job results")
+    parser.add_argument("--export-dir", help="Directory for /export output (default: temp dir)")
+    parser.add_argument("--export-workers", type=int, help="Processes encoding export files (default: CPU count)")
+    parser.add_argument("--import-dir", help="Directory /import may read files from (import is off without it)")
+    parser.add_argument("--import-workers", type=int, help="Processes parsing import files (default: CPU count)")
+    parser.add_argument("--import-ttl", type=float, default=3600.0, help="Seconds to keep finished import status")
+    parser.add_argument("--uds", help="Also listen on this Unix domain socket path")
+    parser.add_argument("--debug-token", default=os.environ.get("AETHERQUERY_DEBUG_TOKEN"),
+                        help="Enables /debug/profile and /debug/allocations for requests with this X-Debug-Token")
+    parser.add_argument("--shm-threshold", type=int, default=1 << 20,
+                        help="Results of this many bytes or more go to Unix socket clients via shared memory")
     
     args = parser.parse_args()
     
     try:
+        for entry in args.backend:
+            scheme, _, target = entry.partition("=")
+            register_backend(scheme, target)
+        tenant_quotas: List[TenantQuotaConfig] = []
+        if args.config:
+            server_state.configure(load_datasource_configs(args.config))
+            workload_classes = load_workload_classes(args.config)
+            if workload_classes:
+                server_state.scheduler.configure(workload_classes, args.default_workload)
+            tenant_quotas = load_tenant_quotas(args.config)
+        else:
+            server_state.configure([DatasourceConfig(
+                primary=args.primary,
+                replicas=args.replica,
+                max_replica_lag=args.max_replica_lag,
+                read_your_writes=args.read_your_writes,
+                cache=args.cache,
+                cache_ttl=args.cache_ttl,
+                cache_stale_ttl=args.cache_stale_ttl,
+                prewarm_top=args.prewarm_top,
+                prewarm_state=args.prewarm_state,
+                write_behind=[WriteBehindRule(table=table) for table in args.write_behind_table],
+                write_behind_interval=args.write_behind_interval,
+                write_behind_log=args.write_behind_log,
+                slow_query_ms=args.slow_query_ms,
+                concurrency_limit=args.concurrency_limit,
+                min_concurrency=args.min_node_concurrency,
+                max_concurrency=args.max_node_concurrency,
+            )])
+        if not any(quota.api_key == "*" for quota in tenant_quotas):
+            tenant_quotas.append(TenantQuotaConfig(
+                rate=args.tenant_rate,
+                burst=args.tenant_burst,
+                max_concurrent_queries=args.tenant_max_queries,
+                max_connections=args.tenant_max_connections,
+            ))
+        server_state.tenants.configure(tenant_quotas)
+        
+        server_state.shared_results.threshold = args.shm_threshold
+        server_state.scheduler.max_concurrency = args.max_concurrency
+        server_state.debug_token = args.debug_token
+        server_state.jobs = JobManager(args.job_dir, max_running=args.max_running_jobs, ttl=args.job_ttl,
+                                       admission=server_state.admit_background)
+        server_state.exporter = Exporter(args.export_dir, args.export_workers)
+        server_state.importer = Importer(args.import_dir, args.import_workers, args.import_ttl,
+                                         admission=server_state.admit_background)
+        
         if args.simple:
             run_simple_server(args.host, args.port)
         else:
-            run_fastapi_server(args.host, args.port, args.reload)
+            run_fastapi_server(args.host, args.port, args.reload, args.uds)
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
@@ -0,0 +1,65 @@
+"""
+Время холодного импорта пакетов AetherQuery
+Запуск: python benchmarks/import_time.py [--runs 5]
+
+Каждый замер - отдельный интерпретатор, поэтому кэш модулей не помогает.
+Выход с кодом 1, если медиана превышает бюджет или при импорте
+загрузились модули, которые должны подгружаться лениво.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, Any, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет холодного старта в мс и модули, которых не должно быть после импорта
+BUDGETS: Dict[str, Dict[str, Any]] = {
+    "aetherquery.client": {"budget_ms": 30.0, "lazy": ["requests", "urllib3", "websocket"]},
+    "aetherquery.cli": {"budget_ms": 80.0, "lazy": ["requests", "rich", "sqlite3"]},
+    "aetherquery_server": {"budget_ms": 1500.0, "lazy": ["uvicorn", "redis", "pyarrow"]},
+}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({{"ms": elapsed, "loaded": [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, lazy: List[str], runs: int = 5) -> Dict[str, Any]:
+    """Медиана времени импорта module в свежем интерпретаторе и загруженные ленивые модули"""
+    timings = []
+    loaded: List[str] = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, lazy=lazy)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        loaded = result["loaded"]
+    return {"module": module, "median_ms": statistics.median(timings), "loaded": loaded}
+
+
+def main(argv: List[str]) -> int:
+    runs = int(argv[argv.index("--runs") + 1]) if "--runs" in argv else 5
+    failed = False
+    for module, spec in BUDGETS.items():
+        result = measure_import(module, spec["lazy"], runs)
+        ok = result["median_ms"] <= spec["budget_ms"] and not result["loaded"]
+        failed = failed or not ok
+        status = "✅" if ok else "❌"
+        print(f"{status} {module}: {result['median_ms']:.1f} ms (бюджет {spec['budget_ms']:.0f} ms)")
+        if result["loaded"]:
+            print(f"   загружены при импорте: {', '.join(result['loaded'])}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
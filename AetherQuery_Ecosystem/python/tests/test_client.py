@@ -6,6 +6,8 @@ import os
 # Добавляем родительскую директорию в путь Python
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import json
+import queue
 from unittest.mock import Mock, patch
 import pytest
 
@@ -16,6 +18,7 @@ try:
         TimeoutError,
         AuthenticationError,
         QueryError,
+        ResourceError,
         ServerError,
     )
     IMPORT_SUCCESS = True
@@ -116,6 +119,300 @@ if IMPORT_SUCCESS:
         print("   ✅ TimeoutError корректно обработан")
 
 
+    @patch('aetherquery.client.requests.Session')
+    def test_quota_exceeded_raises_resource_error(mock_session):
+        """Тест ответа 429: квота ключа API превращается в ResourceError"""
+        print("\n🧪 Тест: превышение квоты")
+        
+        import requests
+        response = Mock(status_code=429, headers={'Retry-After': '3', 'X-Quota-Exceeded': 'rate'})
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError("429 Too Many Requests",
+                                                                              response=response)
+        mock_session.return_value.request.return_value = response
+        
+        client_instance = AetherClient(base_url="http://localhost:8000", api_key="noisy")
+        
+        with pytest.raises(ResourceError) as exc_info:
+            client_instance.query("SELECT 1")
+        
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.resource_type == "rate"
+        assert exc_info.value.retry_after == 3.0
+        print("   ✅ ResourceError с Retry-After")
+
+
+    @patch('aetherquery.client.requests.Session')
+    def test_transaction_commit_and_rollback(mock_session):
+        """Тест транзакции: запросы идут с X-Session-Id, в конце commit/rollback"""
+        print("\n🧪 Тест: Транзакции через /session")
+        
+        mock_response = Mock()
+        mock_response.json.return_value = {"session_id": "abc123", "success": True}
+        mock_response.raise_for_status.return_value = None
+        request = mock_session.return_value.request
+        request.return_value = mock_response
+        
+        client_instance = AetherClient(base_url="http://localhost:8000")
+        with client_instance.transaction():
+            client_instance.query("INSERT INTO t VALUES (1)")
+        
+        calls = [(c.args[0], c.args[1]) for c in request.call_args_list]
+        assert calls == [
+            ("POST", "http://localhost:8000/session"),
+            ("POST", "http://localhost:8000/query"),
+            ("POST", "http://localhost:8000/session/abc123/commit"),
+        ]
+        assert request.call_args_list[1].kwargs["headers"] == {"X-Session-Id": "abc123"}
+        
+        request.reset_mock()
+        with pytest.raises(ValueError):
+            with client_instance.transaction():
+                raise ValueError("boom")
+        assert request.call_args_list[-1].args[1] == "http://localhost:8000/session/abc123/rollback"
+        
+        # После блока запросы снова вне транзакции
+        client_instance.query("SELECT 1")
+        assert "headers" not in request.call_args_list[-1].kwargs
+        print("   ✅ Транзакция фиксируется и откатывается корректно")
+
+
+    class FakeWebSocket:
+        """Сервер /ws в памяти: отвечает на пару запросов в обратном порядке"""
+        
+        def __init__(self):
+            self.inbox = queue.Queue()
+            self.sent = []
+        
+        def send(self, text):
+            message = json.loads(text)
+            self.sent.append(message)
+            if message.get("type") == "cancel":
+                self.inbox.put(json.dumps({"id": message["id"], "type": "cancelled"}))
+                return
+            queries = [m for m in self.sent if m.get("type") == "query"]
+            if len(queries) == 2:
+                for query in reversed(queries):
+                    self.inbox.put(json.dumps({
+                        "id": query["id"], "type": "batch", "data": [{"q": query["query"]}]
+                    }))
+                    self.inbox.put(json.dumps({
+                        "id": query["id"], "type": "result", "success": True, "data": None
+                    }))
+        
+        def recv(self):
+            return self.inbox.get()
+        
+        def settimeout(self, timeout):
+            pass
+        
+        def close(self):
+            self.inbox.put("")
+
+
+    @patch('aetherquery.ws.websocket')
+    def test_websocket_transport(mock_websocket):
+        """Тест WebSocket транспорта: несколько запросов через одно соединение"""
+        print("\n🧪 Тест: WebSocket транспорт")
+        
+        fake_socket = FakeWebSocket()
+        mock_websocket.create_connection.return_value = fake_socket
+        
+        client_instance = AetherClient(base_url="http://localhost:8000", api_key="key", transport="ws")
+        first = client_instance.channel.submit("SELECT 1")
+        second = client_instance.channel.submit("SELECT 2")
+        
+        assert second.result(timeout=1) == {"success": True, "data": [{"q": "SELECT 2"}]}
+        assert first.result(timeout=1)["data"] == [{"q": "SELECT 1"}]
+        url = mock_websocket.create_connection.call_args.args[0]
+        assert url == "ws://localhost:8000/ws"
+        assert "Authorization: Bearer key" in mock_websocket.create_connection.call_args.kwargs["header"]
+        assert [m["id"] for m in fake_socket.sent] == ["1", "2"]
+        
+        pending = client_instance.channel.submit("SELECT 3")
+        assert client_instance.channel.cancel(pending.request_id)
+        assert pending.cancelled()
+        assert fake_socket.sent[-1] == {"id": "3", "type": "cancel"}
+        
+        client_instance.close()
+        print("   ✅ Ответы сопоставлены по id, отмена отправлена")
+
+
+    @patch('aetherquery.client.requests.Session')
+    def test_job_rows_resume_with_range(mock_session):
+        """Тест чтения результата задания с докачкой после обрыва"""
+        print("\n🧪 Тест: Результат фонового задания с докачкой")
+        import requests
+        
+        body = b'{"columns":["id","name"]}\n[1,"a"]\n[2,"b"]\n[3,"c"]\n'
+        
+        def broken_stream(chunk_size):
+            yield body[:30]
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+        
+        first = Mock()
+        first.raise_for_status.return_value = None
+        first.iter_content.side_effect = broken_stream
+        second = Mock()
+        second.raise_for_status.return_value = None
+        second.iter_content.return_value = [body[26:]]
+        request = mock_session.return_value.request
+        request.side_effect = [first, second]
+        
+        client_instance = AetherClient(base_url="http://localhost:8000")
+        rows = list(client_instance.job_rows("job1"))
+        
+        assert rows == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}, {"id": 3, "name": "c"}]
+        assert request.call_args_list[1].kwargs["headers"] == {"Range": "bytes=26-"}
+        print("   ✅ Докачка продолжилась с последней полной строки")
+
+
+    @patch('aetherquery.client.requests.Session')
+    def test_change_stream_reconnects_with_last_event_id(mock_session):
+        """Тест подписки на изменения: разбор SSE и продолжение с Last-Event-ID"""
+        print("\n🧪 Тест: Поток изменений")
+        import requests
+        
+        def first_stream(decode_unicode):
+            yield ": keepalive"
+            yield ""
+            yield "id: 7"
+            yield "event: change"
+            yield 'data: {"seq": 7, "table": "orders"}'
+            yield ""
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+        
+        first = Mock()
+        first.raise_for_status.return_value = None
+        first.iter_lines.side_effect = first_stream
+        second = Mock()
+        second.raise_for_status.return_value = None
+        second.iter_lines.return_value = ["event: reset", 'data: {"seq": 9}', ""]
+        request = mock_session.return_value.request
+        request.side_effect = [first, second]
+        
+        client_instance = AetherClient(base_url="http://localhost:8000")
+        events = list(client_instance.changes(tables=["orders"]))
+        
+        assert events == [
+            {"id": 7, "event": "change", "data": {"seq": 7, "table": "orders"}},
+            {"event": "reset", "data": {"seq": 9}},
+        ]
+        assert request.call_args_list[0].kwargs["params"] == {"tables": "orders"}
+        assert request.call_args_list[1].kwargs["headers"]["Last-Event-ID"] == "7"
+        print("   ✅ События разобраны, переподключение продолжает с последнего id")
+
+
+    @patch('aetherquery.client.requests.Session')
+    def test_request_timings(mock_session):
+        """Тест разбивки задержки: фазы сервера из Server-Timing и время клиента"""
+        print("\n🧪 Тест: Замер фаз запроса")
+        
+        mock_response = Mock()
+        mock_response.json.return_value = {"success": True, "data": []}
+        mock_response.raise_for_status.return_value = None
+        mock_response.headers = {"Server-Timing": "queue;dur=0.5, execute;dur=2.25, total;dur=3"}
+        mock_session.return_value.request.return_value = mock_response
+        
+        recorded = []
+        client_instance = AetherClient(
+            base_url="http://localhost:8000",
+            on_timings=lambda endpoint, timings: recorded.append(endpoint),
+        )
+        client_instance.query("SELECT 1")
+        timings = client_instance.last_timings
+        
+        assert timings["server"] == {"queue": 0.5, "execute": 2.25, "total": 3.0}
+        assert set(timings) == {"round_trip", "network", "decode", "total", "server"}
+        assert timings["total"] >= timings["decode"] >= 0
+        assert recorded == ["/query"]
+        print("   ✅ Фазы сервера разобраны, время сети и разбора записано")
+
+
+    @patch('aetherquery.client.requests.Session')
+    def test_explain_plan_in_cli(mock_session):
+        """Тест explain: запрос к /explain и вывод дерева плана строками с отступами"""
+        print("\n🧪 Тест: explain через сервер")
+        from aetherquery.cli import ServerTarget
+        
+        plan = {
+            "operation": "query", "detail": "SELECT ...", "actual_rows": 2, "children": [
+                {"operation": "search", "detail": "SEARCH t USING INDEX ia (a=?)", "table": "t",
+                 "index": "ia", "estimated_rows": 2.0, "children": []},
+            ],
+        }
+        mock_response = Mock()
+        mock_response.json.return_value = {"query": "SELECT ...", "node": "db", "plan": plan, "raw": []}
+        mock_response.raise_for_status.return_value = None
+        mock_session.return_value.request.return_value = mock_response
+        
+        target = ServerTarget("http://localhost:8000")
+        rows = target.explain("SELECT * FROM t WHERE a = ?", [1], analyze=True)
+        
+        _, kwargs = mock_session.return_value.request.call_args
+        assert kwargs["json"] == {"query": "SELECT * FROM t WHERE a = ?", "analyze": True, "params": [1]}
+        assert [row["operation"] for row in rows] == ["query", "  search"]
+        assert rows[0]["rows"] == 2 and rows[1]["index"] == "ia"
+        print("   ✅ План получен и развёрнут в таблицу")
+
+
+    def test_import_is_lazy_and_within_budget():
+        """Тест холодного импорта: requests не грузится до создания клиента, бюджет соблюдён"""
+        print("\n🧪 Тест: время импорта клиента")
+        from benchmarks.import_time import BUDGETS, measure_import
+
+        spec = BUDGETS['aetherquery.client']
+        result = measure_import('aetherquery.client', spec['lazy'], runs=3)
+        assert result['loaded'] == []
+        assert result['median_ms'] <= spec['budget_ms'], result
+        print(f"   ✅ Импорт за {result['median_ms']:.1f} мс без requests")
+
+
+    def test_cli_shell_and_explain_on_local_sqlite():
+        """Тест CLI: оболочка выводит результат пачками, explain показывает план"""
+        print("\n🧪 Тест: CLI shell и explain")
+        import sqlite3
+        import tempfile
+        from click.testing import CliRunner
+        from aetherquery.cli import main
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cli.db')
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+            conn.executemany("INSERT INTO t (v) VALUES (?)", [('x',)] * 5)
+            conn.commit()
+            conn.close()
+            target = f"sqlite:///{path}"
+
+            runner = CliRunner()
+            shell = runner.invoke(
+                main, ['shell', target, '--batch-size', '2'],
+                input="SELECT id, v\nFROM t;\nSELECT nope;\n\\q\n",
+            )
+            explain = runner.invoke(main, ['explain', target, 'SELECT * FROM t WHERE id = ?', '-p', '3'])
+
+        assert shell.exit_code == 0, shell.output
+        assert "5 строк" in shell.output
+        assert "no such column: nope" in shell.output
+        assert explain.exit_code == 0, explain.output
+        assert "INTEGER PRIMARY KEY" in explain.output
+        print("   ✅ Оболочка и explain работают без сервера")
+
+
+    def test_cli_bench_percentiles():
+        """Тест bench: запросы выполняются параллельно, перцентили упорядочены"""
+        print("\n🧪 Тест: CLI bench")
+        from aetherquery.cli import open_target, percentile, run_bench
+
+        assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.0
+        assert percentile([1.0, 2.0, 3.0, 4.0], 0.99) == 4.0
+        result = run_bench(lambda: open_target('sqlite:///:memory:'), "SELECT 1", concurrency=2,
+                           duration=0.2, warmup=0.05)
+        assert result['queries'] > 0 and result['errors'] == 0
+        assert result['p50_ms'] <= result['p90_ms'] <= result['p99_ms'] <= result['max_ms']
+        print(f"   ✅ {result['queries']} запросов, p99 {result['p99_ms']:.3f} мс")
+
+
     def test_exceptions_hierarchy():
         """Тест иерархии исключений"""
         print("\n🧪 Тест: Иерархия исключений")
@@ -142,6 +439,16 @@ if IMPORT_SUCCESS:
             test_client_context_manager,
             test_connection_error,
             test_timeout_error,
+            test_quota_exceeded_raises_resource_error,
+            test_transaction_commit_and_rollback,
+            test_websocket_transport,
+            test_job_rows_resume_with_range,
+            test_change_stream_reconnects_with_last_event_id,
+            test_request_timings,
+            test_explain_plan_in_cli,
+            test_import_is_lazy_and_within_budget,
+            test_cli_shell_and_explain_on_local_sqlite,
+            test_cli_bench_percentiles,
             test_exceptions_hierarchy,
         ]
         
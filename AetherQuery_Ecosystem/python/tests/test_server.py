@@ -0,0 +1,1460 @@
+"""Минимальные тесты для тестового сервера AetherQuery"""
+
+import sys
+import os
+
+# Добавляем родительскую директорию в путь Python
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import json
+import tempfile
+
+try:
+    import aetherquery_server
+    from aetherquery_server import (
+        Datasource,
+        DatasourceConfig,
+        HashJoin,
+        classify_statement,
+    )
+    IMPORT_SUCCESS = True
+    print("✅ Импорт модулей успешен")
+except ImportError as e:
+    print(f"❌ Ошибка импорта: {e}")
+    IMPORT_SUCCESS = False
+
+
+if IMPORT_SUCCESS:
+
+    def make_datasource(**kwargs):
+        """Источник данных с мгновенными имитированными узлами"""
+        config = DatasourceConfig(
+            primary="simulated://primary?delay=0",
+            replicas=["simulated://replica-1?delay=0", "simulated://replica-2?delay=0&lag=30"],
+            **kwargs
+        )
+        return Datasource(config)
+
+
+    def test_classify_statement():
+        """Тест классификации запросов на чтение и запись"""
+        print("\n🧪 Тест: Классификация запросов")
+        assert classify_statement("SELECT * FROM users") == "read"
+        assert classify_statement("  -- comment\nselect 1") == "read"
+        assert classify_statement("WITH t AS (SELECT 1) SELECT * FROM t") == "read"
+        assert classify_statement("SELECT * FROM users FOR UPDATE") == "write"
+        assert classify_statement("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d") == "write"
+        assert classify_statement("INSERT INTO users VALUES (1)") == "write"
+        assert classify_statement("BEGIN") == "write"
+        print("   ✅ Запросы классифицированы корректно")
+
+
+    def test_reads_go_to_fresh_replica():
+        """Тест маршрутизации чтения на реплику с допустимым отставанием"""
+        print("\n🧪 Тест: Чтение с реплик")
+        datasource = make_datasource(max_replica_lag=5.0)
+        asyncio.run(datasource.probe_lag())
+
+        _, node = asyncio.run(datasource.execute("SELECT * FROM users"))
+        assert node.name == "replica-1"
+
+        _, node = asyncio.run(datasource.execute("UPDATE users SET name = 'x'"))
+        assert node.name == "primary"
+
+        _, node = asyncio.run(datasource.execute("SELECT 1", options={"transaction": True}))
+        assert node.name == "primary"
+        print("   ✅ Чтение идёт на реплику, запись и транзакции - на primary")
+
+
+    def test_read_your_writes_window():
+        """Тест окна read-your-writes"""
+        print("\n🧪 Тест: Read-your-writes")
+        datasource = make_datasource(read_your_writes=60.0)
+        asyncio.run(datasource.probe_lag())
+
+        asyncio.run(datasource.execute("INSERT INTO users VALUES (4)", client_key="alice"))
+        _, node = asyncio.run(datasource.execute("SELECT * FROM users", client_key="alice"))
+        assert node.name == "primary"
+
+        _, node = asyncio.run(datasource.execute("SELECT * FROM users", client_key="bob"))
+        assert node.name == "replica-1"
+        print("   ✅ Клиент видит свои записи, остальные читают с реплик")
+
+
+    def test_parallel_scan_sqlite():
+        """Тест параллельного чтения таблицы SQLite диапазонами rowid"""
+        print("\n🧪 Тест: Параллельное сканирование")
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:?pool_size=4"))
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, amount INTEGER)")
+            for i in range(1, 101):
+                await datasource.execute("INSERT INTO orders (amount) VALUES (?)", [i * 37 % 101])
+
+            unordered = await datasource.scan("orders", partitions=4, min_rows=1).fetch_all()
+            by_key = await datasource.scan("orders", order_by="id", min_rows=1, batch_size=7).fetch_all()
+            by_amount = await datasource.scan("orders", order_by="amount", min_rows=1, batch_size=7).fetch_all()
+            await datasource.close()
+            return unordered, by_key, by_amount
+
+        unordered, by_key, by_amount = asyncio.run(scenario())
+        assert sorted(row["id"] for row in unordered) == list(range(1, 101))
+        assert [row["id"] for row in by_key] == list(range(1, 101))
+        amounts = [row["amount"] for row in by_amount]
+        assert amounts == sorted(amounts) and len(amounts) == 100
+        print("   ✅ Партиции объединены без потерь, порядок соблюдён")
+
+
+    def test_federated_hash_join_spills_to_disk():
+        """Тест соединения двух источников с ограничением памяти"""
+        print("\n🧪 Тест: Федеративное хеш-соединение")
+        orders = Datasource(DatasourceConfig(name="orders", primary="sqlite:///:memory:"))
+        profiles = Datasource(DatasourceConfig(name="profiles", primary="sqlite:///:memory:"))
+
+        async def scenario():
+            await orders.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER, amount INTEGER)")
+            await profiles.execute("CREATE TABLE profiles (user_id INTEGER, name TEXT)")
+            for i in range(200):
+                await orders.execute("INSERT INTO orders (user_id, amount) VALUES (?, ?)", [i % 50, i])
+            for user_id in range(40):
+                await profiles.execute("INSERT INTO profiles VALUES (?, ?)", [user_id, f"user{user_id}"])
+
+            results = []
+            for memory_rows in (100000, 5):
+                join = HashJoin(["user_id"], ["user_id"], how="left", memory_rows=memory_rows, spill_partitions=4)
+                rows = []
+                async for batch in join.run(
+                    orders.select_batches("orders", filters={"amount": {"$gte": 10}}, batch_size=16),
+                    profiles.select_batches("profiles", batch_size=16),
+                ):
+                    rows.extend(batch)
+                results.append((join.spilled, rows))
+            await orders.close()
+            await profiles.close()
+            return results
+
+        (spilled_mem, in_memory), (spilled_disk, on_disk) = asyncio.run(scenario())
+        assert not spilled_mem and spilled_disk
+        assert len(in_memory) == len(on_disk) == 190
+        key = lambda row: row["id"]
+        assert sorted(in_memory, key=key) == sorted(on_disk, key=key)
+        assert all(row["name"] is None for row in in_memory if row["user_id"] >= 40)
+        print("   ✅ Результат со сбросом на диск совпадает с результатом в памяти")
+
+
+    def test_query_cache_invalidated_by_writes():
+        """Тест кэша результатов с инвалидацией по таблицам"""
+        print("\n🧪 Тест: Кэш результатов запросов")
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:", cache="memory://"))
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+            await datasource.execute("INSERT INTO users (name) VALUES (?)", ["Alice"])
+            first, node_first = await datasource.execute("SELECT * FROM users WHERE id = ?", [1])
+            second, node_second = await datasource.execute("SELECT * FROM users WHERE id = ?", [1])
+            other, node_other = await datasource.execute("SELECT * FROM users WHERE id = ?", [2])
+            await datasource.execute("UPDATE users SET name = ? WHERE id = ?", ["Alicia", 1])
+            third, node_third = await datasource.execute("SELECT * FROM users WHERE id = ?", [1])
+            await datasource.close()
+            return first, node_first, second, node_second, node_other, third, node_third
+
+        first, node_first, second, node_second, node_other, third, node_third = asyncio.run(scenario())
+        assert node_first is not None and node_second is None
+        assert first == second == [{"id": 1, "name": "Alice"}]
+        assert node_other is not None
+        assert node_third is not None and third == [{"id": 1, "name": "Alicia"}]
+        assert datasource.cache.stats()["hits"] == 1
+
+        # Чтение, которое пересеклось с записью, не кладёт в кэш устаревший результат
+        racing = Datasource(DatasourceConfig(primary="sqlite:///:memory:", cache="memory://"))
+
+        async def overlap():
+            await racing.execute("CREATE TABLE t (v TEXT)")
+            await racing.execute("INSERT INTO t VALUES ('old')")
+            backend = racing.primary.backend
+            execute, gate = backend.execute, asyncio.Event()
+
+            async def slow_read(query, params=None):
+                rows = await execute(query, params)
+                if query.startswith("SELECT"):
+                    await gate.wait()
+                return rows
+
+            backend.execute = slow_read
+            read = asyncio.create_task(racing.execute("SELECT v FROM t"))
+            await asyncio.sleep(0.01)
+            await racing.execute("UPDATE t SET v = 'new'")
+            gate.set()
+            during, _ = await read
+            after, node = await racing.execute("SELECT v FROM t")
+            await racing.close()
+            return during, after, node
+
+        during, after, node = asyncio.run(overlap())
+        assert during == [{"v": "old"}]
+        assert after == [{"v": "new"}] and node is not None
+
+        # Вытесненные и истёкшие записи не остаются в наборах тегов
+        from aetherquery_server import MemoryCacheStore
+        store = MemoryCacheStore(max_entries=2)
+
+        async def evictions():
+            for i in range(10):
+                await store.set(f"q{i}", b"j", 60.0, ["t:users", f"t:other{i}"])
+            await store.set("short", b"j", 0.0, ["t:short"])
+            expired = await store.get("short")
+            return expired, await store.invalidate(["t:users"])
+
+        expired, removed = asyncio.run(evictions())
+        assert expired is None and removed == 1
+        assert store._tags == {} and store._key_tags == {} and not store._entries
+        print("   ✅ Повторное чтение из кэша, запись сбрасывает записи таблицы")
+
+
+    def test_query_cache_key_keeps_literals():
+        """Тест ключа кэша: литералы сравниваются точно, пробелы и регистр вне них - нет"""
+        print("\n🧪 Тест: Ключ кэша и литералы")
+        from aetherquery_server import QueryCache, MemoryCacheStore
+        cache = QueryCache(MemoryCacheStore())
+        key = lambda query: cache.key("default", query, [])
+        assert key("SELECT * FROM users WHERE name = 'Bob'") != key("SELECT * FROM users WHERE name = 'bob'")
+        assert key("SELECT * FROM notes WHERE note = 'a  b'") != key("SELECT * FROM notes WHERE note = 'a b'")
+        assert key("SELECT '--x' FROM t") != key("SELECT '--y' FROM t")
+        assert key("SELECT * FROM \"Users\"") != key("SELECT * FROM \"users\"")
+        assert key("select *  from users -- all\n where name = 'Bob';") == key("SELECT * FROM users WHERE name = 'Bob'")
+
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:", cache="memory://"))
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+            await datasource.execute("INSERT INTO users (name) VALUES ('Bob'), ('bob')")
+            upper, _ = await datasource.execute("SELECT id FROM users WHERE name = 'Bob'")
+            lower, _ = await datasource.execute("SELECT id FROM users WHERE name = 'bob'")
+            await datasource.close()
+            return upper, lower
+
+        upper, lower = asyncio.run(scenario())
+        assert upper == [{"id": 1}] and lower == [{"id": 2}]
+        print("   ✅ Запросы с разным регистром литералов не делят запись кэша")
+
+
+    def test_metadata_cache_invalidated_by_ddl():
+        """Тест кэша метаданных: повторные запросы без каталога, DDL сбрасывает кэш"""
+        print("\n🧪 Тест: Кэш метаданных")
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:"))
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, title TEXT)")
+            await datasource.execute("INSERT INTO items (title) VALUES ('a'), ('b'), ('c')")
+            first, etag_first = await datasource.metadata.table("items")
+            _, etag_again = await datasource.metadata.table("items")
+            await datasource.execute("ALTER TABLE items ADD COLUMN price REAL")
+            second, etag_second = await datasource.metadata.table("items")
+            await datasource.close()
+            return first, etag_first, etag_again, second, etag_second
+
+        first, etag_first, etag_again, second, etag_second = asyncio.run(scenario())
+        assert first["estimated_rows"] == 3
+        assert etag_first == etag_again
+        assert datasource.metadata.stats()["hits"] == 1
+        assert [c["name"] for c in second["columns"]] == ["id", "title", "price"]
+        assert etag_second != etag_first
+
+        # Без ANALYZE оценка берётся из max(rowid), таблица целиком не читается
+        import sqlite3
+        from aetherquery_server import SQLiteBackend
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.execute("CREATE TABLE tags (name TEXT PRIMARY KEY) WITHOUT ROWID")
+        conn.execute("INSERT INTO items (title) VALUES ('a'), ('b'), ('c')")
+        conn.execute("DELETE FROM items WHERE id = 2")
+        statements = []
+        conn.set_trace_callback(statements.append)
+        estimate = SQLiteBackend._table_stats(conn, "items")["estimated_rows"]
+        no_rowid = SQLiteBackend._table_stats(conn, "tags")["estimated_rows"]
+        conn.close()
+        assert estimate == 3 and no_rowid is None
+        assert not any("count(" in statement.lower() for statement in statements)
+        print("   ✅ Метаданные кэшируются и обновляются после DDL")
+
+
+    def test_sqlite_tuned_profile():
+        """Тест профиля SQLite: WAL, pragmas и разделение писателя и читателей"""
+        print("\n🧪 Тест: Профиль производительности SQLite")
+        workdir = tempfile.mkdtemp()
+        url = f"sqlite:///{os.path.join(workdir, 'tuned.db')}?profile=tuned&readers=3&mmap_size=1048576"
+        datasource = Datasource(DatasourceConfig(primary=url))
+        backend = datasource.primary.backend
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT)")
+            await datasource.execute("INSERT INTO events (kind) VALUES (?)", ["click"])
+            rows, _ = await datasource.execute("SELECT kind FROM events")
+            # Соединения читателей открыты в режиме query_only
+            try:
+                await backend._run(backend._execute, "DELETE FROM events", None)
+                reader_wrote = True
+            except aetherquery_server.BackendError:
+                reader_wrote = False
+            await asyncio.sleep(0)
+            return rows, reader_wrote
+
+        rows, reader_wrote = asyncio.run(scenario())
+        settings = backend.settings()
+        asyncio.run(datasource.close())
+        assert rows == [{"kind": "click"}]
+        assert not reader_wrote
+        assert backend.pool_size == 3
+        assert settings["journal_mode"] == "wal"
+        assert settings["mmap_size"] == 1048576
+        print("   ✅ WAL включён, читатели не могут писать")
+
+
+    def test_transaction_sessions():
+        """Тест сессий транзакций: закреплённое соединение, commit/rollback и лимит"""
+        print("\n🧪 Тест: Сессии транзакций")
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:", max_sessions=1))
+        sessions = aetherquery_server.SessionManager()
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE accounts (id INTEGER PRIMARY KEY, balance INTEGER)")
+            session = await sessions.open(datasource, "alice")
+            try:
+                await sessions.open(datasource, "bob")
+                limited = False
+            except aetherquery_server.HTTPException as e:
+                limited = e.status_code == 429
+            await session.execute("INSERT INTO accounts (balance) VALUES (?)", [100])
+            inside = await session.execute("SELECT count(*) AS n FROM accounts", [])
+            await sessions.finish(session.id, commit=False)
+            after_rollback, _ = await datasource.execute("SELECT count(*) AS n FROM accounts")
+
+            session = await sessions.open(datasource, "alice")
+            await session.execute("INSERT INTO accounts (balance) VALUES (?)", [50])
+            await sessions.finish(session.id, commit=True)
+            after_commit, _ = await datasource.execute("SELECT count(*) AS n FROM accounts")
+            await datasource.close()
+            return limited, inside, after_rollback, after_commit
+
+        limited, inside, after_rollback, after_commit = asyncio.run(scenario())
+        assert limited
+        assert inside == [{"n": 1}]
+        assert after_rollback == [{"n": 0}]
+        assert after_commit == [{"n": 1}]
+
+        # Читатели пула не видят незафиксированных строк сессии и не кэшируют их
+        cached = Datasource(DatasourceConfig(primary="sqlite:///:memory:", cache="memory://"))
+
+        async def isolation():
+            await cached.execute("CREATE TABLE accounts (id INTEGER PRIMARY KEY, balance INTEGER)")
+            transaction = await cached.open_transaction()
+            await transaction.execute("INSERT INTO accounts (balance) VALUES (?)", [100])
+            read = asyncio.create_task(cached.execute("SELECT count(*) AS n FROM accounts"))
+            await asyncio.sleep(0.05)
+            waited = not read.done()
+            await transaction.rollback()
+            during, _ = await read
+            again, node = await cached.execute("SELECT count(*) AS n FROM accounts")
+            await cached.close()
+            return waited, during, again, node
+
+        waited, during, again, node = asyncio.run(isolation())
+        assert waited and during == [{"n": 0}]
+        assert again == [{"n": 0}] and node is None
+        print("   ✅ Откат и фиксация работают, лимит сессий соблюдается")
+
+
+    def test_websocket_channel_multiplexing():
+        """Тест канала /ws: параллельные запросы, пачки и отмена по id"""
+        print("\n🧪 Тест: WebSocket канал запросов")
+        from fastapi.testclient import TestClient
+
+        previous = aetherquery_server.server_state.datasources
+        aetherquery_server.server_state.configure([
+            DatasourceConfig(primary="sqlite:///:memory:"),
+            DatasourceConfig(name="slow", primary="simulated://slow?delay=5"),
+        ])
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                http.post("/query", json={"query": "CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"})
+                http.post("/query", json={"query": "INSERT INTO t (v) VALUES ('a'), ('b'), ('c')"})
+                with http.websocket_connect("/ws") as ws:
+                    ws.send_json({"id": "slow", "query": "SELECT 1", "options": {"datasource": "slow"}})
+                    ws.send_json({"id": "count", "query": "SELECT count(*) AS n FROM t"})
+                    ws.send_json({"id": "rows", "query": "SELECT * FROM t", "batch_size": 2})
+                    frames = [ws.receive_json() for _ in range(4)]
+                    ws.send_json({"id": "slow", "type": "cancel"})
+                    cancelled = ws.receive_json()
+        finally:
+            aetherquery_server.server_state.datasources = previous
+
+        by_id = {}
+        for frame in frames:
+            by_id.setdefault(frame["id"], []).append(frame)
+        assert by_id["count"][0]["data"] == [{"n": 3}]
+        assert [f["type"] for f in by_id["rows"]] == ["batch", "batch", "result"]
+        assert by_id["rows"][-1]["rows"] == 3
+        assert cancelled == {"id": "slow", "type": "cancelled"}
+        print("   ✅ Быстрые запросы не ждут медленный, отмена работает")
+
+
+    def test_unix_socket_shared_memory_transport():
+        """Тест Unix socket: большой результат приходит через разделяемую память"""
+        print("\n🧪 Тест: Unix socket и разделяемая память")
+        import threading
+        import time
+        import uvicorn
+        from aetherquery.client import AetherClient
+
+        state = aetherquery_server.server_state
+        previous = state.datasources, state.shared_results.threshold
+        state.configure([DatasourceConfig(primary="sqlite:///:memory:")])
+        state.shared_results.threshold = 1000
+        handed_over = state.shared_results.handed_over
+
+        path = os.path.join(tempfile.mkdtemp(), "aetherquery.sock")
+        server = uvicorn.Server(uvicorn.Config(aetherquery_server.app, uds=path, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        try:
+            while not server.started:
+                time.sleep(0.05)
+            with AetherClient(f"unix://{path}") as client_instance:
+                client_instance.query("CREATE TABLE docs (id INTEGER PRIMARY KEY, body TEXT)")
+                for _ in range(20):
+                    client_instance.query("INSERT INTO docs (body) VALUES (?)", ["x" * 100])
+                small = client_instance.query("SELECT count(*) AS n FROM docs")
+                large = client_instance.query("SELECT * FROM docs")
+        finally:
+            server.should_exit = True
+            thread.join()
+            state.datasources, state.shared_results.threshold = previous
+
+        assert small["data"] == [{"n": 20}]
+        assert len(large["data"]) == 20 and large["success"]
+        assert state.shared_results.handed_over == handed_over + 1
+        # Клиент удалил прочитанный сегмент - серверу удалять нечего
+        state.shared_results.expire(force=True)
+        assert state.shared_results.stats()["pending"] == 0
+        print("   ✅ Маленькие ответы идут по сокету, большие - через разделяемую память")
+
+
+    def test_background_jobs():
+        """Тест фоновых заданий: ограничение параллельности, файл результата, Range и TTL"""
+        print("\n🧪 Тест: Фоновые задания")
+        from aetherquery_server import JobManager, QueryRequest
+
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:"))
+        slow = Datasource(DatasourceConfig(name="slow", primary="simulated://slow?delay=0.3"))
+        jobs = JobManager(tempfile.mkdtemp(), max_running=1, ttl=0.0)
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT)")
+            for i in range(25):
+                await datasource.execute("INSERT INTO events (kind) VALUES (?)", [f"k{i % 3}"])
+
+            blocker = jobs.submit(slow, QueryRequest(query="SELECT * FROM users"), None)
+            job = jobs.submit(datasource, QueryRequest(query="SELECT * FROM events WHERE kind = ?", params=["k1"]), None)
+            failing = jobs.submit(datasource, QueryRequest(query="SELECT * FROM missing"), None)
+            await asyncio.sleep(0.1)
+            statuses = (blocker.status, job.status)
+            await asyncio.gather(blocker.task, job.task, failing.task)
+            with open(job.path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            jobs.expire()
+            await jobs.close_all()
+            await datasource.close()
+            return statuses, job, failing, lines
+
+        statuses, job, failing, lines = asyncio.run(scenario())
+        assert statuses == ("running", "queued")
+        assert job.status == "done" and job.rows == 8
+        assert json.loads(lines[0]) == {"columns": ["id", "kind"]}
+        assert len(lines) == 9 and json.loads(lines[1]) == [2, "k1"]
+        assert failing.status == "failed" and "missing" in failing.error
+        assert not jobs.jobs and not os.path.exists(job.path)
+        print("   ✅ Задания выполняются по очереди, результат удаляется по TTL")
+
+
+    def test_export_partitioned_csv():
+        """Тест выгрузки в сжатые CSV с разбиением по ключу и числу строк"""
+        print("\n🧪 Тест: Экспорт в файлы")
+        import csv
+        import gzip
+        from aetherquery_server import Exporter, ExportRequest
+
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:"))
+        exporter = Exporter(tempfile.mkdtemp(), workers=1)
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE sales (id INTEGER PRIMARY KEY, region TEXT, amount INTEGER)")
+            for i in range(50):
+                await datasource.execute("INSERT INTO sales (region, amount) VALUES (?, ?)", [["eu", "us"][i % 2], i])
+            request = ExportRequest(
+                query="SELECT * FROM sales", compression="gzip", partition_by="region",
+                partition_rows=10, batch_size=7, name="sales",
+            )
+            manifest = await exporter.export(datasource, request)
+            await datasource.close()
+            return manifest
+
+        try:
+            manifest = asyncio.run(scenario())
+        finally:
+            exporter.close()
+
+        assert manifest["rows"] == 50
+        assert [f["rows"] for f in manifest["files"]] == [10, 10, 5, 10, 10, 5]
+        assert manifest["files"][0]["path"] == os.path.join("sales", "region=eu", "part-00000.csv.gz")
+        exported = []
+        for info in manifest["files"]:
+            with gzip.open(os.path.join(exporter.directory, info["path"]), "rt", newline="") as f:
+                rows = list(csv.reader(f))
+            assert rows[0] == ["id", "region", "amount"]
+            exported.extend(rows[1:])
+        assert sorted(int(row[0]) for row in exported) == list(range(1, 51))
+        print("   ✅ Части разложены по ключу и ограничены по числу строк")
+
+
+    def test_bulk_import_csv():
+        """Тест импорта CSV: части по границам строк, типы из схемы таблицы"""
+        print("\n🧪 Тест: Импорт CSV")
+        from aetherquery_server import Importer, ImportRequest
+
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, "items.csv"), "w", newline="", encoding="utf-8") as f:
+            f.write("id,title,price,active\n")
+            for i in range(1, 301):
+                title = '"multi\nline, ""quoted"""' if i % 50 == 0 else f"item{i}"
+                f.write(f"{i},{title},{'' if i % 7 == 0 else i * 1.5},{i % 2}\n")
+
+        datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:"))
+        importer = Importer(directory, workers=1)
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, title TEXT, price REAL, active BOOLEAN)")
+            task = importer.start(datasource, ImportRequest(path="items.csv", table="items", chunk_bytes=512, batch_size=64), None)
+            await task.task
+            rows, _ = await datasource.execute(
+                "SELECT count(*) AS n, sum(price IS NULL) AS nulls, sum(typeof(id) = 'integer') AS ints, "
+                "max(length(title)) AS longest FROM items"
+            )
+            quoted, _ = await datasource.execute("SELECT title, active FROM items WHERE id = 100")
+            await datasource.close()
+            return task, rows[0], quoted[0]
+
+        try:
+            task, summary, quoted = asyncio.run(scenario())
+        finally:
+            importer.close()
+
+        assert task.status == "done", task.error
+        assert task.chunks > 1 and task.info()["progress"] == 1.0
+        assert summary == {"n": 300, "nulls": 42, "ints": 300, "longest": 20}
+        assert quoted == {"title": 'multi\nline, "quoted"', "active": 0}
+
+        # Запись о завершённой загрузке живёт ttl секунд, как результаты заданий
+        assert task.expires_at is not None and task.expires_at > task.finished_at
+        importer.expire()
+        assert importer.get(task.id) is task
+        task.expires_at = 0
+        importer.expire()
+        assert task.id not in importer.imports and importer.stats()["expired"] == 1
+        print("   ✅ Файл разобран по частям, значения приведены к типам колонок")
+
+
+    def test_change_feed_invalidates_caches():
+        """Тест потока изменений: свои и внешние записи сбрасывают кэш и доходят до подписчика"""
+        print("\n🧪 Тест: Поток изменений")
+        import sqlite3
+
+        path = os.path.join(tempfile.mkdtemp(), "changes.db")
+        datasource = Datasource(DatasourceConfig(primary=f"sqlite:///{path}", cache="memory://"))
+
+        async def scenario():
+            await datasource.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, total INTEGER)")
+            subscription = datasource.changes.subscribe(["orders"])
+            await datasource.execute("INSERT INTO orders (total) VALUES (10)")
+            await datasource.poll_external_changes()
+            cached, _ = await datasource.execute("SELECT count(*) AS n FROM orders")
+
+            external = sqlite3.connect(path)
+            external.execute("INSERT INTO orders (total) VALUES (20)")
+            external.commit()
+            external.close()
+            await datasource.poll_external_changes()
+            fresh, node = await datasource.execute("SELECT count(*) AS n FROM orders")
+
+            events = []
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+            replay = datasource.changes.subscribe(after=events[0]["seq"])
+
+            # Своя запись уже зафиксирована, но ещё не завершилась, когда идёт опрос
+            import threading
+            backend = datasource.primary.backend
+            committed, release = threading.Event(), threading.Event()
+
+            def slow_write(conn):
+                backend._execute(conn, "INSERT INTO orders (total) VALUES (30)", None)
+                committed.set()
+                release.wait(5)
+
+            versions = [await backend.data_version()]
+            write = asyncio.create_task(backend._run_write(slow_write))
+            await asyncio.get_running_loop().run_in_executor(None, committed.wait, 5)
+            await datasource.poll_external_changes()
+            versions.append(await backend.data_version())
+            release.set()
+            await write
+            await datasource.poll_external_changes()
+            during = subscription.queue.qsize()
+            await datasource.close()
+            return cached, fresh, node, events, replay.queue.qsize(), versions, during
+
+        cached, fresh, node, events, replayed, versions, during = asyncio.run(scenario())
+        assert versions[0] != versions[1] and during == 0
+
+        # Неразборчивый Last-Event-ID - не 500, а reset: клиент перечитывает данные
+        from fastapi.testclient import TestClient
+        with TestClient(aetherquery_server.app) as http:
+            resumed = http.get("/changes", headers={"Last-Event-ID": "abc"})
+        assert resumed.status_code == 200 and resumed.text.startswith("event: reset")
+        assert cached == [{"n": 1}]
+        assert fresh == [{"n": 2}] and node is not None
+        assert [(e["table"], e["operation"], e["source"]) for e in events] == [
+            ("orders", "insert", "server"),
+            (None, "write", "external"),
+        ]
+        assert replayed == 1
+        print("   ✅ Внешняя запись замечена, кэш сброшен, подписчик получил события")
+
+
+    def test_server_timing_phases():
+        """Тест замера фаз: Server-Timing и поле timings в ответе /query"""
+        print("\n🧪 Тест: Server-Timing")
+        from fastapi.testclient import TestClient
+
+        previous = aetherquery_server.server_state.datasources
+        aetherquery_server.server_state.configure([DatasourceConfig(primary="sqlite:///:memory:")])
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                http.post("/query", json={"query": "CREATE TABLE t (id INTEGER PRIMARY KEY)"})
+                with_timings = http.post("/query", json={"query": "SELECT * FROM t", "options": {"timings": True}})
+                without = http.post("/query", json={"query": "SELECT * FROM t"})
+        finally:
+            aetherquery_server.server_state.datasources = previous
+
+        header = with_timings.headers["server-timing"]
+        phases = [metric.split(";")[0] for metric in header.split(", ")]
+        assert phases == ["queue", "lease", "execute", "fetch", "serialize", "total"]
+        timings = with_timings.json()["timings"]
+        assert set(timings) == {"queue", "lease", "execute", "fetch", "total"}
+        assert without.json()["timings"] is None and "server-timing" in without.headers
+        print("   ✅ Фазы очереди, пула, выполнения, выборки и сериализации замерены")
+
+
+    def test_debug_profile_and_allocations():
+        """Тест отладочных эндпоинтов: защита токеном, свёрнутые стеки, аллокации по маршрутам"""
+        print("\n🧪 Тест: профайлер и tracemalloc")
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from fastapi.testclient import TestClient
+
+        state = aetherquery_server.server_state
+        previous = state.debug_token
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                state.debug_token = None
+                assert http.get("/debug/profile").status_code == 404
+                state.debug_token = "secret"
+                assert http.get("/debug/profile", headers={"X-Debug-Token": "wrong"}).status_code == 403
+
+                headers = {"X-Debug-Token": "secret"}
+                profile = http.get("/debug/profile", params={"seconds": 0.2, "interval": 0.01}, headers=headers)
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    capture = pool.submit(http.get, "/debug/allocations",
+                                          params={"seconds": 0.5, "limit": 5}, headers=headers)
+                    time.sleep(0.1)
+                    for _ in range(5):
+                        http.get("/tables")
+                    allocations = capture.result()
+        finally:
+            state.debug_token = previous
+
+        assert profile.status_code == 200
+        lines = profile.text.strip().splitlines()
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0 and ";" in stack
+        assert any("run_forever" in line for line in lines)
+        report = allocations.json()
+        assert len(report["top"]) <= 5
+        tables = [entry for entry in report["routes"] if entry["route"] == "GET /tables"]
+        assert tables and tables[0]["requests"] == 5
+        print("   ✅ Стеки свёрнуты, прирост памяти отнесён к маршрутам")
+
+
+    def test_lazy_backend_registry():
+        """Тест ленивого реестра: модуль бэкенда импортируется при первом источнике"""
+        print("\n🧪 Тест: ленивая загрузка бэкендов")
+        module_name = "aetherquery_lazy_backend_probe"
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, f"{module_name}.py"), "w", encoding="utf-8") as f:
+                f.write("from aetherquery_server import SimulatedBackend\n\n"
+                        "class ProbeBackend(SimulatedBackend):\n    pass\n")
+            sys.path.insert(0, tmp)
+            try:
+                aetherquery_server.register_backend("probe", f"{module_name}:ProbeBackend")
+                assert module_name not in sys.modules
+                backend = aetherquery_server.create_backend("probe://node")
+                assert type(backend).__name__ == "ProbeBackend"
+                assert module_name in sys.modules
+                assert not isinstance(aetherquery_server.BACKENDS["probe"], str)
+
+                aetherquery_server.register_backend("missing", "aetherquery_no_such_driver:Backend")
+                try:
+                    aetherquery_server.create_backend("missing://node")
+                    assert False, "ожидалась ошибка отсутствующего драйвера"
+                except ValueError as e:
+                    assert "aetherquery_no_such_driver" in str(e)
+            finally:
+                sys.path.remove(tmp)
+                sys.modules.pop(module_name, None)
+                aetherquery_server.BACKENDS.pop("probe", None)
+                aetherquery_server.BACKENDS.pop("missing", None)
+        print("   ✅ Драйвер загружен только при создании источника")
+
+
+    def test_explain_and_slow_query_plans():
+        """Тест /explain: нормализованный план SQLite и снятие планов медленных запросов"""
+        print("\n🧪 Тест: EXPLAIN и журнал медленных запросов")
+        import time
+        from fastapi.testclient import TestClient
+
+        previous = aetherquery_server.server_state.datasources
+        aetherquery_server.server_state.configure([DatasourceConfig(
+            primary="sqlite:///:memory:", slow_query_ms=0.000001,
+        )])
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                for statement in [
+                    "CREATE TABLE t (id INTEGER PRIMARY KEY, a INT, b INT)",
+                    "CREATE INDEX ia ON t (a, b)",
+                    "INSERT INTO t (a, b) VALUES (1, 2), (1, 3), (2, 2), (3, 1)",
+                    "ANALYZE",
+                ]:
+                    http.post("/query", json={"query": statement})
+                invalid = http.post("/explain", json={"query": "SELECT missing FROM t"})
+                plan = http.post("/explain", json={
+                    "query": "SELECT a, b FROM t x WHERE a = ?", "params": [1], "analyze": True,
+                }).json()
+                rejected = http.post("/explain", json={"query": "DELETE FROM t", "analyze": True})
+                http.post("/query", json={"query": "SELECT * FROM t WHERE b = 2"})
+                for _ in range(50):
+                    log = http.get("/slow-queries").json()
+                    scans = [entry for entry in log["queries"] if entry["query"] == "SELECT * FROM t WHERE b = 2"]
+                    if scans and scans[0]["plan"]:
+                        break
+                    time.sleep(0.02)
+        finally:
+            aetherquery_server.server_state.datasources = previous
+
+        assert invalid.status_code == 400
+        search = plan["plan"]["children"][0]
+        assert search["operation"] == "search" and search["table"] == "t"
+        assert search["index"] == "ia" and search["covering"] and search["estimated_rows"] == 2
+        assert plan["analyzed"] and plan["plan"]["actual_rows"] == 2 and plan["execution_time"] >= 0
+        assert rejected.status_code == 400
+        assert scans[0]["plan"]["children"][0]["operation"] == "scan"
+        assert not [entry for entry in log["queries"] if entry["query"].startswith("CREATE") and entry["plan"]]
+        print("   ✅ План нормализован, медленные запросы сохранены с планами")
+
+
+    def test_index_advisor_validates_on_scratch_copy():
+        """Тест советника: кандидаты из журнала медленных запросов, проверка на копии базы, DDL"""
+        print("\n🧪 Тест: советник по индексам")
+        import time
+        from fastapi.testclient import TestClient
+
+        previous = aetherquery_server.server_state.datasources
+        aetherquery_server.server_state.configure([DatasourceConfig(
+            primary="sqlite:///:memory:", slow_query_ms=0.000001,
+        )])
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                assert http.get("/advisor/indexes", params={"datasource": "default"}).status_code == 200
+                http.post("/query", json={"query": (
+                    "CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INT, status TEXT, created_at INT)"
+                )})
+                http.post("/query", json={"query": "CREATE INDEX idx_status ON orders (status)"})
+                values = ",".join(f"({i % 200}, 's{i % 3}', {i})" for i in range(10000))
+                http.post("/query", json={"query": f"INSERT INTO orders (user_id, status, created_at) VALUES {values}"})
+                for user_id in range(3):
+                    http.post("/query", json={
+                        "query": "SELECT * FROM orders o WHERE o.user_id = ? AND created_at > ?",
+                        "params": [user_id, 100],
+                    })
+                http.post("/query", json={"query": "SELECT * FROM orders WHERE status = 's1'"})
+                for _ in range(50):
+                    log = http.get("/slow-queries").json()
+                    if all(entry["plan"] for entry in log["queries"] if entry["query"].startswith("SELECT")):
+                        break
+                    time.sleep(0.02)
+                validated = http.get("/advisor/indexes").json()
+                estimated = http.get("/advisor/indexes", params={"validate": False}).json()
+        finally:
+            aetherquery_server.server_state.datasources = previous
+
+        top = validated["candidates"][0]
+        assert top["table"] == "orders" and top["columns"] == ["user_id", "created_at"]
+        assert top["validated"] and top["used"] and top["estimated_benefit_ms"] > 0
+        assert top["executions"] == 3 and "params" not in top
+        assert validated["validation"]["status"] == "done"
+        assert not [candidate for candidate in validated["candidates"] if candidate["columns"] == ["status"]]
+        assert validated["ddl"].startswith(
+            'CREATE INDEX IF NOT EXISTS "idx_orders_user_id_created_at" ON "orders" ("user_id", "created_at");'
+        )
+        assert estimated["validation"] is None and not estimated["candidates"][0]["validated"]
+        print(f"   ✅ Индекс проверен на копии, ускорение {top['speedup']:.1f}x")
+
+
+    def test_workload_classes_weighted_fair_scheduling():
+        """Тест классов нагрузки: квоты, доли по весам, отказ при переполнении очереди"""
+        print("\n🧪 Тест: классы нагрузки")
+        from fastapi import HTTPException
+        from aetherquery_server import WorkloadClassConfig, WorkloadScheduler
+
+        scheduler = WorkloadScheduler([
+            WorkloadClassConfig(name="interactive", weight=3.0, max_concurrency=4, api_keys=["ui-key"]),
+            WorkloadClassConfig(name="background", weight=1.0, max_concurrency=1, max_queue=20,
+                                fingerprints=[aetherquery_server.query_fingerprint("SELECT * FROM report")]),
+        ], max_concurrency=1)
+
+        assert scheduler.classify(api_key="ui-key", requested="background") == "interactive"
+        assert scheduler.classify(requested="background") == "background"
+        assert scheduler.classify(query="select * from  report") == "background"
+        assert scheduler.classify(requested="unknown") == "interactive"
+
+        async def scenario():
+            order = []
+            release = asyncio.Event()
+
+            async def hold():
+                async with scheduler.slot("interactive"):
+                    await release.wait()
+
+            async def request(name):
+                async with scheduler.slot(name):
+                    order.append(name)
+                    await asyncio.sleep(0)
+
+            holder = asyncio.create_task(hold())
+            await asyncio.sleep(0)
+            waiting = [asyncio.create_task(request(name)) for name in ["background"] * 8 + ["interactive"] * 8]
+            await asyncio.sleep(0)
+            stats = scheduler.stats()["classes"]
+            release.set()
+            await asyncio.gather(holder, *waiting)
+
+            small = WorkloadScheduler([WorkloadClassConfig(name="interactive", max_concurrency=1, max_queue=1,
+                                                           queue_timeout=0.05)], max_concurrency=1)
+            statuses = []
+
+            async def blocked():
+                try:
+                    async with small.slot("interactive"):
+                        await asyncio.sleep(0.2)
+                except HTTPException as e:
+                    statuses.append((e.status_code, e.headers["Retry-After"]))
+
+            await asyncio.gather(*(blocked() for _ in range(3)))
+            return order, stats, statuses, small.stats()["classes"]["interactive"]
+
+        order, stats, statuses, small_stats = asyncio.run(scenario())
+        assert stats["background"]["queue_depth"] == 8 and stats["interactive"]["queue_depth"] == 8
+        # При конкуренции интерактивный класс получает примерно 3 слота из 4
+        assert order[:8].count("interactive") == 6
+        assert scheduler.running == 0
+        assert scheduler.stats()["classes"]["background"]["admitted"] == 8
+        assert sorted(status for status, _ in statuses) == [429, 429]
+        assert small_stats["rejected"] == 1 and small_stats["timed_out"] == 1
+
+        # Обходы, соединения и EXPLAIN ANALYZE идут через класс background
+        from fastapi.testclient import TestClient
+        state = aetherquery_server.server_state
+        previous = state.datasources
+        state.configure([DatasourceConfig(primary="sqlite:///:memory:")])
+        classes = state.scheduler.classes
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                http.post("/query", json={"query": "CREATE TABLE t (id INTEGER)"})
+                background, interactive = classes["background"].admitted, classes["interactive"].admitted
+                routed = [
+                    http.post("/scan", json={"table": "t"}),
+                    http.post("/scan", json={"table": "t", "stream": True}),
+                    http.post("/federated", json={"left": {"table": "t"}, "right": {"table": "t"}, "on": {"id": "id"}}),
+                    http.post("/explain", json={"query": "SELECT * FROM t", "analyze": True}),
+                ]
+                http.post("/explain", json={"query": "SELECT * FROM t"})
+        finally:
+            state.datasources = previous
+        assert all(response.status_code == 200 for response in routed)
+        assert classes["background"].admitted - background == 4
+        assert classes["interactive"].admitted - interactive == 1 and state.scheduler.running == 0
+        print(f"   ✅ Порядок выдачи слотов: {''.join(name[0] for name in order)}")
+
+
+    def test_adaptive_concurrency_limit():
+        """Тест адаптивного предела параллельности и размера пула читателей"""
+        print("\n🧪 Тест: адаптивный предел параллельности")
+        from aetherquery_server import ConcurrencyLimiter, Datasource, DatasourceConfig
+
+        async def load(limiter, latency, rounds):
+            async def request():
+                async with limiter.acquire():
+                    await asyncio.sleep(latency)
+
+            for _ in range(rounds):
+                await asyncio.gather(*(request() for _ in range(limiter.limit * 2)))
+
+        resized = []
+        gradient = ConcurrencyLimiter("gradient", limit=4, max_limit=32, window=0.005,
+                                      on_change=resized.append)
+        aimd = ConcurrencyLimiter("aimd", limit=4, max_limit=32, window=0.005)
+
+        async def scenario():
+            for limiter in (gradient, aimd):
+                await load(limiter, 0.01, 6)
+                grown = limiter.limit
+                await load(limiter, 0.06, 4)
+                yield limiter, grown
+
+        async def collect():
+            return [item async for item in scenario()]
+
+        for limiter, grown in asyncio.run(collect()):
+            stats = limiter.stats()
+            # Задержка стабильна - предел растёт, задержка выросла в разы - падает
+            assert grown > 4, stats
+            assert limiter.limit < grown, stats
+            assert stats["increases"] and stats["decreases"] and stats["in_flight"] == 0
+            assert stats["decisions"][-1]["reason"] == "latency"
+        assert resized and resized[-1] == gradient.limit
+
+        # Без нагрузки предел не меняется: задержка одиночных запросов не говорит о ёмкости
+        idle = ConcurrencyLimiter("aimd", limit=8, window=0.0)
+
+        async def sequential():
+            for i in range(40):
+                async with idle.acquire():
+                    # Колебания задержки в разы, как от планировщика ОС
+                    await asyncio.sleep(0.02 if i % 7 == 6 else 0.001)
+
+        asyncio.run(sequential())
+        assert idle.limit == 8 and idle.increases == 0 and idle.decreases == 0
+
+        async def pool():
+            datasource = Datasource(DatasourceConfig(primary="sqlite:///:memory:?readers=2",
+                                                     concurrency_limit="aimd", max_concurrency=8))
+            backend = datasource.primary.backend
+            await datasource.execute("CREATE TABLE t (id INTEGER)")
+            await datasource.execute("SELECT * FROM t")
+            backend.resize(5)
+            grown = backend._pool.qsize()
+            # Уменьшение при занятом соединении: оно закрывается после возврата
+            leased = backend._pool.get()
+            backend.resize(1)
+            before_return = backend._pool.qsize()
+            backend._pool.put(leased)
+            rows, _ = await datasource.execute("SELECT count(*) AS n FROM t")
+            stats = datasource.stats()[backend.name]
+            await datasource.close()
+            return grown, before_return, backend._surplus, rows, stats
+
+        grown, before_return, surplus, rows, stats = asyncio.run(pool())
+        assert grown == 5 and before_return == 0 and surplus == 0 and rows == [{"n": 0}]
+        assert stats["concurrency"]["algorithm"] == "aimd" and stats["concurrency"]["max_limit"] == 8
+        print(f"   ✅ Предел gradient: {gradient.limit}, aimd: {aimd.limit}, лишних соединений: {surplus}")
+
+
+    def test_tenant_quotas_by_api_key():
+        """Тест квот арендаторов: корзина токенов, соединения источника и одновременные запросы"""
+        print("\n🧪 Тест: квоты арендаторов")
+        from fastapi import HTTPException
+        from fastapi.testclient import TestClient
+        from aetherquery_server import TenantLimits, TenantQuotaConfig
+
+        state = aetherquery_server.server_state
+        previous = state.datasources
+        state.configure([DatasourceConfig(primary="sqlite:///:memory:")])
+        state.tenants.configure([
+            TenantQuotaConfig(api_key="noisy", name="noisy", rate=2.0, burst=2),
+            TenantQuotaConfig(api_key="bulk", name="bulk", max_connections=1),
+        ])
+        noisy = {"Authorization": "Bearer noisy"}
+        bulk = {"Authorization": "Bearer bulk"}
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                http.post("/query", json={"query": "CREATE TABLE t (id INTEGER)"})
+                statuses = [http.post("/query", json={"query": "SELECT 1"}, headers=noisy) for _ in range(3)]
+                quiet = [http.post("/query", json={"query": "SELECT 1"}, headers={"Authorization": "Bearer quiet"})
+                         for _ in range(5)]
+
+                session_id = http.post("/session", headers=bulk).json()["session_id"]
+                blocked = http.post("/query", json={"query": "SELECT * FROM t"}, headers=bulk)
+                # Обходные маршруты к бэкенду подчиняются тем же квотам
+                scan_blocked = http.post("/scan", json={"table": "t"}, headers=bulk)
+                join_blocked = http.post("/federated", json={"left": {"table": "t"}, "right": {"table": "t"},
+                                                             "on": {"id": "id"}}, headers=bulk)
+                explain_blocked = http.post("/explain", json={"query": "SELECT * FROM t"}, headers=bulk)
+                second_session = http.post("/session", headers=bulk)
+                inside = http.post("/query", json={"query": "INSERT INTO t VALUES (1)"},
+                                   headers={**bulk, "X-Session-Id": session_id})
+                http.post(f"/session/{session_id}/commit")
+                after = http.post("/query", json={"query": "SELECT * FROM t"}, headers=bulk)
+                scanned = http.post("/scan", json={"table": "t", "stream": True}, headers=bulk)
+                tenants = http.get("/stats").json()["tenants"]
+        finally:
+            state.datasources = previous
+            state.tenants.configure([])
+
+        assert [response.status_code for response in statuses] == [200, 200, 429]
+        assert statuses[2].headers["X-Quota-Exceeded"] == "rate" and int(statuses[2].headers["Retry-After"]) >= 1
+        assert all(response.status_code == 200 for response in quiet)
+        assert blocked.status_code == 429 and blocked.headers["X-Quota-Exceeded"] == "connections"
+        assert second_session.status_code == 429
+        for response in (scan_blocked, join_blocked, explain_blocked):
+            assert response.status_code == 429 and response.headers["X-Quota-Exceeded"] == "connections"
+        assert scanned.status_code == 200 and json.loads(scanned.text.splitlines()[0]) == {"id": 1}
+        assert inside.status_code == 200 and after.json()["data"] == [{"id": 1}]
+        assert tenants["noisy"]["rejected"]["rate"] == 1 and tenants["noisy"]["queries"] == 2
+        assert tenants["bulk"]["rejected"]["connections"] == 5 and tenants["bulk"]["sessions"] == 1
+        assert tenants["bulk"]["connections"] == {} and tenants["bulk"]["rows"] == 2
+        # Ключи без явной квоты видны в статистике только по хэшу
+        assert "quiet" not in json.dumps(tenants) and any(name.startswith("key-") for name in tenants)
+
+        limits = TenantLimits([TenantQuotaConfig(max_concurrent_queries=1)])
+
+        async def concurrent():
+            async with limits.query("a", "default"):
+                try:
+                    async with limits.query("a", "default"):
+                        pass
+                except HTTPException as e:
+                    rejected = e
+                async with limits.query("b", "default"):
+                    pass
+            return rejected
+
+        async def queued():
+            # Фоновая работа не получает 429, а дожидается освобождения квоты
+            order = []
+
+            async def background():
+                async with limits.query("a", "default", queued=True):
+                    order.append("background")
+
+            async def late(label):
+                async with limits.query("a", "default", queued=True):
+                    order.append(label)
+                    await asyncio.sleep(0.01)
+
+            async with limits.query("a", "default"):
+                waiter = asyncio.create_task(background())
+                await asyncio.sleep(0.1)
+                order.append("foreground")
+            await waiter
+            # Ожидающие обслуживаются по порядку: новый фоновый запрос не обгоняет старые
+            async with limits.query("a", "default"):
+                waiters = [asyncio.create_task(late(f"queued-{i}")) for i in range(3)]
+                await asyncio.sleep(0.01)
+                waiting = limits.tenant("a").stats()["waiting"]
+            waiters.append(asyncio.create_task(late("newcomer")))
+            await asyncio.gather(*waiters)
+            # Отменённый ожидающий уходит из очереди и не держит квоту
+            async with limits.query("a", "default"):
+                cancelled = asyncio.create_task(late("cancelled"))
+                await asyncio.sleep(0.01)
+                cancelled.cancel()
+            await asyncio.gather(cancelled, return_exceptions=True)
+            order.append(waiting)
+            return order
+
+        rejected = asyncio.run(concurrent())
+        assert rejected.status_code == 429 and rejected.headers["X-Quota-Exceeded"] == "concurrency"
+        assert asyncio.run(queued()) == ["foreground", "background", "queued-0", "queued-1", "queued-2", "newcomer", 3]
+        assert limits.tenant("a").in_flight == 0 and not limits.tenant("a").waiters
+        assert limits.tenant("b").queries == 1
+        print("   ✅ Шумный арендатор получает 429, остальные не затронуты")
+
+
+    def test_stale_while_revalidate_and_prewarm():
+        """Тест устаревших записей кэша с фоновым обновлением и прогрева частых запросов"""
+        print("\n🧪 Тест: stale-while-revalidate и прогрев кэша")
+        import time
+
+        config = dict(cache="memory://", cache_ttl=0.05, cache_ttl_jitter=0.0, cache_stale_ttl=30.0,
+                      prewarm_top=5, prewarm_margin=0.0)
+        query = "SELECT count(*) AS n FROM events WHERE kind = ?"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "swr.db")
+            state = os.path.join(tmp, "prewarm.json")
+
+            async def scenario():
+                datasource = Datasource(DatasourceConfig(primary=f"sqlite:///{path}", prewarm_state=state, **config))
+                await datasource.execute("CREATE TABLE events (kind TEXT)")
+                await datasource.execute("INSERT INTO events VALUES ('click')")
+                await datasource.execute(query, ["click"])
+                _, cached_node = await datasource.execute(query, ["click"])
+                time.sleep(0.08)
+                # Изменение в обход сервера: кэш о нём не знает
+                await datasource.primary.backend.execute("INSERT INTO events VALUES ('click')")
+                stale, stale_node = await datasource.execute(query, ["click"])
+                refreshed = await datasource.refresh(query, ["click"])
+                fresh, fresh_node = await datasource.execute(query, ["click"])
+
+                time.sleep(0.08)
+                warmed = await datasource.prewarm()
+                idle = await datasource.prewarm(now=0.0)
+                datasource.query_stats.save(state, config["prewarm_top"])
+                stats = datasource.stats()["cache"]
+                await datasource.close()
+
+                # После рестарта кэш прогревается до первого запроса
+                restarted = Datasource(DatasourceConfig(primary=f"sqlite:///{path}", prewarm_state=state, **config))
+                loaded = restarted.query_stats.load(state)
+                await restarted.prewarm()
+                _, first_node = await restarted.execute(query, ["click"])
+                await restarted.close()
+                return (cached_node, stale, stale_node, refreshed, fresh, fresh_node, warmed, idle, stats,
+                        loaded, first_node)
+
+            (cached_node, stale, stale_node, refreshed, fresh, fresh_node, warmed, idle, stats,
+             loaded, first_node) = asyncio.run(scenario())
+
+        assert cached_node is None and stale_node is None and fresh_node is None
+        assert stale == [{"n": 1}] and refreshed and fresh == [{"n": 2}]
+        assert warmed == 1 and idle == 0
+        assert stats["stale_hits"] == 1 and stats["refreshes"] == 2 and stats["prewarmed"] == 1
+        assert stats["prewarm"][0]["count"] == 4 and "params" not in stats["prewarm"][0]
+        assert loaded == 1 and first_node is None
+        print("   ✅ Устаревший результат отдан сразу и обновлён в фоне, кэш прогрет после рестарта")
+
+
+    def test_write_behind_coalesces_and_survives_restart():
+        """Тест отложенной записи: слияние, пакетный сброс, повтор после ошибки и журнал"""
+        print("\n🧪 Тест: отложенная запись")
+        from aetherquery_server import WriteBehindRule
+
+        increment = "UPDATE counters SET value = value + ? WHERE name = ?"
+        with tempfile.TemporaryDirectory() as tmp:
+            config = DatasourceConfig(
+                primary=f"sqlite:///{os.path.join(tmp, 'wb.db')}",
+                write_behind=[
+                    WriteBehindRule(fingerprint=aetherquery_server.query_fingerprint(increment),
+                                    key_params=[1], coalesce="sum", sum_params=[0]),
+                    WriteBehindRule(table="events"),
+                    WriteBehindRule(table="late"),
+                ],
+                write_behind_interval=60.0,
+                write_behind_max_rows=200,
+                write_behind_log=os.path.join(tmp, "wal", "writes.log"),
+            )
+
+            async def scenario():
+                datasource = Datasource(config)
+                buffer = datasource.write_behind
+                # Записи, отличающиеся только регистром литерала, не сливаются
+                by_name = WriteBehindRule(table="counters", key_params=[0])
+                key = lambda query: buffer._key(query, ["a"], by_name)
+                assert key("UPDATE counters SET tag = 'X' WHERE name = ?") != key("UPDATE counters SET tag = 'x' WHERE name = ?")
+                assert key("update counters  SET tag = 'X' where name = ?") == key("UPDATE counters SET tag = 'X' WHERE name = ?")
+                await datasource.execute("CREATE TABLE counters (name TEXT PRIMARY KEY, value INT)")
+                await datasource.execute("INSERT INTO counters VALUES ('a', 0), ('b', 0)")
+                await datasource.execute("CREATE TABLE events (kind TEXT)")
+                for i in range(100):
+                    await datasource.execute(increment, [1, "a" if i % 4 else "b"])
+                for _ in range(50):
+                    await datasource.execute("INSERT INTO events VALUES (?)", ["view"])
+                acknowledged, _ = await datasource.execute(increment, [5, "a"])
+                before, _ = await datasource.execute("SELECT * FROM counters ORDER BY name")
+                pending = len(buffer.pending)
+                flushed = await buffer.flush()
+                after, _ = await datasource.execute("SELECT * FROM counters ORDER BY name")
+                events, _ = await datasource.execute("SELECT count(*) AS n FROM events")
+
+                # Таблицы ещё нет: сброс не удаётся, записи остаются в буфере
+                await datasource.execute("INSERT INTO late VALUES (1)")
+                failed = await buffer.flush()
+                retained = len(buffer.pending)
+                await datasource.execute("CREATE TABLE late (id INT)")
+                await datasource.execute("INSERT INTO late VALUES (2)")
+                # Падение до сброса: буфер теряется, журнал остаётся
+                buffer.close()
+                stats = datasource.stats()["write_behind"]
+                await datasource.primary.backend.close()
+
+                restarted = Datasource(config)
+                replayed = len(restarted.write_behind.pending)
+                await restarted.write_behind.flush()
+                late, _ = await restarted.execute("SELECT id FROM late ORDER BY id")
+                segments = restarted.write_behind.stats()["log_segments"]
+                await restarted.close()
+                return (acknowledged, before, pending, flushed, after, events, failed, retained, stats,
+                        replayed, late, segments)
+
+            (acknowledged, before, pending, flushed, after, events, failed, retained, stats,
+             replayed, late, segments) = asyncio.run(scenario())
+            leftover = os.listdir(os.path.join(tmp, "wal"))
+
+        assert acknowledged == [{"rows_affected": None, "buffered": True, "coalesced": True}]
+        assert before == [{"name": "a", "value": 0}, {"name": "b", "value": 0}]
+        # 101 обновление двух счётчиков слились в две строки
+        assert pending == 52 and flushed == 52
+        assert after == [{"name": "a", "value": 80}, {"name": "b", "value": 25}] and events == [{"n": 50}]
+        assert failed == 0 and retained == 1
+        assert stats["flush_errors"] == 1 and stats["coalesced"] == 99 and stats["pending"] == 2
+        assert stats["flushes"] == 1 and stats["lag_ms"] > 0 and "no such table" in stats["last_error"]
+        assert replayed == 2 and late == [{"id": 1}, {"id": 2}]
+        assert segments == 1 and len(leftover) == 1
+        print(f"   ✅ Слито {stats['coalesced']} записей, после падения восстановлено {replayed}")
+
+
+    def test_write_behind_keeps_write_order():
+        """Тест отложенной записи: порядок разных запросов к одной строке и записи без правила в журнале"""
+        print("\n🧪 Тест: порядок отложенных записей")
+        from aetherquery_server import WriteBehindRule
+
+        upsert = "UPDATE kv SET v = ? WHERE k = ?"
+        with tempfile.TemporaryDirectory() as tmp:
+            def config(rules):
+                return DatasourceConfig(
+                    primary=f"sqlite:///{os.path.join(tmp, 'order.db')}", write_behind=rules,
+                    write_behind_interval=60.0, write_behind_log=os.path.join(tmp, "order.log"),
+                )
+
+            rules = [WriteBehindRule(fingerprint=aetherquery_server.query_fingerprint(upsert), key_params=[1]),
+                     WriteBehindRule(table="kv")]
+
+            async def scenario():
+                datasource = Datasource(config(rules))
+                await datasource.execute("CREATE TABLE kv (k INTEGER PRIMARY KEY, v INTEGER DEFAULT 0)")
+                await datasource.execute("INSERT INTO kv (k) VALUES (1)")
+                # UPDATE k=1, INSERT k=2, UPDATE k=2: второй UPDATE не может обогнать INSERT
+                await datasource.execute(upsert, [1, 1])
+                await datasource.execute("INSERT INTO kv (k) VALUES (?)", [2])
+                await datasource.execute(upsert, [1, 2])
+                # Слияние с первым UPDATE k=1 подняло бы запись выше REPLACE той же строки
+                await datasource.execute("INSERT OR REPLACE INTO kv (k, v) VALUES (?, ?)", [1, 5])
+                overtaken, _ = await datasource.execute(upsert, [7, 1])
+                merged, _ = await datasource.execute(upsert, [8, 1])
+                await datasource.write_behind.flush()
+                rows, _ = await datasource.execute("SELECT k, v FROM kv ORDER BY k")
+
+                # Записи в журнале, правило для которых убрали из конфигурации
+                await datasource.execute("INSERT INTO kv (k, v) VALUES (?, ?)", [3, 30])
+                datasource.write_behind.close()
+                await datasource.primary.backend.close()
+                restarted = Datasource(config([]))
+                replayed = len(restarted.write_behind.pending)
+                direct, _ = await restarted.execute("INSERT INTO kv (k, v) VALUES (4, 40)")
+                await restarted.write_behind.flush()
+                after, _ = await restarted.execute("SELECT k, v FROM kv WHERE k >= 3 ORDER BY k")
+                leftover = restarted.write_behind.stats()["log_segments"]
+                await restarted.close()
+                return overtaken, merged, rows, replayed, direct, after, leftover
+
+            overtaken, merged, rows, replayed, direct, after, leftover = asyncio.run(scenario())
+
+        assert overtaken[0]["coalesced"] is False and merged[0]["coalesced"] is True
+        assert rows == [{"k": 1, "v": 8}, {"k": 2, "v": 1}]
+        assert replayed == 1 and "buffered" not in direct[0]
+        assert after == [{"k": 3, "v": 30}, {"k": 4, "v": 40}] and leftover == 1
+        print("   ✅ Порядок записей сохранён, записи без правила из журнала дошли до базы")
+
+
+    class FakeRedis:
+        """Redis в памяти с курсорными итераторами; блокирующие KEYS и SMEMBERS запрещены"""
+
+        def __init__(self, data):
+            self.data = data
+            self.calls = []
+
+        def __getattr__(self, name):
+            raise AssertionError(f"unexpected Redis call: {name}")
+
+        async def scan_iter(self, match=None, count=None, _type=None):
+            import fnmatch
+            self.calls.append(("scan", match, count))
+            for key in sorted(self.data):
+                if fnmatch.fnmatchcase(key, match or "*"):
+                    yield key
+
+        async def hscan_iter(self, name, match=None, count=None):
+            self.calls.append(("hscan", name, count))
+            for item in self.data[name].items():
+                yield item
+
+        async def sscan_iter(self, name, match=None, count=None):
+            self.calls.append(("sscan", name, count))
+            for member in sorted(self.data.get(name, ())):
+                yield member
+
+        async def zscan_iter(self, name, match=None, count=None):
+            self.calls.append(("zscan", name, count))
+            for item in sorted(self.data[name].items(), key=lambda item: item[1]):
+                yield item
+
+        async def execute_command(self, *args):
+            self.calls.append(args)
+            if args[0].upper() == "SET":
+                self.data[args[1]] = args[2]
+                return "OK"
+            return self.data.get(args[1])
+
+        async def delete(self, *keys):
+            self.calls.append(("delete", len(keys)))
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+        async def aclose(self):
+            pass
+
+
+    def test_redis_scan_streaming():
+        """Тест источника Redis: KEYS и обходы коллекций через курсор, потоковая выдача, SSCAN в кэше"""
+        print("\n🧪 Тест: курсорные обходы Redis")
+        from fastapi.testclient import TestClient
+        from aetherquery_server import BackendError, RedisBackend, RedisCacheStore
+
+        data = {f"user:{i}": f"u{i}" for i in range(5)}
+        data.update({"session:1": "s", "profile": {"name": "Ann", "age": "30"}, "board": {"a": 2.0, "b": 1.0}})
+        fake = FakeRedis(data)
+        backend = RedisBackend("redis", "", scan_count=100, max_rows=3, client=fake)
+
+        async def direct():
+            batches = [batch async for batch in backend.query_batches("KEYS user:*", batch_size=2)]
+            hash_rows = await backend.execute("HSCAN ? COUNT 10", ["profile"])
+            ranked = await backend.execute("ZSCAN board")
+            value = await backend.execute("GET user:1")
+            try:
+                await backend.execute("SCAN 0 MATCH user:*")
+            except BackendError as e:
+                limited = str(e)
+            return batches, hash_rows, ranked, value, limited
+
+        batches, hash_rows, ranked, value, limited = asyncio.run(direct())
+        assert [len(batch) for batch in batches] == [2, 2, 1] and batches[0][0] == {"key": "user:0"}
+        assert fake.calls[0] == ("scan", "user:*", 100)
+        assert hash_rows == [{"field": "name", "value": "Ann"}, {"field": "age", "value": "30"}]
+        assert ("hscan", "profile", 10) in fake.calls
+        assert ranked == [{"member": "b", "score": 1.0}, {"member": "a", "score": 2.0}]
+        assert value == [{"result": "u1"}] and "stream it with batch_size" in limited
+        assert aetherquery_server.classify_statement("HSCAN profile") == "read"
+
+        # Поток через /ws: пачки уходят по мере продвижения курсора
+        state = aetherquery_server.server_state
+        previous = state.datasources
+        state.configure([DatasourceConfig(name="kv", primary="simulated://kv")])
+        state.datasources["kv"].primary.backend = backend
+        try:
+            with TestClient(aetherquery_server.app) as http:
+                with http.websocket_connect("/ws") as ws:
+                    ws.send_json({"id": "keys", "query": "SCAN MATCH user:* COUNT 2", "batch_size": 2,
+                                  "options": {"datasource": "kv"}})
+                    frames = [ws.receive_json() for _ in range(4)]
+        finally:
+            state.datasources = previous
+        assert [frame["type"] for frame in frames] == ["batch", "batch", "batch", "result"]
+        assert frames[-1]["success"] and frames[-1]["rows"] == 5
+
+        # Результаты команд Redis не кэшируются: SET сразу виден следующему GET
+        cached = Datasource(DatasourceConfig(primary="redis://localhost:6379/0", cache="memory://"))
+        cached.primary.backend = RedisBackend("redis", "", client=FakeRedis({"user:1": "u1"}))
+
+        async def through_datasource():
+            first, _ = await cached.execute("GET user:1")
+            await cached.execute("SET user:1 renamed")
+            second, node = await cached.execute("GET user:1")
+            return first, second, node
+
+        first, second, node = asyncio.run(through_datasource())
+        assert cached.cache is None and first == [{"result": "u1"}]
+        assert second == [{"result": "renamed"}] and node is not None
+
+        # Инвалидация кэша читает теги курсором и удаляет ключи пачками
+        store = RedisCacheStore("redis://localhost:6379/0")
+        tagged = FakeRedis({"aq:t:default:users": {f"aq:q:{i}" for i in range(1200)}})
+        tagged.data.update({f"aq:q:{i}": b"j" for i in range(1200)})
+        store.client = tagged
+        removed = asyncio.run(store.invalidate(["aq:t:default:users"]))
+        assert removed == 1200 and [call for call in tagged.calls if call[0] == "delete"][:3] == [
+            ("delete", 500), ("delete", 500), ("delete", 200)]
+        print(f"   ✅ KEYS выполнен через SCAN, {len(batches)} пачки, кэш сброшен по SSCAN")
+
+
+    def run_all_tests():
+        """Запуск всех тестов"""
+        print("🚀 Запуск тестов сервера AetherQuery")
+        print("=" * 50)
+
+        tests = [
+            test_classify_statement,
+            test_reads_go_to_fresh_replica,
+            test_read_your_writes_window,
+            test_parallel_scan_sqlite,
+            test_federated_hash_join_spills_to_disk,
+            test_query_cache_invalidated_by_writes,
+            test_query_cache_key_keeps_literals,
+            test_metadata_cache_invalidated_by_ddl,
+            test_sqlite_tuned_profile,
+            test_transaction_sessions,
+            test_websocket_channel_multiplexing,
+            test_unix_socket_shared_memory_transport,
+            test_background_jobs,
+            test_export_partitioned_csv,
+            test_bulk_import_csv,
+            test_change_feed_invalidates_caches,
+            test_server_timing_phases,
+            test_debug_profile_and_allocations,
+            test_lazy_backend_registry,
+            test_explain_and_slow_query_plans,
+            test_index_advisor_validates_on_scratch_copy,
+            test_workload_classes_weighted_fair_scheduling,
+            test_adaptive_concurrency_limit,
+            test_tenant_quotas_by_api_key,
+            test_stale_while_revalidate_and_prewarm,
+            test_write_behind_coalesces_and_survives_restart,
+            test_write_behind_keeps_write_order,
+            test_redis_scan_streaming,
+        ]
+
+        passed = 0
+        failed = 0
+
+        for test_func in tests:
+            try:
+                test_func()
+                passed += 1
+            except Exception as e:
+                failed += 1
+                print(f"   ❌ Тест {test_func.__name__} упал: {e}")
+
+        print("\n" + "=" * 50)
+        print(f"📊 Результаты:")
+        print(f"   ✅ Успешно: {passed}")
+        print(f"   ❌ Провалено: {failed}")
+        print(f"   📈 Всего: {passed + failed}")
+
+        return failed == 0
+
+else:
+
+    def run_all_tests():
+        print("❌ Тесты не могут быть запущены из-за ошибки импорта")
+        return False
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)